@@ -0,0 +1,352 @@
+import random
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from models import db, ParkingLot, ParkingSpot, Reservation, Payment, SPOT_TYPES
+from analytics import record_usage
+from shards import fan_out, shard_names
+
+
+class ReservationError(Exception):
+    """A reservation request that cannot be fulfilled; the message is shown to the user"""
+
+
+class LotFullError(ReservationError):
+    pass
+
+
+class DuplicateVehicleError(ReservationError):
+    pass
+
+
+class AlreadyReleasedError(ReservationError):
+    pass
+
+
+def active_on_other_shards(vehicle_numbers):
+    """Those of vehicle_numbers with an active reservation on a shard other than the current session's.
+
+    A vehicle holds one active reservation across all regions, but each
+    shard only sees its own reservations, so the others are asked as well.
+    """
+    current = db.session.info.get('shard')
+    others = [shard for shard in shard_names() if shard != current]
+    if not others:
+        return set()
+    found = fan_out(lambda: db.session.scalars(db.select(Reservation.vehicle_number).where(
+        Reservation.vehicle_number.in_(vehicle_numbers), Reservation.payment_status == 'Pending')).all(),
+        shards=others)
+    return set().union(*found)
+
+
+def claim_spot(lot_id, spot_type=None):
+    """Atomically mark the lowest-numbered free spot in the lot occupied.
+
+    With spot_type, only spots of that type are considered. Either way the
+    candidate is the first entry of a (lot, status[, type]) index range, so
+    finding it costs the same however full the lot is.
+    The UPDATE only succeeds while the spot is still 'A', so two requests can
+    never claim the same spot; the loser tries the next free one for as long
+    as there is one. Each lost race means another request took a spot, so
+    this ends once the lot is full.
+    Returns (spot_id, spot_number), or None when no matching spot is free.
+    """
+    free = [ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A']
+    if spot_type is not None:
+        free.append(ParkingSpot.spot_type == spot_type)
+    while True:
+        candidate = db.select(ParkingSpot.spot_id).where(*free) \
+            .order_by(ParkingSpot.spot_id).limit(1).scalar_subquery()
+        claimed = db.session.execute(
+            db.update(ParkingSpot)
+            .where(ParkingSpot.spot_id == candidate, ParkingSpot.status == 'A')
+            .values(status='O')
+            .returning(ParkingSpot.spot_id, ParkingSpot.spot_number)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if claimed:
+            ParkingLot.adjust_counts(lot_id, available=-1, occupied=1)
+            return claimed
+        if not db.session.query(db.exists().where(*free)).scalar():
+            return None
+
+
+def create_reservation(lot, user_id, vehicle_number, parking_timestamp, spot_type=None, attempts=5):
+    """Claim a spot in lot for the vehicle and commit the reservation.
+
+    spot_type asks for a spot of that type only. Without it a Standard spot
+    is taken when one is free, so EV and Accessible bays are only handed out
+    to untyped requests once the Standard spots have run out.
+
+    Retries the whole transaction when SQLite reports the database as locked
+    by a concurrent writer. Raises a ReservationError subclass when the
+    vehicle already has an active reservation or the lot is full.
+    Returns (reservation, spot_number).
+    """
+    if spot_type is not None and spot_type not in SPOT_TYPES:
+        raise ReservationError(f'Unknown spot type: {spot_type}')
+    lot_id, price = lot.lot_id, lot.price
+
+    def reserve():
+        existing = Reservation.query.filter_by(vehicle_number=vehicle_number, payment_status='Pending').first()
+        if existing or active_on_other_shards([vehicle_number]):
+            raise DuplicateVehicleError('An active reservation already exists for this vehicle number.')
+
+        if spot_type is None:
+            claimed = claim_spot(lot_id, 'Standard') or claim_spot(lot_id)
+            if claimed is None:
+                raise LotFullError('No spots are available in this lot right now.')
+        else:
+            claimed = claim_spot(lot_id, spot_type)
+            if claimed is None:
+                raise LotFullError(f'No {spot_type} spots are available in this lot right now.')
+
+        reservation = Reservation(
+            spot_id=claimed.spot_id,
+            user_id=user_id,
+            parking_cost_per_time=price,
+            vehicle_number=vehicle_number,
+            reservation_timestamp=datetime.now(),
+            parking_timestamp=parking_timestamp
+        )
+        db.session.add(reservation)
+        db.session.commit()
+        return reservation, claimed.spot_number
+    return _retry_when_locked(reserve, attempts)
+
+
+def _retry_when_locked(transaction, attempts):
+    """Run transaction(), rolling back and retrying it when SQLite reports the database as locked.
+
+    A ReservationError rolls back and propagates at once.
+    """
+    for attempt in range(attempts):
+        try:
+            return transaction()
+        except ReservationError:
+            db.session.rollback()
+            raise
+        except OperationalError as e:
+            db.session.rollback()
+            if 'locked' not in str(e.orig) or attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0.005, 0.05) * (attempt + 1))
+
+
+def release_reservation(reservation):
+    """Free the reservation's spot, charge for the time parked and commit.
+
+    The reservation is closed with an UPDATE that only matches while it is
+    still Pending, so a release submitted twice charges once; the second
+    raises AlreadyReleasedError. Returns the Payment.
+    """
+    left_at = datetime.utcnow()
+    closed = db.session.execute(
+        db.update(Reservation)
+        .where(Reservation.reservation_id == reservation.reservation_id, Reservation.payment_status == 'Pending')
+        .values(payment_status='Paid', leaving_timestamp=left_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not closed:
+        db.session.rollback()
+        raise AlreadyReleasedError('This reservation has already been paid.')
+
+    freed = db.session.execute(
+        db.update(ParkingSpot)
+        .where(ParkingSpot.spot_id == reservation.spot_id, ParkingSpot.status == 'O')
+        .values(status='A')
+        .returning(ParkingSpot.lot_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if freed:
+        ParkingLot.adjust_counts(freed.lot_id, available=1, occupied=-1)
+
+    hours = max(1, (left_at - reservation.parking_timestamp).total_seconds() / 3600)
+    payment = Payment(
+        reservation_id=reservation.reservation_id,
+        amount=round(hours * reservation.parking_cost_per_time, 2),
+        payment_method='Cash',
+        payment_status='Completed',
+        payment_timestamp=datetime.now()
+    )
+    db.session.add(payment)
+    db.session.flush()
+    record_usage([payment.payment_id])
+    db.session.commit()
+    return payment
+
+
+def claim_spots(lot_id, count, spot_type=None, attempts=5):
+    """Atomically mark up to count free spots in the lot occupied, lowest-numbered first.
+
+    Each round claims all the spots still needed with one UPDATE; spots
+    taken by a concurrent writer in the meantime are simply not returned,
+    and the next round looks for replacements.
+    Returns [(spot_id, spot_number)] in spot order, shorter than count when
+    the lot runs out.
+    """
+    free = [ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A']
+    if spot_type is not None:
+        free.append(ParkingSpot.spot_type == spot_type)
+    claimed = []
+    for _ in range(attempts):
+        wanted = count - len(claimed)
+        if wanted <= 0:
+            break
+        candidates = db.select(ParkingSpot.spot_id).where(*free).order_by(ParkingSpot.spot_id).limit(wanted)
+        rows = db.session.execute(
+            db.update(ParkingSpot)
+            .where(ParkingSpot.spot_id.in_(candidates), ParkingSpot.status == 'A')
+            .values(status='O')
+            .returning(ParkingSpot.spot_id, ParkingSpot.spot_number)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if not rows:
+            break
+        claimed.extend(rows)
+    if claimed:
+        ParkingLot.adjust_counts(lot_id, available=-len(claimed), occupied=len(claimed))
+    return sorted(claimed)
+
+
+def create_reservations(lot, user_id, vehicle_numbers, parking_timestamp, spot_type=None, attempts=5):
+    """Reserve a spot in lot for each vehicle, all in one transaction.
+
+    Vehicles listed twice, or that already have an active reservation
+    (found with a single query per shard), are rejected; the rest get the
+    lowest-numbered free spots of spot_type (Standard first, then any, when
+    None) for as long as the lot has them. Returns one result per vehicle
+    number, in the order given: {'vehicle_number', 'reservation_id',
+    'spot_number'} when reserved, {'vehicle_number', 'error'} otherwise.
+    """
+    if spot_type is not None and spot_type not in SPOT_TYPES:
+        raise ReservationError(f'Unknown spot type: {spot_type}')
+    lot_id, price = lot.lot_id, lot.price
+
+    def reserve():
+        results, wanted = [], {}
+        for vehicle_number in vehicle_numbers:
+            if vehicle_number in wanted:
+                results.append({'vehicle_number': vehicle_number, 'error': 'Vehicle listed more than once.'})
+            else:
+                results.append({'vehicle_number': vehicle_number})
+                wanted[vehicle_number] = None  # Keeps the request order
+
+        active = set(db.session.scalars(db.select(Reservation.vehicle_number).where(
+            Reservation.vehicle_number.in_(list(wanted)), Reservation.payment_status == 'Pending')))
+        active |= active_on_other_shards(list(wanted))
+        wanted = [vehicle_number for vehicle_number in wanted if vehicle_number not in active]
+
+        if spot_type is None:
+            spots = claim_spots(lot_id, len(wanted), 'Standard')
+            spots += claim_spots(lot_id, len(wanted) - len(spots))
+        else:
+            spots = claim_spots(lot_id, len(wanted), spot_type)
+
+        now = datetime.now()
+        reserved = {}
+        if spots:
+            assigned = dict(zip(wanted, spots))
+            rows = db.session.execute(
+                db.insert(Reservation).returning(Reservation.reservation_id, Reservation.vehicle_number),
+                [{
+                    'spot_id': spot.spot_id,
+                    'user_id': user_id,
+                    'parking_cost_per_time': price,
+                    'vehicle_number': vehicle_number,
+                    'reservation_timestamp': now,
+                    'parking_timestamp': parking_timestamp,
+                    'payment_status': 'Pending',
+                } for vehicle_number, spot in assigned.items()]
+            ).all()
+            reserved = {row.vehicle_number: (row.reservation_id, assigned[row.vehicle_number].spot_number)
+                        for row in rows}
+        db.session.commit()
+
+        full = f'No {spot_type} spots are available in this lot right now.' if spot_type \
+            else 'No spots are available in this lot right now.'
+        for result in results:
+            vehicle_number = result['vehicle_number']
+            if 'error' in result:
+                continue
+            if vehicle_number in active:
+                result['error'] = 'An active reservation already exists for this vehicle number.'
+            elif vehicle_number in reserved:
+                result['reservation_id'], result['spot_number'] = reserved[vehicle_number]
+            else:
+                result['error'] = full
+        return results
+    return _retry_when_locked(reserve, attempts)
+
+
+def release_reservations(user_id, reservation_ids, attempts=5):
+    """Release several of a user's reservations and charge for them in one transaction.
+
+    Reservations are closed, their spots freed and the lot counters moved
+    with one UPDATE each, and the payments go in as one bulk INSERT.
+    Returns one result per id, in the order given: {'reservation_id',
+    'amount'} when released, {'reservation_id', 'error'} otherwise.
+    """
+    def release():
+        left_at = datetime.utcnow()
+        closed = db.session.execute(
+            db.update(Reservation)
+            .where(Reservation.reservation_id.in_(reservation_ids),
+                   Reservation.user_id == user_id,
+                   Reservation.payment_status == 'Pending')
+            .values(payment_status='Paid', leaving_timestamp=left_at)
+            .returning(Reservation.reservation_id, Reservation.spot_id,
+                       Reservation.parking_timestamp, Reservation.parking_cost_per_time)
+            .execution_options(synchronize_session=False)
+        ).all()
+
+        amounts = {}
+        if closed:
+            freed = db.session.execute(
+                db.update(ParkingSpot)
+                .where(ParkingSpot.spot_id.in_([row.spot_id for row in closed]), ParkingSpot.status == 'O')
+                .values(status='A')
+                .returning(ParkingSpot.lot_id)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+            for lot_id, n in Counter(freed).items():
+                ParkingLot.adjust_counts(lot_id, available=n, occupied=-n)
+
+            paid_at = datetime.now()
+            payments = []
+            for row in closed:
+                hours = max(1, (left_at - row.parking_timestamp).total_seconds() / 3600)
+                amounts[row.reservation_id] = round(hours * row.parking_cost_per_time, 2)
+                payments.append({
+                    'reservation_id': row.reservation_id,
+                    'amount': amounts[row.reservation_id],
+                    'payment_method': 'Cash',
+                    'payment_status': 'Completed',
+                    'payment_timestamp': paid_at,
+                })
+            payment_ids = db.session.execute(db.insert(Payment).returning(Payment.payment_id), payments).scalars().all()
+            record_usage(payment_ids)
+
+        # Tell "already paid" apart from "not yours or no such reservation"
+        others = [rid for rid in reservation_ids if rid not in amounts]
+        owned = set(db.session.scalars(db.select(Reservation.reservation_id).where(
+            Reservation.reservation_id.in_(others), Reservation.user_id == user_id))) if others else set()
+        db.session.commit()
+
+        results, seen = [], set()
+        for reservation_id in reservation_ids:
+            if reservation_id in seen:
+                results.append({'reservation_id': reservation_id, 'error': 'Reservation listed more than once.'})
+                continue
+            seen.add(reservation_id)
+            if reservation_id in amounts:
+                results.append({'reservation_id': reservation_id, 'amount': amounts[reservation_id]})
+            elif reservation_id in owned:
+                results.append({'reservation_id': reservation_id, 'error': 'This reservation has already been paid.'})
+            else:
+                results.append({'reservation_id': reservation_id, 'error': 'Reservation not found'})
+        return results
+    return _retry_when_locked(release, attempts)
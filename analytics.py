@@ -0,0 +1,222 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from archive import STORES
+from models import (db, ParkingLot, ParkingSpot, Reservation, Payment,
+                    LotUsageHourly, LotUsageDaily, LotStayHistogram, STAY_BUCKETS)
+from shards import fan_out, shard_for_id
+
+ROLLUP_BATCH_SIZE = 5000
+
+
+def _payment_rows(conn, *conditions, limit=None, store=(Reservation, Payment)):
+    """(payment_id, lot_id, paid at, amount, parked at, left at) of the matching payments in store"""
+    R, P = store
+    return conn.execute(
+        db.select(
+            P.payment_id,
+            ParkingSpot.lot_id,
+            P.payment_timestamp,
+            P.amount,
+            R.parking_timestamp,
+            R.leaving_timestamp,
+        )
+        .join(R, P.reservation_id == R.reservation_id)
+        .join(ParkingSpot, R.spot_id == ParkingSpot.spot_id)
+        .where(*conditions)
+        .order_by(P.payment_id)
+        .limit(limit)
+    ).all()
+
+
+def _aggregate(rows):
+    """Sum payment rows into hourly, daily and stay-histogram rollup rows"""
+    hourly = defaultdict(lambda: [0, 0.0, 0.0])
+    daily = defaultdict(lambda: [0, 0.0, 0.0])
+    stays = defaultdict(int)
+    for _, lot_id, paid_at, amount, parked_at, left_at in rows:
+        minutes = 0.0
+        if parked_at and left_at:
+            minutes = max(0.0, (left_at - parked_at).total_seconds() / 60)
+        for totals in (hourly[lot_id, paid_at.replace(minute=0, second=0, microsecond=0)],
+                       daily[lot_id, paid_at.date()]):
+            totals[0] += 1
+            totals[1] += amount
+            totals[2] += minutes
+        stays[lot_id, paid_at.date(), bisect_right(STAY_BUCKETS, minutes)] += 1
+
+    def counters(totals):
+        return {'reservations': totals[0], 'revenue': totals[1], 'stay_minutes': totals[2]}
+    return (
+        [{'lot_id': lot_id, 'hour': hour, **counters(t)} for (lot_id, hour), t in hourly.items()],
+        [{'lot_id': lot_id, 'day': day, **counters(t)} for (lot_id, day), t in daily.items()],
+        [{'lot_id': lot_id, 'day': day, 'bucket': bucket, 'reservations': n}
+         for (lot_id, day, bucket), n in stays.items()],
+    )
+
+
+def _add_rows(conn, model, keys, rows):
+    """Insert rollup rows, adding their counters to any row already present for the same key"""
+    if not rows:
+        return
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: getattr(model, name) + stmt.excluded[name] for name in rows[0] if name not in keys},
+    )
+    conn.execute(stmt, rows)
+
+
+def _add_to_rollups(conn, rows):
+    hourly, daily, stays = _aggregate(rows)
+    _add_rows(conn, LotUsageHourly, ['lot_id', 'hour'], hourly)
+    _add_rows(conn, LotUsageDaily, ['lot_id', 'day'], daily)
+    _add_rows(conn, LotStayHistogram, ['lot_id', 'day', 'bucket'], stays)
+
+
+def record_usage(payment_ids, conn=None):
+    """Add newly recorded payments to the rollups.
+
+    Call in the transaction that inserts the payments, exactly once per
+    payment, so the rollups commit or roll back together with them.
+    """
+    conn = conn or db.session
+    _add_to_rollups(conn, _payment_rows(conn, Payment.payment_id.in_(list(payment_ids))))
+
+
+def rebuild_usage_rollups(batch_size=ROLLUP_BATCH_SIZE, conn=None):
+    """Recompute every rollup from the live and archived payments; returns the number of payments read"""
+    conn = conn or db.session
+    for model in (LotUsageHourly, LotUsageDaily, LotStayHistogram):
+        conn.execute(db.delete(model))
+    total = 0
+    for store in STORES:
+        after = 0
+        while True:
+            rows = _payment_rows(conn, store[1].payment_id > after, limit=batch_size, store=store)
+            if not rows:
+                break
+            _add_to_rollups(conn, rows)
+            total += len(rows)
+            after = rows[-1].payment_id
+    return total
+
+
+def _bucket_label(i):
+    low = STAY_BUCKETS[i - 1] if i else 0
+    return f'{low}-{STAY_BUCKETS[i]} min' if i < len(STAY_BUCKETS) else f'{low}+ min'
+
+
+def _usage_rows(start, end, lot_id):
+    """(days, lots, hours, buckets) rollup rows of the current shard"""
+    day_after = end + timedelta(days=1)
+
+    def in_range(model, column, low, high):
+        conditions = [column >= low, column < high]
+        if lot_id is not None:
+            conditions.append(model.lot_id == lot_id)
+        return conditions
+
+    D = LotUsageDaily
+    days = db.session.query(D.day, db.func.sum(D.reservations), db.func.sum(D.revenue)) \
+        .filter(*in_range(D, D.day, start, day_after)).group_by(D.day).all()
+    lots = db.session.query(
+        D.lot_id, ParkingLot.prime_location_name,
+        db.func.sum(D.reservations), db.func.sum(D.revenue), db.func.sum(D.stay_minutes),
+    ).outerjoin(ParkingLot, ParkingLot.lot_id == D.lot_id) \
+     .filter(*in_range(D, D.day, start, day_after)) \
+     .group_by(D.lot_id, ParkingLot.prime_location_name).order_by(D.lot_id).all()
+
+    H = LotUsageHourly
+    hour_of_day = db.extract('hour', H.hour)
+    hours = db.session.query(hour_of_day, db.func.sum(H.reservations)) \
+        .filter(*in_range(H, H.hour, datetime.combine(start, time.min), datetime.combine(day_after, time.min))) \
+        .group_by(hour_of_day).all()
+
+    S = LotStayHistogram
+    buckets = db.session.query(S.bucket, db.func.sum(S.reservations)) \
+        .filter(*in_range(S, S.day, start, day_after)).group_by(S.bucket).all()
+    return days, lots, hours, buckets
+
+
+def usage_report(start, end, lot_id=None):
+    """Revenue, stay and peak-hour analytics for the days start..end (inclusive) from the rollups.
+
+    Every query reads pre-aggregated rows and returns at most one row per
+    day, lot, hour or bucket, so a year of data costs the same as a week.
+    The shards are queried at once (only the lot's shard with lot_id) and
+    their rows added together.
+    """
+    import numpy as np
+
+    shards = None if lot_id is None else [shard_for_id(lot_id)]
+    days, lots, hours, buckets = [], [], [], []
+    for shard_days, shard_lots, shard_hours, shard_buckets in fan_out(_usage_rows, start, end, lot_id, shards=shards):
+        days += shard_days
+        lots += shard_lots
+        hours += shard_hours
+        buckets += shard_buckets
+    lots.sort(key=lambda row: row[0])
+
+    # Dense per-day series, so days without payments count as zero revenue
+    n_days = (end - start).days + 1
+    daily_reservations = np.zeros(n_days, dtype=np.int64)
+    daily_revenue = np.zeros(n_days)
+    if days:
+        # Several shards can have a row for the same day, so add rather than assign
+        index = np.array([(day - start).days for day, _, _ in days])
+        np.add.at(daily_reservations, index, [n for _, n, _ in days])
+        np.add.at(daily_revenue, index, [revenue for _, _, revenue in days])
+
+    by_hour = np.zeros(24, dtype=np.int64)
+    for hour, n in hours:
+        by_hour[int(hour)] += n
+
+    stay_counts = np.zeros(len(STAY_BUCKETS) + 1, dtype=np.int64)
+    for bucket, n in buckets:
+        stay_counts[bucket] += n
+    # Interpolate percentiles inside the histogram; the open-ended last bucket
+    # is treated as ending at twice the last edge
+    edges = np.array((0, *STAY_BUCKETS, 2 * STAY_BUCKETS[-1]), dtype=float)
+    cumulative = np.concatenate(([0], np.cumsum(stay_counts)))
+    percentiles = np.array([50, 90, 99])
+    stay_percentiles = np.interp(percentiles / 100 * cumulative[-1], cumulative, edges) \
+        if cumulative[-1] else np.zeros(len(percentiles))
+
+    total_reservations = int(daily_reservations.sum())
+    total_stay = sum(stay or 0 for *_, stay in lots)
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'lot_id': lot_id,
+        'totals': {
+            'reservations': total_reservations,
+            'revenue': round(float(daily_revenue.sum()), 2),
+            'average_stay_minutes': round(total_stay / total_reservations, 1) if total_reservations else None,
+        },
+        'daily': [
+            {'day': (start + timedelta(days=i)).isoformat(),
+             'reservations': int(daily_reservations[i]), 'revenue': round(float(daily_revenue[i]), 2)}
+            for i in range(n_days)
+        ],
+        'daily_revenue_percentiles': {
+            f'p{p}': round(float(v), 2) for p, v in zip(percentiles, np.percentile(daily_revenue, percentiles))
+        },
+        'lots': [
+            {'lot_id': lot, 'name': name, 'reservations': n, 'revenue': round(revenue, 2),
+             'average_stay_minutes': round(stay / n, 1) if n else None}
+            for lot, name, n, revenue, stay in lots
+        ],
+        'reservations_by_hour': by_hour.tolist(),
+        'busiest_hour': int(by_hour.argmax()) if by_hour.any() else None,
+        'stay_histogram': [
+            {'bucket': _bucket_label(i), 'reservations': int(n)} for i, n in enumerate(stay_counts)
+        ],
+        'stay_percentiles_minutes': {
+            f'p{p}': round(float(v), 1) for p, v in zip(percentiles, stay_percentiles)
+        },
+    }
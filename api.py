@@ -0,0 +1,413 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from flask import Blueprint, current_app, jsonify, make_response, request
+from flask_login import current_user, login_user, logout_user
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
+from werkzeug.http import is_resource_modified
+
+from allocation import (create_reservation, release_reservation, create_reservations, release_reservations,
+                        ReservationError, AlreadyReleasedError, DuplicateVehicleError, LotFullError)
+from models import db, User_Admin, Reservation, ParkingLot, ParkingSpot
+from archive import user_reservation_page
+from pagination import (keyset_select, timestamp_cursor, parse_timestamp_cursor, encode_cursor, decode_cursor,
+                        prefix_filter, PER_PAGE)
+from passwords import HashingBusyError
+from shards import fan_out, group_by_shard, shard_for_id, use_shard
+
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+MAX_BATCH_SIZE = 200
+
+
+def error(message, status):
+    return jsonify({'error': message}), status
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting to the login page"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return error('Authentication required', 401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def conditional(etag, last_modified, render):
+    """A JSON response of render(), or an empty 304 when the client's validators still match.
+
+    render is only called when the client's copy is stale, so an unchanged
+    resource costs no more than the query that produced its validators.
+    """
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = jsonify(render())
+    else:
+        response = make_response('', 304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # Always revalidate; unchanged lots come back as 304
+    return response
+
+
+def lot_json(lot):
+    return {
+        'lot_id': lot.lot_id,
+        'name': lot.prime_location_name,
+        'address': lot.address,
+        'pincode': lot.pincode,
+        'price_per_hour': lot.price,
+        'capacity': lot.capacity,
+        'available': lot.available,
+        'occupied': lot.occupied,
+        'is_active': lot.is_active,
+        'version': lot.version,
+    }
+
+
+def reservation_json(reservation):
+    spot = reservation.spot
+    return {
+        'reservation_id': reservation.reservation_id,
+        'lot_id': spot.lot_id if spot else None,
+        'lot_name': spot.lot.prime_location_name if spot and spot.lot else None,
+        'spot_number': spot.spot_number if spot else None,
+        'spot_type': spot.spot_type if spot else None,
+        'vehicle_number': reservation.vehicle_number,
+        'reserved_at': reservation.reservation_timestamp.isoformat() if reservation.reservation_timestamp else None,
+        'parked_at': reservation.parking_timestamp.isoformat() if reservation.parking_timestamp else None,
+        'left_at': reservation.leaving_timestamp.isoformat() if reservation.leaving_timestamp else None,
+        'price_per_hour': reservation.parking_cost_per_time,
+        'status': reservation.payment_status,
+        'amount': reservation.payment.amount if reservation.payment else None,
+    }
+
+
+def spot_json(spot, reservation=None, user=None):
+    return {
+        'spot_id': spot.spot_id,
+        'spot_number': spot.spot_number,
+        'spot_type': spot.spot_type,
+        'status': spot.status,
+        'reservation_id': reservation.reservation_id if reservation else None,
+        'vehicle_number': reservation.vehicle_number if reservation else None,
+        'user_id': reservation.user_id if reservation else None,
+        'username': user.username if user else None,
+    }
+
+
+def user_json(user, reservation=None):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'role': user.role,
+        'active_reservation_id': reservation.reservation_id if reservation else None,
+        'active_spot_number': reservation.spot.spot_number if reservation and reservation.spot else None,
+    }
+
+
+# The statements below are shared with the async read paths in asgi.py, which
+# run them on an AsyncSession per shard instead of db.session
+
+ACTIVE_LOT_VERSIONS = db.select(ParkingLot.lot_id, ParkingLot.created_at, ParkingLot.version,
+                                ParkingLot.updated_at).where(ParkingLot.is_active == True)
+
+ACTIVE_LOTS = db.select(ParkingLot).where(ParkingLot.is_active == True)
+
+
+def lot_version_select(lot_id):
+    return db.select(ParkingLot.created_at, ParkingLot.version, ParkingLot.updated_at) \
+        .where(ParkingLot.lot_id == lot_id)
+
+
+def lot_tag(lot_id, created_at, version):
+    """ETag part of one lot; created_at keeps it from matching an older lot that had the same id"""
+    return f'{lot_id}-{created_at:%Y%m%d%H%M%S%f}-v{version}' if created_at else f'{lot_id}-v{version}'
+
+
+def lot_validators(lot_id):
+    """(ETag, Last-Modified) of one lot from its version columns, or None if there is no such lot"""
+    return row_validators(lot_id, db.session.execute(lot_version_select(lot_id)).first())
+
+
+def row_validators(lot_id, row):
+    """lot_validators() from a lot_version_select() row, or None for no row"""
+    if row is None:
+        return None
+    return f'lot-{lot_tag(lot_id, row.created_at, row.version)}', row.updated_at
+
+
+def lots_validators(versions):
+    """(ETag, Last-Modified) of the lot list from its ACTIVE_LOT_VERSIONS rows, sorted by lot_id"""
+    etag = hashlib.sha1(','.join(lot_tag(lot_id, created_at, version)
+                                 for lot_id, created_at, version, _ in versions).encode()).hexdigest()
+    return etag, max((updated for *_, updated in versions if updated), default=None)
+
+
+def availability_json(lot):
+    return {'lot_id': lot.lot_id, 'capacity': lot.capacity, 'available': lot.available,
+            'occupied': lot.occupied, 'version': lot.version}
+
+
+def lot_spots_selects(lot_id):
+    """(spots, active reservations, free spots by type) of one lot; the reservations' users are on the default database"""
+    return (
+        db.select(ParkingSpot).where(ParkingSpot.lot_id == lot_id).order_by(ParkingSpot.spot_number),
+        db.select(Reservation).join(ParkingSpot).where(ParkingSpot.lot_id == lot_id,
+                                                       Reservation.payment_status == 'Pending'),
+        db.select(ParkingSpot.spot_type, db.func.count()).where(ParkingSpot.lot_id == lot_id,
+                                                                ParkingSpot.status == 'A')
+        .group_by(ParkingSpot.spot_type),
+    )
+
+
+def users_select(user_ids):
+    return db.select(User_Admin).where(User_Admin.id.in_(user_ids))
+
+
+def lot_spots_json(lot, spots, active, users, free_by_type):
+    active_by_spot = {reservation.spot_id: reservation for reservation in active}
+    users_by_id = {user.id: user for user in users}
+    listed = []
+    for spot in spots:
+        reservation = active_by_spot.get(spot.spot_id) if spot.status == 'O' else None
+        listed.append(spot_json(spot, reservation, users_by_id.get(reservation.user_id) if reservation else None))
+    return {'lot': lot_json(lot), 'spots': listed, 'free_by_type': dict(free_by_type)}
+
+
+USER_PAGE_COLUMNS = (User_Admin.username, User_Admin.id)
+
+
+def users_page_select(search=None, after=None, per_page=PER_PAGE):
+    """One keyset page of users by username, optionally those whose username starts with search"""
+    statement = db.select(User_Admin)
+    if search:
+        statement = statement.where(prefix_filter(User_Admin.username, search))
+    return keyset_select(statement, USER_PAGE_COLUMNS, after=decode_cursor(after, len(USER_PAGE_COLUMNS)),
+                         per_page=per_page, descending=False)
+
+
+def active_reservations_select(user_ids):
+    return db.select(Reservation).options(joinedload(Reservation.spot)).where(
+        Reservation.user_id.in_(user_ids), Reservation.payment_status == 'Pending')
+
+
+def users_page_json(rows, active, per_page=PER_PAGE):
+    """Body of a users page from the rows of users_page_select() and their active reservations"""
+    users = rows[:per_page]
+    by_user = {}
+    for reservation in active:
+        by_user.setdefault(reservation.user_id, reservation)
+    next_cursor = None
+    if len(rows) > per_page:
+        next_cursor = encode_cursor([users[-1].username, users[-1].id])
+    return {'users': [user_json(user, by_user.get(user.id)) for user in users], 'next': next_cursor}
+
+
+def reservations_page_json(reservations, has_more):
+    next_cursor = None
+    if has_more:
+        last = reservations[-1]
+        next_cursor = timestamp_cursor(last.reservation_timestamp, last.reservation_id)
+    return {'reservations': [reservation_json(r) for r in reservations], 'next': next_cursor}
+
+
+@api_v1.route('/session', methods=['POST'])
+def create_session():
+    data = request.get_json(silent=True) or {}
+    user = User_Admin.query.filter_by(username=data.get('username')).first()
+    hasher = current_app.extensions['password_hasher']
+    try:
+        verified = user is not None and hasher.verify(user, data.get('password') or '')
+    except HashingBusyError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '2'}
+    if not verified:
+        return error('Invalid username or password', 401)
+    login_user(user)
+    return jsonify({'id': user.id, 'username': user.username, 'role': user.role})
+
+
+@api_v1.route('/session', methods=['DELETE'])
+@api_login_required
+def delete_session():
+    logout_user()
+    return '', 204
+
+
+@api_v1.route('/lots')
+@api_login_required
+def list_lots():
+    versions = sorted(tuple(row) for rows in fan_out(lambda: db.session.execute(ACTIVE_LOT_VERSIONS).all())
+                      for row in rows)
+
+    def render():
+        lots = fan_out(lambda: [lot_json(lot) for lot in db.session.scalars(ACTIVE_LOTS)])
+        return {'lots': sorted((lot for shard_lots in lots for lot in shard_lots), key=lambda lot: lot['lot_id'])}
+    return conditional(*lots_validators(versions), render)
+
+
+@api_v1.route('/lots/<int:lot_id>')
+@api_login_required
+def get_lot(lot_id):
+    validators = lot_validators(lot_id)
+    if validators is None:
+        return error('Lot not found', 404)
+    return conditional(*validators, lambda: lot_json(db.session.get(ParkingLot, lot_id)))
+
+
+@api_v1.route('/lots/<int:lot_id>/availability')
+@api_login_required
+def get_availability(lot_id):
+    validators = lot_validators(lot_id)
+    if validators is None:
+        return error('Lot not found', 404)
+    return conditional(*validators, lambda: availability_json(db.session.get(ParkingLot, lot_id)))
+
+
+@api_v1.route('/reservations')
+@api_login_required
+def list_reservations():
+    reservations, has_more = user_reservation_page(current_user.id, status=request.args.get('status'),
+                                                   after=parse_timestamp_cursor(request.args.get('before')))
+    return jsonify(reservations_page_json(reservations, has_more))
+
+
+@api_v1.route('/admin/lots/<int:lot_id>/spots')
+@api_login_required
+def list_lot_spots(lot_id):
+    if current_user.role != 'admin':
+        return error('Access denied', 403)
+    lot = db.session.get(ParkingLot, lot_id)
+    if lot is None:
+        return error('Lot not found', 404)
+    spots, active, free_by_type = lot_spots_selects(lot_id)
+    active = db.session.scalars(active).all()
+    users = db.session.scalars(users_select({r.user_id for r in active})).all() if active else []
+    return jsonify(lot_spots_json(lot, db.session.scalars(spots).all(), active, users,
+                                  db.session.execute(free_by_type).all()))
+
+
+@api_v1.route('/admin/users')
+@api_login_required
+def list_users():
+    if current_user.role != 'admin':
+        return error('Access denied', 403)
+    users = db.session.scalars(users_page_select(request.args.get('q', '').strip(), request.args.get('after'))).all()
+    user_ids = [user.id for user in users[:PER_PAGE]]
+    active = [r for rows in fan_out(lambda: db.session.scalars(active_reservations_select(user_ids)).all())
+              for r in rows] if user_ids else []
+    return jsonify(users_page_json(users, active))
+
+
+@api_v1.route('/lots/<int:lot_id>/reservations', methods=['POST'])
+@api_login_required
+def reserve(lot_id):
+    if current_user.role == 'admin':
+        return error('Admins cannot make reservations', 403)
+    lot = db.session.get(ParkingLot, lot_id)
+    if lot is None:
+        return error('Lot not found', 404)
+
+    data = request.get_json(silent=True) or {}
+    vehicle_number = (data.get('vehicle_number') or '').strip()
+    if not vehicle_number:
+        return error('vehicle_number is required', 400)
+    try:
+        parking_timestamp = datetime.fromisoformat(data['parking_time']) if data.get('parking_time') else datetime.now()
+    except (TypeError, ValueError):
+        return error('parking_time must be an ISO date and time', 400)
+
+    try:
+        reservation, _ = create_reservation(lot, current_user.id, vehicle_number, parking_timestamp,
+                                            spot_type=data.get('spot_type'))
+    except (LotFullError, DuplicateVehicleError) as e:
+        return error(str(e), 409)
+    except ReservationError as e:
+        return error(str(e), 400)
+    return jsonify(reservation_json(reservation)), 201
+
+
+@api_v1.route('/lots/<int:lot_id>/reservations/batch', methods=['POST'])
+@api_login_required
+def reserve_batch(lot_id):
+    if current_user.role == 'admin':
+        return error('Admins cannot make reservations', 403)
+    lot = db.session.get(ParkingLot, lot_id)
+    if lot is None:
+        return error('Lot not found', 404)
+
+    data = request.get_json(silent=True) or {}
+    vehicle_numbers = data.get('vehicle_numbers')
+    if not isinstance(vehicle_numbers, list) or not vehicle_numbers \
+            or not all(isinstance(v, str) and v.strip() for v in vehicle_numbers):
+        return error('vehicle_numbers must be a non-empty list of vehicle numbers', 400)
+    if len(vehicle_numbers) > MAX_BATCH_SIZE:
+        return error(f'At most {MAX_BATCH_SIZE} vehicles per batch', 400)
+    try:
+        parking_timestamp = datetime.fromisoformat(data['parking_time']) if data.get('parking_time') else datetime.now()
+    except (TypeError, ValueError):
+        return error('parking_time must be an ISO date and time', 400)
+
+    try:
+        results = create_reservations(lot, current_user.id, [v.strip() for v in vehicle_numbers],
+                                      parking_timestamp, spot_type=data.get('spot_type'))
+    except ReservationError as e:
+        return error(str(e), 400)
+    return jsonify({'reserved': sum('error' not in r for r in results), 'results': results})
+
+
+@api_v1.route('/reservations/release', methods=['POST'])
+@api_login_required
+def release_batch():
+    """Release and pay for several of the user's reservations.
+
+    Reservations are released in one transaction per shard, not across the
+    whole batch. When a shard's transaction fails its reservations stay
+    active, get an error result and are listed under 'retry', so the client
+    can send just those again.
+    """
+    data = request.get_json(silent=True) or {}
+    reservation_ids = data.get('reservation_ids')
+    if not isinstance(reservation_ids, list) or not reservation_ids \
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in reservation_ids):
+        return error('reservation_ids must be a non-empty list of reservation ids', 400)
+    if len(reservation_ids) > MAX_BATCH_SIZE:
+        return error(f'At most {MAX_BATCH_SIZE} reservations per batch', 400)
+
+    # One transaction per shard; results come back in the order the ids were given
+    results, failed = {}, set()
+    for shard, ids in group_by_shard(reservation_ids).items():
+        with use_shard(shard):
+            try:
+                results[shard] = iter(release_reservations(current_user.id, ids))
+            except SQLAlchemyError:
+                db.session.rollback()
+                current_app.logger.exception('Batch release failed on shard %s', shard or 'default')
+                results[shard] = iter([{'reservation_id': reservation_id,
+                                        'error': 'Not released, please try again.'} for reservation_id in ids])
+                failed.update(ids)
+    results = [next(results[shard_for_id(reservation_id)]) for reservation_id in reservation_ids]
+    return jsonify({'released': sum('error' not in r for r in results), 'results': results,
+                    'retry': [reservation_id for reservation_id in dict.fromkeys(reservation_ids)
+                              if reservation_id in failed]})
+
+
+@api_v1.route('/reservations/<int:reservation_id>/release', methods=['POST'])
+@api_login_required
+def release(reservation_id):
+    reservation = db.session.get(Reservation, reservation_id)
+    if reservation is None:
+        return error('Reservation not found', 404)
+    if reservation.user_id != current_user.id:
+        return error('Access denied', 403)
+
+    try:
+        release_reservation(reservation)
+    except AlreadyReleasedError as e:
+        return error(str(e), 409)
+    return jsonify(reservation_json(reservation))
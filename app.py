@@ -1,12 +1,28 @@
-from flask import Flask, render_template, redirect, url_for, flash, request
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, abort, make_response, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from datetime import datetime, timedelta
-from models import db, User_Admin, Reservation, Payment, ParkingSpot, ParkingLot
+from datetime import datetime, date, timedelta
+from models import db, User_Admin, Reservation, Payment, ParkingSpot, ParkingLot, SPOT_TYPES, ArchivedReservation, ArchivedPayment
+from reports import lot_utilization, utilization_summary, user_history_stats, user_counts
+from pagination import keyset_page, keyset_select, PER_PAGE, timestamp_cursor, parse_timestamp_cursor, encode_cursor, decode_cursor, prefix_filter
+from sqlalchemy.orm import joinedload, selectinload
+from charts import ChartCache, chart_key
+from sweeper import ExpirySweeper, sweep_expired_reservations
+from migrations import run_migrations, check_query_plans
+from allocation import create_reservation, release_reservation, ReservationError, AlreadyReleasedError
+from database import init_database
+from user_cache import UserCache
+from exports import export_rows, parse_export_date, EXPORT_FORMATS
+from analytics import rebuild_usage_rollups, usage_report
+from availability import AvailabilityFeed, lot_availability
+from api import api_v1
+from instrumentation import RequestMetrics
+from passwords import PasswordHasher, HashingBusyError
+from archive import archive_reservations, archive_counts, user_reservations, user_reservation_page, ARCHIVE_BATCH_SIZE
+from fragments import LotCardCache
+from shards import init_shard_routing, prepare_shards, bind_shard, use_shard, fan_out, shard_names, shard_for_pincode, is_sharded, local_id
 from werkzeug.security import generate_password_hash, check_password_hash
-import matplotlib.pyplot as plt
-import io
-import base64
 import os
+import click
 
 from dotenv import load_dotenv
 
@@ -15,19 +31,35 @@ load_dotenv()
 app = Flask(__name__)
 
 app.secret_key = os.environ.get("SECRET_KEY", "fallback-secret")
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///parking_system.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False    
-db.init_app(app)
+init_database(app)  # DATABASE_URL, DATABASE_SHARDS and DB_PROFILE from the environment
+init_shard_routing(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+expiry_sweeper = ExpirySweeper(app)
+availability_feed = AvailabilityFeed(app)
+request_metrics = RequestMetrics(app)
+password_hasher = PasswordHasher(app)
+lot_card_cache = LotCardCache(app)
+app.register_blueprint(api_v1)
+
+chart_cache = ChartCache(
+    max_entries=int(os.environ.get('CHART_CACHE_SIZE', 32)),
+    ttl=int(os.environ.get('CHART_CACHE_TTL', 300)),
+    workers=int(os.environ.get('CHART_RENDER_WORKERS', 1)),
+)
+
+user_cache = UserCache(ttl=int(os.environ.get('USER_CACHE_TTL', 60))).watch_changes()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User_Admin.query.get(int(user_id))
+    return user_cache.load(int(user_id))
 
 def create_database():
     with app.app_context():
         db.create_all()
+        run_migrations()
+        prepare_shards()
         if not User_Admin.query.first():
             admin = User_Admin(username='admin', 
                               email='admin@parkease.com',
@@ -36,44 +68,101 @@ def create_database():
             db.session.add(admin)
             db.session.commit()
 
-def check_expired_reservations():
-    """Automatically handle expired reservations"""
-    # Find reservations that are more than 24 hours old and still pending
-    cutoff_time = datetime.now() - timedelta(hours=24)
-    expired_reservations = Reservation.query.filter(
-        Reservation.payment_status == 'Pending',
-        Reservation.parking_timestamp < cutoff_time
-    ).all()
-    
-    for reservation in expired_reservations:
-        # Mark spot as available
-        spot = ParkingSpot.query.get(reservation.spot_id)
-        if spot:
-            spot.status = 'A'
-        
-        # Calculate maximum charge (24 hours)
-        max_hours = 24
-        total_cost = max_hours * reservation.parking_cost_per_time
-        
-        # Create payment record
-        payment = Payment(
-            reservation_id=reservation.reservation_id,
-            amount=total_cost,
-            payment_method='Auto-charge',
-            payment_status='Completed',
-            payment_timestamp=datetime.now()
-        )
-        
-        # Update reservation
-        reservation.payment_status = 'Paid'
-        reservation.leaving_timestamp = cutoff_time
-        
-        db.session.add(payment)
-    
-    if expired_reservations:
-        db.session.commit()
-        return len(expired_reservations)
-    return 0
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    """Create missing tables and apply pending schema migrations"""
+    db.create_all()
+    applied = run_migrations()
+    click.echo(f'Applied migration(s): {", ".join(map(str, applied))}' if applied else 'Database is up to date.')
+    for shard, applied in prepare_shards().items():
+        click.echo(f'Shard {shard}: ' + (f'applied migration(s): {", ".join(map(str, applied))}'
+                                         if applied else 'up to date.'))
+
+@app.cli.command('check-query-plans')
+@click.option('--verbose', '-v', is_flag=True, help='Print the full plan of every query.')
+def check_query_plans_command(verbose):
+    """Fail if any hot query needs a full table scan"""
+    failed = False
+    for name, (plan, scans) in check_query_plans().items():
+        click.echo(f'{"FULL SCAN" if scans else "ok":>9}  {name}')
+        if verbose or scans:
+            for line in plan:
+                click.echo(f'           {line}')
+        failed = failed or bool(scans)
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command('check-counters')
+@click.option('--fix', is_flag=True, help='Rewrite drifted counters from the parking_spot table.')
+def check_counters(fix):
+    """Compare the per-lot occupancy counters with the actual spot statuses"""
+    drifted = []
+    for shard in shard_names():
+        with use_shard(shard):
+            # Described while the shard is selected: the fix commits, and reloading a lot needs its shard
+            drifted += [f'Lot {lot.lot_id} ({lot.prime_location_name}): '
+                        f'counters {old_available}/{old_occupied}, actual {available}/{occupied}'
+                        for lot, old_available, old_occupied, available, occupied in ParkingLot.rebuild_counts(fix=fix)]
+    for line in drifted:
+        click.echo(line)
+    if not drifted:
+        click.echo('All lot counters are consistent.')
+    elif fix:
+        click.echo(f'Rebuilt counters for {len(drifted)} lot(s).')
+    else:
+        raise SystemExit(1)
+
+@app.cli.command('sweep-expired')
+@click.option('--batch-size', default=500, show_default=True, help='Reservations closed per transaction.')
+def sweep_expired(batch_size):
+    """Close and auto-charge reservations pending for more than 24 hours"""
+    closed = sweep_expired_reservations(batch_size)
+    click.echo(f'{closed} expired reservation(s) closed.')
+
+@app.cli.command('rebuild-analytics')
+@click.option('--batch-size', default=5000, show_default=True, help='Payments read per query.')
+def rebuild_analytics(batch_size):
+    """Recompute the analytics rollup tables from all recorded payments"""
+    total = 0
+    for shard in shard_names():
+        with use_shard(shard):
+            total += rebuild_usage_rollups(batch_size)
+            db.session.commit()
+    click.echo(f'Rolled up {total} payment(s).')
+
+@app.cli.command('archive-reservations')
+@click.option('--older-than-days', type=int, default=lambda: int(os.environ.get('ARCHIVE_AFTER_DAYS', 90)),
+              show_default='ARCHIVE_AFTER_DAYS or 90', help='Archive Paid reservations parked longer ago than this.')
+@click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, show_default=True, help='Reservations moved per transaction.')
+@click.option('--max-batches', type=int, help='Stop after this many batches; the next run carries on.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to wait between batches.')
+def archive_reservations_command(older_than_days, batch_size, max_batches, pause):
+    """Move old Paid reservations and their payments into the archive database"""
+    moved = 0
+    for shard in shard_names():
+        with use_shard(shard):
+            moved += archive_reservations(timedelta(days=older_than_days), batch_size, max_batches, pause,
+                                          progress=lambda n: click.echo(f'{n} reservation(s) archived...'))
+    counts = archive_counts()
+    click.echo(f'Archived {moved} reservation(s). Live: {counts["reservations"]} reservation(s), '
+               f'{counts["payments"]} payment(s); archive: {counts["archived_reservations"]} reservation(s), '
+               f'{counts["archived_payments"]} payment(s).')
+
+@app.cli.command('export-reservations')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--start', help='First reservation date (YYYY-MM-DD or ISO datetime).')
+@click.option('--end', help='Last reservation date, inclusive.')
+@click.option('--lot', 'lot_id', type=int, help='Only reservations in this lot.')
+@click.option('--output', '-o', type=click.File('w'), default='-', help='Output file (default stdout).')
+def export_reservations(fmt, start, end, lot_id, output):
+    """Stream reservations joined with their spot, lot and payment as CSV or NDJSON"""
+    try:
+        start, end = parse_export_date(start), parse_export_date(end, end=True)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    encode = EXPORT_FORMATS[fmt][0]
+    for chunk in encode(export_rows(start, end, lot_id)):
+        output.write(chunk)
 
 @app.route('/')
 def home_page():
@@ -86,8 +175,14 @@ def login():
         password = request.form['password']
         role = request.form['role']
 
-        user = User_Admin.query.filter_by(username=username).first()
-        if user and user.check_password(password) and user.role == role:
+        # Checking the role in the query spares a password hash for the wrong login form
+        user = User_Admin.query.filter_by(username=username, role=role).first()
+        try:
+            verified = user is not None and password_hasher.verify(user, password)
+        except HashingBusyError as e:
+            flash(str(e), 'warning')
+            return render_template('login.html'), 503, {'Retry-After': '2'}
+        if verified:
             login_user(user)
             flash('Login successful!', 'success')
             if role == 'admin':
@@ -117,8 +212,12 @@ def register():
             flash('Username already exists. Please choose a different one.', 'danger')
             return redirect(url_for('register'))
         else: 
-            user = User_Admin(username=username, email=email, role='user')
-            user.set_password(password)
+            try:
+                password_hash = password_hasher.hash(password)
+            except HashingBusyError as e:
+                flash(str(e), 'warning')
+                return redirect(url_for('register'))
+            user = User_Admin(username=username, email=email, role='user', password_hash=password_hash)
             db.session.add(user)
             db.session.commit()
             login_user(user)
@@ -126,6 +225,8 @@ def register():
             return redirect(url_for('user_dashboard'))
     return render_template('register.html')
 
+DASHBOARD_USERS = 10
+
 @app.route('/admin_dashboard')
 @login_required
 def admin_dashboard():
@@ -133,79 +234,146 @@ def admin_dashboard():
         flash('Access denied', 'danger')
         return redirect(url_for('home_page'))
 
-    # Check for expired reservations
-    expired_count = check_expired_reservations()
-    if expired_count > 0:
-        flash(f'{expired_count} expired reservation(s) have been automatically closed.', 'info')
-
-    lots = ParkingLot.query.all()
-    users = User_Admin.query.all()
+    # One page of lots by name, optionally narrowed to names starting with lot_q;
+    # every shard reads its own page at once and the pages are merged
+    lot_search = request.args.get('lot_q', '').strip()
+    lot_columns = [ParkingLot.prime_location_name, ParkingLot.lot_id]
+    after = decode_cursor(request.args.get('lots_after'), len(lot_columns))
+
+    def lot_page():
+        lot_query = ParkingLot.query
+        if lot_search:
+            lot_query = lot_query.filter(prefix_filter(ParkingLot.prime_location_name, lot_search))
+        page, more = keyset_page(lot_query, lot_columns, descending=False, after=after)
+        return page, more, db.session.query(db.func.count(ParkingLot.lot_id)).scalar()
+
+    pages = fan_out(lot_page)
+    lots = sorted((lot for page, _, _ in pages for lot in page), key=lambda lot: (lot.prime_location_name, lot.lot_id))
+    more_lots = len(lots) > PER_PAGE or any(more for _, more, _ in pages)
+    lots = lots[:PER_PAGE]
+    next_lots = encode_cursor([lots[-1].prime_location_name, lots[-1].lot_id]) if more_lots else None
+    total_lots = sum(count for _, _, count in pages)
+
+    # Newest sign-ups only; the users page has the full, searchable list
+    users = User_Admin.query.order_by(User_Admin.id.desc()).limit(DASHBOARD_USERS).all()
+
+    summary, charts = dashboard_charts()
+    today = date.today()
+    usage = usage_report(today - timedelta(days=29), today)
+
+    # Start rendering both charts now; the page only links to them
+    chart1 = chart_cache.prefetch(*charts['occupancy'])
+    chart2 = chart_cache.prefetch(*charts['utilization'])
+
+    return render_template('admin_dashboard.html', lots=lots, users=users, chart1=chart1, chart2=chart2,
+                           available_spots=summary['available'], occupied_spots=summary['occupied'],
+                           usage=usage, total_lots=total_lots, lot_search=lot_search, next_lots=next_lots,
+                           first_lots='lots_after' not in request.args)
+
+def dashboard_charts():
+    """Utilization summary plus the (data, chart_type, title) of each dashboard chart"""
+    report = lot_utilization()
+    summary = utilization_summary(report)
 
     # Spot Occupancy Chart
-    total_spots = ParkingSpot.query.count()
-    available = ParkingSpot.query.filter_by(status='A').count()
-    occupied = total_spots - available
-
-    spot_data = {'Available': available, 'Occupied': occupied}
-    chart1 = generate_chart(spot_data, chart_type='pie', title='Spot Occupancy')
+    spot_data = {'Available': summary['available'], 'Occupied': summary['occupied']}
 
     # Lot Utilization Chart
-    lot_data = {}
-    for lot in lots:
-        lot_name = lot.prime_location_name
-        total = ParkingSpot.query.filter_by(lot_id=lot.lot_id).count()
-        occ = ParkingSpot.query.filter_by(lot_id=lot.lot_id, status='O').count()
-        utilization = round((occ / total) * 100, 2) if total > 0 else 0
-        lot_data[lot_name] = utilization
+    lot_data = {row['name']: row['utilization'] for row in report}
 
-    chart2 = generate_chart(lot_data, chart_type='bar', title='Lot Utilization (%)')
+    return summary, {
+        'occupancy': (spot_data, 'pie', 'Spot Occupancy'),
+        'utilization': (lot_data, 'bar', 'Lot Utilization (%)'),
+    }
 
-    return render_template('admin_dashboard.html', lots=lots, users=users, chart1=chart1, chart2=chart2, available_spots=available, occupied_spots=occupied)
+@app.route('/admin/chart/<kind>.png')
+@login_required
+def chart_image(kind):
+    if current_user.role != 'admin':
+        abort(403)
+
+    charts = dashboard_charts()[1]
+    if kind not in charts:
+        abort(404)
+
+    if request.if_none_match.contains(chart_key(*charts[kind])):
+        return '', 304
+
+    with request_metrics.timed('chart'):
+        key, png = chart_cache.get(*charts[kind])
+    response = make_response(png)
+    response.mimetype = 'image/png'
+    response.set_etag(key)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # Revalidate; unchanged charts come back as 304
+    return response.make_conditional(request)
+
+@app.route('/metrics')
+def metrics():
+    # Scrapers authenticate with METRICS_TOKEN; without one, only admins can read the metrics
+    token = os.environ.get('METRICS_TOKEN')
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+    elif not (current_user.is_authenticated and current_user.role == 'admin'):
+        abort(403)
+    return Response(request_metrics.prometheus() + password_hasher.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/api/utilization')
+@login_required
+def utilization_api():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
 
-def generate_chart(data, chart_type='bar', title='Chart'):
-    plt.switch_backend('Agg')  # Headless mode
-    
-    # Set figure size based on chart type
-    if chart_type == 'bar':
-        fig, ax = plt.subplots(figsize=(9, 9))
-    else:
-        fig, ax = plt.subplots(figsize=(9, 9))
-
-    labels = list(data.keys())
-    values = list(data.values())
-
-    # Handle empty or all-zero data
-    if not values or all(v == 0 for v in values):
-        labels = ['No Data']
-        values = [1]
-        chart_type = 'bar'  # Avoid pie chart for invalid data
-        title = 'No Data Available'
-
-    if chart_type == 'bar':
-        bars = ax.bar(labels, values, color='skyblue')
-        # Rotate x-axis labels to prevent overlapping
-        plt.xticks(rotation=45, ha='right')
-        # Add value labels on top of bars
-        for bar, value in zip(bars, values):
-            height = bar.get_height()
-            ax.text(bar.get_x() + bar.get_width()/2., height + 0.5,
-                   f'{value}%', ha='center', va='bottom', fontsize=9)
-        # Adjust bottom margin to prevent label cutoff
-        plt.subplots_adjust(bottom=0.25)
-    elif chart_type == 'pie':
-        ax.pie(values, labels=labels, autopct='%1.1f%%', startangle=90)
-
-    ax.set_title(title, fontsize=12, fontweight='bold', pad=15)
-
-    # Adjust layout with proper spacing to prevent label cutoff
-    plt.tight_layout(pad=1.5)
-    img = io.BytesIO()
-    plt.savefig(img, format='png', dpi=100)
-    img.seek(0)
-    chart_base64 = base64.b64encode(img.getvalue()).decode()
-    plt.close(fig)
-
-    return chart_base64
+    report = lot_utilization()
+    return jsonify({'lots': report, 'summary': utilization_summary(report)})
+
+MAX_ANALYTICS_DAYS = 3660
+
+@app.route('/admin/api/analytics')
+@login_required
+def analytics_api():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+
+    try:
+        end = date.fromisoformat(request.args['end']) if 'end' in request.args else date.today()
+        start = date.fromisoformat(request.args['start']) if 'start' in request.args else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'start and end must be dates (YYYY-MM-DD)'}), 400
+    if not 0 <= (end - start).days < MAX_ANALYTICS_DAYS:
+        return jsonify({'error': f'start must be on or before end, at most {MAX_ANALYTICS_DAYS} days apart'}), 400
+
+    return jsonify(usage_report(start, end, request.args.get('lot_id', type=int)))
+
+@app.route('/admin/api/cache-stats')
+@login_required
+def cache_stats_api():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+
+    return jsonify({'user_cache': user_cache.stats(), 'password_hashing': password_hasher.stats(),
+                    'lot_cards': lot_card_cache.stats()})
+
+@app.route('/admin/export/reservations.<fmt>')
+@login_required
+def export_reservations_view(fmt):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+
+    try:
+        start = parse_export_date(request.args.get('start'))
+        end = parse_export_date(request.args.get('end'), end=True)
+    except ValueError:
+        return jsonify({'error': 'start and end must be ISO dates'}), 400
+    lot_id = request.args.get('lot_id', type=int)
+
+    encode, mimetype = EXPORT_FORMATS[fmt]
+    response = Response(stream_with_context(encode(export_rows(start, end, lot_id))), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=reservations.{fmt}'
+    return response
 
 @app.route('/admin/lot/create', methods=['GET', 'POST'])
 @login_required
@@ -215,6 +383,12 @@ def create_lot():
         return redirect(url_for('home_page'))
     
     if request.method == 'POST':
+        bays = (('EV', request.form.get('ev_spots', 0, type=int)),
+                ('Accessible', request.form.get('accessible_spots', 0, type=int)))
+        if any(count < 0 for _, count in bays) or sum(count for _, count in bays) > int(request.form['capacity']):
+            flash('EV and accessible bays must fit within the capacity', 'danger')
+            return redirect(url_for('create_lot'))
+
         lot = ParkingLot(
             prime_location_name=request.form['name'],
             price=float(request.form['price']),
@@ -223,16 +397,12 @@ def create_lot():
             pincode=request.form['pincode'],
             contact=request.form['contact']
         )
+        lot.available_count = lot.capacity
+        bind_shard(shard_for_pincode(lot.pincode))
         db.session.add(lot)
-        db.session.commit()
-        for i in range(1, lot.capacity + 1):
-            spot = ParkingSpot(
-                lot_id=lot.lot_id,
-                spot_number=f"{lot.prime_location_name[:3]}-{lot.lot_id}-{i:03d}",
-                status='A'  # Available
-            )
-            db.session.add(spot)
-        
+        db.session.flush()  # Assigns lot_id for the spot numbers
+        add_spots(lot, 1, lot.capacity, bays)
+        ParkingLot.mark_changed(lot.lot_id)
         db.session.commit()
         flash('Parking lot created successfully!', 'success')
         return redirect(url_for('admin_dashboard'))
@@ -269,52 +439,78 @@ def edit_lot(lot_id):
                 return redirect(url_for('edit_lot', lot_id=lot_id))
 
             if new_capacity != lot.capacity:
-                if new_capacity < lot.capacity:
-                    spots_to_delete = ParkingSpot.query.filter(
-                        ParkingSpot.lot_id == lot.lot_id,
-                        ParkingSpot.spot_number >= f"{lot.prime_location_name[:3]}-{new_capacity + 1:03d}"
-                    ).all()
-
-                    for spot in spots_to_delete:
-                        if spot.status == 'O':
-                            flash('Cannot reduce capacity - some spots are occupied', 'danger')
-                            return redirect(url_for('edit_lot', lot_id=lot_id))
-
-                update_spots_for_lot(lot, new_capacity)
+                if not update_spots_for_lot(lot, new_capacity):
+                    flash('Cannot reduce capacity - some spots are occupied', 'danger')
+                    return redirect(url_for('edit_lot', lot_id=lot_id))
                 lot.capacity = new_capacity
 
+        lot.touch()
         db.session.commit()
         flash('Parking lot updated successfully!', 'success')
         return redirect(url_for('admin_dashboard'))
     return render_template('edit.html', lot=lot)
 
+SPOT_CHUNK_SIZE = 5000
+
+def add_spots(lot, first, last, bays=()):
+    """Insert available spots numbered first..last for a lot, in executemany chunks.
+
+    bays is a sequence of (spot_type, count) given to the lowest-numbered
+    new spots in order; the rest are Standard.
+    """
+    prefix = f"{lot.prime_location_name[:3]}-{local_id(lot.lot_id)}"  # Short on shards too
+    layout, end = [], first
+    for spot_type, count in bays:
+        end += count
+        layout.append((end, spot_type))
+
+    def spot_type_of(number):
+        return next((spot_type for end, spot_type in layout if number < end), 'Standard')
+
+    for start in range(first, last + 1, SPOT_CHUNK_SIZE):
+        db.session.execute(db.insert(ParkingSpot), [
+            {'lot_id': lot.lot_id, 'spot_number': f"{prefix}-{i:03d}", 'status': 'A', 'spot_type': spot_type_of(i)}
+            for i in range(start, min(start + SPOT_CHUNK_SIZE, last + 1))
+        ])
+
 def update_spots_for_lot(lot, new_capacity):
-    """Helper function to manage spots when lot capacity changes"""
+    """Helper function to manage spots when lot capacity changes.
+
+    Returns False, changing nothing, if a spot that would be removed is occupied.
+    """
     current_spots = ParkingSpot.query.filter_by(lot_id=lot.lot_id).count()
     
     if new_capacity > current_spots:
         # Add new spots
-        for i in range(current_spots + 1, new_capacity + 1):
-            spot = ParkingSpot(
-                lot_id=lot.lot_id,
-                spot_number=f"{lot.prime_location_name[:3]}-{i:03d}",
-                status='A'
-            )
-            db.session.add(spot)
+        add_spots(lot, current_spots + 1, new_capacity)
+        ParkingLot.adjust_counts(lot.lot_id, available=new_capacity - current_spots)
     elif new_capacity < current_spots:
+        # The newest spots go first: everything from the (new_capacity + 1)-th spot id on
+        first_removed = db.session.query(ParkingSpot.spot_id).filter_by(lot_id=lot.lot_id) \
+            .order_by(ParkingSpot.spot_id).offset(new_capacity).limit(1).scalar()
+        removed = db.and_(ParkingSpot.lot_id == lot.lot_id, ParkingSpot.spot_id >= first_removed)
+
         # Delete extra spots (only if not occupied)
-        spots_to_delete = ParkingSpot.query.filter(
-            ParkingSpot.lot_id == lot.lot_id,
-            ParkingSpot.spot_number >= f"{lot.prime_location_name[:3]}-{new_capacity+1:03d}"
-        ).all()
-        for spot in spots_to_delete:
-            if spot.status == 'O':
-                flash('Cannot reduce capacity — some spots are occupied.', 'danger')
-                return
-
-        # Safe to delete
-        for spot in spots_to_delete:
-            db.session.delete(spot)
+        if db.session.query(db.exists().where(removed, ParkingSpot.status == 'O')).scalar():
+            return False
+
+        # Safe to delete, along with their past reservations and payments
+        removed_spot_ids = db.select(ParkingSpot.spot_id).where(removed)
+        removed_reservation_ids = db.select(Reservation.reservation_id).where(Reservation.spot_id.in_(removed_spot_ids))
+        db.session.execute(db.delete(Payment).where(Payment.reservation_id.in_(removed_reservation_ids))
+                           .execution_options(synchronize_session=False))
+        db.session.execute(db.delete(Reservation).where(Reservation.spot_id.in_(removed_spot_ids))
+                           .execution_options(synchronize_session=False))
+        archived_ids = db.select(ArchivedReservation.reservation_id).where(
+            ArchivedReservation.spot_id.in_(removed_spot_ids))
+        db.session.execute(db.delete(ArchivedPayment).where(ArchivedPayment.reservation_id.in_(archived_ids))
+                           .execution_options(synchronize_session=False))
+        db.session.execute(db.delete(ArchivedReservation).where(ArchivedReservation.spot_id.in_(removed_spot_ids))
+                           .execution_options(synchronize_session=False))
+        deleted = db.session.execute(db.delete(ParkingSpot).where(removed)
+                                     .execution_options(synchronize_session=False)).rowcount
+        ParkingLot.adjust_counts(lot.lot_id, available=-deleted)
+    return True
 
 @app.route('/admin/lot/delete/<int:lot_id>', methods=['POST'])
 @login_required
@@ -335,6 +531,7 @@ def delete_lot(lot_id):
         ParkingSpot.query.filter_by(lot_id=lot.lot_id).delete()
         # Then delete the lot
         db.session.delete(lot)
+        ParkingLot.mark_changed(lot_id)
         db.session.commit()
         flash('Parking lot deleted successfully!', 'success')
     except Exception as e:
@@ -352,19 +549,98 @@ def view_spots(lot_id):
     
     lot = ParkingLot.query.get_or_404(lot_id)
     spots = ParkingSpot.query.filter_by(lot_id=lot_id).order_by(ParkingSpot.spot_number).all()
-    
+
+    # Active reservations for the whole lot in one query, their users (on the default database) in another
+    active = Reservation.query.join(ParkingSpot).filter(
+        ParkingSpot.lot_id == lot_id,
+        Reservation.payment_status == 'Pending'
+    ).options(selectinload(Reservation.user)).all()
+    active_by_spot = {reservation.spot_id: reservation for reservation in active}
+
     # Get reservation details for occupied spots
     spot_details = []
     for spot in spots:
         detail = {'spot': spot}
         if spot.status == 'O':
-            reservation = Reservation.query.filter_by(spot_id=spot.spot_id, payment_status='Pending').first()
+            reservation = active_by_spot.get(spot.spot_id)
             if reservation:
                 detail['reservation'] = reservation
-                detail['user'] = User_Admin.query.get(reservation.user_id)
+                detail['user'] = reservation.user
         spot_details.append(detail)
     
-    return render_template('spots.html', lot=lot, spots=spot_details)
+    free_by_type = dict(db.session.query(ParkingSpot.spot_type, db.func.count())
+                        .filter_by(lot_id=lot_id, status='A').group_by(ParkingSpot.spot_type).all())
+    return render_template('spots.html', lot=lot, spots=spot_details,
+                           spot_types=SPOT_TYPES, free_by_type=free_by_type)
+
+@app.route('/admin/spot/<int:spot_id>/type', methods=['POST'])
+@login_required
+def set_spot_type(spot_id):
+    if current_user.role != 'admin':
+        flash('Access denied', 'danger')
+        return redirect(url_for('home_page'))
+
+    spot = ParkingSpot.query.get_or_404(spot_id)
+    spot_type = request.form.get('spot_type')
+    if spot_type not in SPOT_TYPES:
+        flash('Invalid spot type', 'danger')
+    else:
+        spot.spot_type = spot_type
+        db.session.commit()
+        flash(f'Spot {spot.spot_number} is now {spot_type}', 'success')
+    return redirect(url_for('view_spots', lot_id=spot.lot_id))
+
+USER_SORTS = {'username': User_Admin.username, 'email': User_Admin.email, 'id': User_Admin.id}
+
+# Prefix searches, each served by an index range scan
+USER_SEARCH_FIELDS = {
+    'username': lambda text: prefix_filter(User_Admin.username, text),
+    'email': lambda text: prefix_filter(User_Admin.email, text),
+    'vehicle': lambda text: User_Admin.id.in_(vehicle_user_ids(text)),
+}
+
+def vehicle_user_ids(text):
+    """Subquery of the ids of users with a reservation for a vehicle number starting with text"""
+    return db.select(Reservation.user_id).where(prefix_filter(Reservation.vehicle_number, text))
+
+# User ids per IN list when searching vehicles across shards, well under SQLite's bound parameter limit
+VEHICLE_SEARCH_CHUNK = 500
+
+def vehicle_users_page(text, columns, after=None, descending=True):
+    """keyset_page() of the users with a reservation for a vehicle number starting with text, on any shard.
+
+    Reservations and users are on different databases, so each shard streams
+    its matching user ids in chunks and keeps only the best page of those
+    users; the shards' pages are then merged. Neither the ids held nor any IN
+    list grows with the number of matches.
+    """
+    def best(users):
+        return sorted(users, key=lambda user: tuple(getattr(user, column.key) for column in columns),
+                      reverse=descending)[:PER_PAGE + 1]
+
+    def shard_page():
+        ids = vehicle_user_ids(text).distinct().execution_options(yield_per=VEHICLE_SEARCH_CHUNK)
+        page = []
+        for chunk in db.session.scalars(ids).partitions():
+            chunk_query = User_Admin.query.filter(User_Admin.id.in_(chunk))
+            page = best(page + keyset_select(chunk_query, columns, after, descending=descending).all())
+        return page
+
+    users = best({user.id: user for page in fan_out(shard_page) for user in page}.values())
+    return users[:PER_PAGE], len(users) > PER_PAGE
+
+def active_reservations(user_ids):
+    """{user_id: an active reservation, with its spot} for the given users, from every shard"""
+    def shard_active():
+        return Reservation.query.options(joinedload(Reservation.spot)).filter(
+            Reservation.user_id.in_(user_ids),
+            Reservation.payment_status == 'Pending').all()
+
+    active = {}
+    for reservations in fan_out(shard_active):
+        for reservation in reservations:
+            active.setdefault(reservation.user_id, reservation)
+    return active
 
 @app.route('/admin/users')
 @login_required
@@ -372,24 +648,41 @@ def view_users():
     if current_user.role != 'admin':
         flash('Access denied', 'danger')
         return redirect(url_for('home_page'))
-    
-    users = User_Admin.query.all()
+
+    search = request.args.get('q', '').strip()
+    field = request.args.get('field') if request.args.get('field') in USER_SEARCH_FIELDS else 'username'
+    sort = request.args.get('sort') if request.args.get('sort') in USER_SORTS else 'username'
+    descending = request.args.get('dir') == 'desc'
+
+    columns = [USER_SORTS[sort]] if sort == 'id' else [USER_SORTS[sort], User_Admin.id]
+    after = decode_cursor(request.args.get('after'), len(columns))
+    if search and field == 'vehicle' and is_sharded():
+        users, has_more = vehicle_users_page(search, columns, after=after, descending=descending)
+    else:
+        query = User_Admin.query
+        if search:
+            query = query.filter(USER_SEARCH_FIELDS[field](search))
+        users, has_more = keyset_page(query, columns, descending=descending, after=after)
+
+    # Active reservation of each user on the page, with its spot, in one query per shard
+    active = active_reservations([user.id for user in users]) if users else {}
+
     user_details = []
-    
     for user in users:
         details = {'user': user}
-        active_reservation = Reservation.query.filter_by(
-            user_id=user.id,
-            payment_status='Pending'
-        ).first()
-        
-        if active_reservation:
-            details['spot'] = ParkingSpot.query.get(active_reservation.spot_id)
-            details['reservation'] = active_reservation
-        
+        if user.id in active:
+            details['reservation'] = active[user.id]
+            details['spot'] = active[user.id].spot
         user_details.append(details)
-    
-    return render_template('users.html', users=user_details)
+
+    next_cursor = None
+    if has_more:
+        last = users[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+
+    return render_template('users.html', users=user_details, counts=user_counts(), search=search, field=field,
+                           sort=sort, direction='desc' if descending else 'asc',
+                           next_cursor=next_cursor, first_page='after' not in request.args)
 
 @app.route('/admin/user/<int:user_id>/history')
 @login_required
@@ -399,23 +692,28 @@ def view_user_history(user_id):
         return redirect(url_for('home_page'))
     
     user = User_Admin.query.get_or_404(user_id)
-    # Get all reservations for this user (both active and completed)
-    reservations = Reservation.query.filter_by(user_id=user_id).order_by(
-        Reservation.reservation_timestamp.desc()
-    ).all()
-    
+    # One page of live and archived reservations (newest first) with spot, lot and payment joined in
+    reservations, has_more = user_reservation_page(user_id, after=parse_timestamp_cursor(request.args.get('before')))
+
     # Get detailed information for each reservation
     reservation_details = []
     for reservation in reservations:
         detail = {
             'reservation': reservation,
-            'spot': ParkingSpot.query.get(reservation.spot_id),
-            'lot': ParkingLot.query.get(ParkingSpot.query.get(reservation.spot_id).lot_id) if ParkingSpot.query.get(reservation.spot_id) else None,
-            'payment': Payment.query.filter_by(reservation_id=reservation.reservation_id).first()
+            'spot': reservation.spot,
+            'lot': reservation.spot.lot if reservation.spot else None,
+            'payment': reservation.payment
         }
         reservation_details.append(detail)
-    
-    return render_template('user_history.html', user=user, reservations=reservation_details)
+
+    next_cursor = None
+    if has_more:
+        last = reservations[-1]
+        next_cursor = timestamp_cursor(last.reservation_timestamp, last.reservation_id)
+
+    return render_template('user_history.html', user=user, reservations=reservation_details,
+                           stats=user_history_stats(user_id), next_cursor=next_cursor,
+                           first_page='before' not in request.args)
 
 @app.route('/user_dashboard')
 @login_required
@@ -424,14 +722,10 @@ def user_dashboard():
         flash('Access denied', 'danger')
         return redirect(url_for('home_page'))
 
-    # Check for expired reservations
-    expired_count = check_expired_reservations()
-    if expired_count > 0:
-        flash(f'{expired_count} expired reservation(s) have been automatically closed.', 'info')
-
-    active_reservation = Reservation.query.filter_by(
-        user_id=current_user.id, payment_status='Pending'
-    ).all()
+    user_id = current_user.id
+    active_reservation = [reservation for reservations in fan_out(
+        lambda: Reservation.query.filter_by(user_id=user_id, payment_status='Pending').all())
+        for reservation in reservations]
 
     # Check for long-running reservations and show warnings
     for res in active_reservation:
@@ -441,10 +735,22 @@ def user_dashboard():
         elif hours_elapsed > 20:
             flash(f'Critical: Your reservation will be automatically closed in {24-hours_elapsed:.1f} hours.', 'danger')
 
-    available_lots = ParkingLot.query.filter_by(is_active=True).all()
+    # The same for every user, so it comes from the fragment cache with live counts filled in
+    lot_cards = lot_card_cache.render()
+
+    return render_template('user_dashboard.html', lot_cards=lot_cards, reservation=active_reservation)
 
-    return render_template('user_dashboard.html', lots=available_lots, reservation=active_reservation)
 
+@app.route('/api/availability/stream')
+@login_required
+def availability_stream():
+    # Live per-lot availability, so the dashboard does not need reloading to see free spots
+    snapshot = lot_availability()
+    db.session.remove()  # Do not hold a connection for the life of the stream
+    response = Response(availability_feed.stream(snapshot), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Let nginx pass events straight through
+    return response
 
 @app.route('/reserve/<int:lot_id>', methods=['POST'])
 @login_required
@@ -456,15 +762,7 @@ def reserve_spot(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
     vehicle_number = request.form['vehicle_number']
     user_parking_time = request.form['parking_time']
-    spot = ParkingSpot.query.filter_by(lot_id=lot_id, status='A').first()
-    existing = Reservation.query.filter_by(vehicle_number=vehicle_number, payment_status='Pending').first()
-    if existing:
-        flash('An active reservation already exists for this vehicle number.', 'danger')
-        return redirect(url_for('user_dashboard'))
-
-    if spot.status != 'A':
-        flash('Spot is already occupied', 'danger')
-        return redirect(url_for('user_dashboard'))
+    spot_type = request.form.get('spot_type') or None  # Empty means any type
 
     try:
         parking_timestamp = datetime.strptime(user_parking_time, '%Y-%m-%dT%H:%M')
@@ -472,20 +770,13 @@ def reserve_spot(lot_id):
         flash('Invalid date format for parking time.', 'danger')
         return redirect(url_for('user_dashboard'))
 
-    reservation = Reservation(
-        spot_id=spot.spot_id,
-        user_id=current_user.id,
-        parking_cost_per_time=spot.lot.price,
-        vehicle_number=vehicle_number,
-        reservation_timestamp=datetime.now(),
-        parking_timestamp=parking_timestamp
-    )
-
-    spot.status = 'O'  # Mark as occupied
-    db.session.add(reservation)
-    db.session.commit()
+    try:
+        reservation, spot_number = create_reservation(lot, current_user.id, vehicle_number, parking_timestamp, spot_type)
+    except ReservationError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('user_dashboard'))
 
-    flash(f'Spot {spot.spot_number} reserved successfully!', 'success')
+    flash(f'Spot {spot_number} reserved successfully!', 'success')
     return redirect(url_for('user_dashboard'))
 
 
@@ -515,41 +806,20 @@ def release_spot(reservation_id):
         flash('Access denied', 'danger')
         return redirect(url_for('user_dashboard'))
 
-    if reservation.payment_status != 'Pending':
-        flash('This reservation has already been paid.', 'info')
+    try:
+        payment = release_reservation(reservation)
+    except AlreadyReleasedError as e:
+        flash(str(e), 'info')
         return redirect(url_for('user_dashboard'))
 
-    spot = ParkingSpot.query.get(reservation.spot_id)
-    spot.status = 'A'  # Mark spot as available
-
-    reservation.leaving_timestamp = datetime.utcnow()
-
-    duration = reservation.leaving_timestamp - reservation.parking_timestamp
-    hours = max(1, duration.total_seconds() / 3600)
-    total_cost = round(hours * reservation.parking_cost_per_time, 2)
-
-    payment = Payment(
-        reservation_id=reservation.reservation_id,
-        amount=total_cost,
-        payment_method='Cash',
-        payment_status='Completed',
-        payment_timestamp=datetime.now()
-    )
-
-    reservation.payment_status = 'Paid'
-    db.session.add(payment)
-    db.session.commit()
-
-    flash(f'Spot released and payment of ₹{total_cost:.2f} recorded.', 'success')
+    flash(f'Spot released and payment of ₹{payment.amount:.2f} recorded.', 'success')
     return redirect(url_for('user_dashboard'))
 
 
 @app.route('/history')
 @login_required
 def history():
-    reservations = Reservation.query.filter_by(user_id=current_user.id).order_by(
-        Reservation.reservation_timestamp.desc()
-    ).all()
+    reservations = user_reservations(current_user.id)
     return render_template('history.html', reservations=reservations)
 
 
@@ -0,0 +1,147 @@
+import heapq
+import time
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload
+
+from models import db, Reservation, Payment, ParkingSpot, ArchivedReservation, ArchivedPayment
+from pagination import keyset_select, PER_PAGE
+from shards import fan_out
+
+ARCHIVE_BATCH_SIZE = 5000
+
+# (reservation model, payment model) of the hot tables and of the archive
+STORES = ((Reservation, Payment), (ArchivedReservation, ArchivedPayment))
+
+
+def _copy(source, target, condition):
+    """INSERT INTO target SELECT the matching rows of source, skipping rows target already has"""
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    columns = [column.name for column in source.__table__.columns]
+    db.session.execute(
+        dialect.insert(target).from_select(columns, db.select(*source.__table__.columns).where(condition))
+        .on_conflict_do_nothing()
+    )
+
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move up to batch_size Paid reservations parked before cutoff, and their payments, in one transaction.
+
+    Rows are copied before they are deleted and copies already in the
+    archive are skipped, so a batch interrupted at any point (even between
+    the two database files) is completed by running it again.
+    Returns the number of reservations moved.
+    """
+    # SQLite reuses the highest rowid once it is deleted; keeping the newest
+    # reservation and payment means an archived id is never handed out again
+    newest_reservation = db.session.query(db.func.max(Reservation.reservation_id)).scalar()
+    newest_payment = db.session.query(Payment.reservation_id).filter(
+        Payment.payment_id == db.session.query(db.func.max(Payment.payment_id)).scalar_subquery()).scalar()
+    ids = db.session.scalars(
+        db.select(Reservation.reservation_id)
+        .where(Reservation.payment_status == 'Paid', Reservation.parking_timestamp < cutoff,
+               Reservation.reservation_id.notin_([newest_reservation, newest_payment or -1]))
+        .order_by(Reservation.parking_timestamp)
+        .limit(batch_size)
+    ).all()
+    if not ids:
+        return 0
+
+    _copy(Reservation, ArchivedReservation, Reservation.reservation_id.in_(ids))
+    _copy(Payment, ArchivedPayment, Payment.reservation_id.in_(ids))
+    db.session.execute(db.delete(Payment).where(Payment.reservation_id.in_(ids))
+                       .execution_options(synchronize_session=False))
+    db.session.execute(db.delete(Reservation).where(Reservation.reservation_id.in_(ids))
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+    return len(ids)
+
+
+def archive_reservations(older_than, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None, pause=0.0, progress=None):
+    """Move every Paid reservation parked more than older_than ago into the archive, batch by batch.
+
+    Each batch commits on its own, so writers wait at most one batch and a
+    run that stops early (max_batches, a crash, a deploy) is resumed by the
+    next one. pause sleeps between batches to leave room for other writers;
+    progress(moved so far) is called after each batch.
+    Returns the number of reservations moved.
+    """
+    cutoff = datetime.now() - older_than
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        if progress:
+            progress(moved)
+        if pause:
+            time.sleep(pause)
+    return moved
+
+
+def _counts():
+    return {
+        'reservations': db.session.query(db.func.count(Reservation.reservation_id)).scalar(),
+        'payments': db.session.query(db.func.count(Payment.payment_id)).scalar(),
+        'archived_reservations': db.session.query(db.func.count(ArchivedReservation.reservation_id)).scalar(),
+        'archived_payments': db.session.query(db.func.count(ArchivedPayment.payment_id)).scalar(),
+    }
+
+
+def archive_counts():
+    """Reservations and payments in the hot tables and in the archive, over all shards"""
+    shard_counts = fan_out(_counts)
+    return {name: sum(counts[name] for counts in shard_counts) for name in shard_counts[0]}
+
+
+def user_reservations_select(R, user_id, status=None):
+    """SELECT of a user's reservations in R, live or archived, with spot, lot and payment joined in"""
+    statement = db.select(R).where(R.user_id == user_id).options(
+        joinedload(R.spot).joinedload(ParkingSpot.lot),
+        joinedload(R.payment)
+    )
+    if status:
+        statement = statement.where(R.payment_status == status)
+    return statement
+
+
+def reservation_page_selects(user_id, after=None, per_page=PER_PAGE, status=None):
+    """One keyset page query per store; merge their rows from every shard with merge_reservation_pages()"""
+    return [keyset_select(user_reservations_select(R, user_id, status), [R.reservation_timestamp, R.reservation_id],
+                          after=after, per_page=per_page) for R, _ in STORES]
+
+
+def _newest_first(reservation):
+    return reservation.reservation_timestamp or datetime.min, reservation.reservation_id
+
+
+def merge_reservation_pages(results, per_page=PER_PAGE):
+    """(rows, has_more) of the newest per_page reservations among the rows of reservation_page_selects()"""
+    rows, has_more = [], False
+    for result in results:
+        rows.extend(result[:per_page])
+        has_more = has_more or len(result) > per_page
+    rows.sort(key=_newest_first, reverse=True)
+    return rows[:per_page], has_more or len(rows) > per_page
+
+
+def user_reservations(user_id):
+    """All of a user's reservations, live and archived, on every shard, newest first"""
+    reservations = fan_out(lambda: [r for R, _ in STORES for r in db.session.scalars(user_reservations_select(R, user_id))])
+    return sorted((r for shard_reservations in reservations for r in shard_reservations),
+                  key=_newest_first, reverse=True)
+
+
+def user_reservation_page(user_id, after=None, per_page=PER_PAGE, status=None):
+    """One keyset page of a user's live and archived reservations on every shard, newest first; returns (rows, has_more)"""
+    results = fan_out(lambda: [db.session.scalars(statement).all()
+                               for statement in reservation_page_selects(user_id, after, per_page, status)])
+    return merge_reservation_pages([rows for shard_results in results for rows in shard_results], per_page)
+
+
+def merge_by_id(*streams):
+    """Merge row streams that are each ordered by their first column, the reservation id"""
+    return heapq.merge(*streams, key=lambda row: row[0])
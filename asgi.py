@@ -0,0 +1,227 @@
+"""ASGI entry point: the read-heavy JSON endpoints on an async engine, everything else on the Flask app.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+GET requests for the lot list, a lot, its availability, a user's
+reservations and the admin spot and user listings are answered on the event
+loop from an aiosqlite (or asyncpg) engine per database, so a slow read only
+holds a connection, not a worker; ASYNC_READ_LIMIT of them run at once and the
+rest queue. They return the same JSON as the /api/v1 views in api.py and use
+the same statements. All other requests, including every page and write, go
+to the unchanged Flask app on a thread pool of WSGI_THREADS threads;
+gunicorn app:app keeps working as before.
+"""
+import asyncio
+import os
+import re
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from sqlalchemy.ext.asyncio import AsyncSession
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date, is_resource_modified, parse_cookie, quote_etag
+
+import api
+from app import app as flask_app, user_cache
+from archive import reservation_page_selects, merge_reservation_pages
+from database import create_async_engines
+from models import User_Admin, ParkingLot
+from pagination import parse_timestamp_cursor, PER_PAGE
+from shards import shard_for_id
+
+JSON_HEADERS = [(b'content-type', b'application/json')]
+
+
+class Request:
+    """The parts of an ASGI GET request the read endpoints need"""
+
+    def __init__(self, scope, params):
+        self.scope = scope
+        self.params = params
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+        self.cookies = parse_cookie(self.headers.get('cookie', ''))
+
+
+class AsyncReads:
+    """Serves the read endpoints listed in routes natively and hands every other request to the WSGI app"""
+
+    def __init__(self, flask_app, user_cache, threads=10, max_reads=10):
+        self.flask_app = flask_app
+        self.user_cache = user_cache
+        # Requests beyond max_reads wait their turn instead of all interleaving
+        # their queries, which would stretch every one of them
+        self.reads = asyncio.Semaphore(max_reads)
+        self.wsgi = WSGIMiddleware(flask_app, workers=threads)
+        self.shards = flask_app.config['SHARDS']
+        self.engines = create_async_engines(flask_app)
+        self.routes = [
+            (re.compile(r'/api/v1/lots'), self.list_lots),
+            (re.compile(r'/api/v1/lots/(?P<lot_id>\d+)'), self.get_lot),
+            (re.compile(r'/api/v1/lots/(?P<lot_id>\d+)/availability'), self.get_availability),
+            (re.compile(r'/api/v1/reservations'), self.list_reservations),
+            (re.compile(r'/api/v1/admin/lots/(?P<lot_id>\d+)/spots'), self.list_lot_spots),
+            (re.compile(r'/api/v1/admin/users'), self.list_users),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            path, root = scope['path'], scope.get('root_path', '')
+            if root and path.startswith(root):
+                path = path[len(root):]
+            for pattern, endpoint in self.routes:
+                match = pattern.fullmatch(path)
+                if match:
+                    request = Request(scope, {key: int(value) for key, value in match.groupdict().items()})
+                    user = await self.current_user(request)
+                    if user is None and self.flask_app.config.get('REMEMBER_COOKIE_NAME',
+                                                                  'remember_token') in request.cookies:
+                        break  # Only Flask-Login can turn a remember-me cookie into a session
+                    status, body, headers = await self.dispatch(endpoint, request, user)
+                    return await self.respond(send, status, body, headers)
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for engine in self.engines.values():
+                    await engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, endpoint, request, user):
+        if user is None:
+            return 401, {'error': 'Authentication required'}, []
+        async with self.reads:
+            return await endpoint(request, user, **request.params)
+
+    async def respond(self, send, status, body, headers):
+        payload = b'' if body is None else (self.flask_app.json.dumps(body) + '\n').encode()
+        headers = (JSON_HEADERS if body is not None else []) + \
+            [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers] + \
+            [(b'content-length', str(len(payload)).encode())]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    def session(self, shard=None):
+        """An AsyncSession on one database; objects stay readable after it closes"""
+        return AsyncSession(self.engines[shard], expire_on_commit=False)
+
+    async def fan_out(self, fn, shards=None):
+        """await fn(session) on every shard (or the given ones) at once, returning the results in shard order"""
+        async def run(shard):
+            async with self.session(shard) as session:
+                return await fn(session)
+        return await asyncio.gather(*(run(shard) for shard in (self.shards if shards is None else shards)))
+
+    async def current_user(self, request):
+        """The logged-in user of Flask's signed session cookie, or None; shares the Flask app's user cache"""
+        value = request.cookies.get(self.flask_app.config['SESSION_COOKIE_NAME'])
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        if not value or serializer is None:
+            return None
+        try:
+            user_id = serializer.loads(value, max_age=int(self.flask_app.permanent_session_lifetime.total_seconds()))
+            user_id = int(user_id['_user_id'])
+        except (BadSignature, KeyError, TypeError, ValueError):
+            return None
+        user = self.user_cache.lookup(user_id)
+        if user is None:
+            async with self.session() as session:
+                user = await session.get(User_Admin, user_id)
+            self.user_cache.store(user)
+        return user
+
+    async def conditional(self, request, validators, render):
+        """Like api.conditional(): a JSON body from await render(), or an empty 304 when the client's copy is current"""
+        etag, last_modified = validators
+        environ = {'REQUEST_METHOD': 'GET'}
+        for header in ('if-none-match', 'if-modified-since'):
+            if header in request.headers:
+                environ['HTTP_' + header.upper().replace('-', '_')] = request.headers[header]
+        headers = [('etag', quote_etag(etag)), ('cache-control', 'private, no-cache')]
+        if last_modified is not None:
+            headers.append(('last-modified', http_date(last_modified)))
+        if is_resource_modified(environ, etag=etag, last_modified=last_modified):
+            return 200, await render(), headers
+        return 304, None, headers
+
+    async def list_lots(self, request, user):
+        async def versions(session):
+            return [tuple(row) for row in (await session.execute(api.ACTIVE_LOT_VERSIONS)).all()]
+
+        async def lots(session):
+            return [api.lot_json(lot) for lot in await session.scalars(api.ACTIVE_LOTS)]
+
+        async def render():
+            return {'lots': sorted((lot for shard_lots in await self.fan_out(lots) for lot in shard_lots),
+                                   key=lambda lot: lot['lot_id'])}
+        rows = sorted(row for shard_rows in await self.fan_out(versions) for row in shard_rows)
+        return await self.conditional(request, api.lots_validators(rows), render)
+
+    async def lot_view(self, request, lot_id, to_json):
+        async with self.session(shard_for_id(lot_id, self.shards)) as session:
+            validators = api.row_validators(lot_id, (await session.execute(api.lot_version_select(lot_id))).first())
+            if validators is None:
+                return 404, {'error': 'Lot not found'}, []
+
+            async def render():
+                return to_json(await session.get(ParkingLot, lot_id))
+            return await self.conditional(request, validators, render)
+
+    async def get_lot(self, request, user, lot_id):
+        return await self.lot_view(request, lot_id, api.lot_json)
+
+    async def get_availability(self, request, user, lot_id):
+        return await self.lot_view(request, lot_id, api.availability_json)
+
+    async def list_reservations(self, request, user):
+        statements = reservation_page_selects(user.id, after=parse_timestamp_cursor(request.args.get('before')),
+                                              status=request.args.get('status'))
+
+        async def page(session):
+            return [(await session.scalars(statement)).all() for statement in statements]
+        results = await self.fan_out(page)
+        reservations, has_more = merge_reservation_pages([rows for shard_results in results for rows in shard_results])
+        return 200, api.reservations_page_json(reservations, has_more), []
+
+    async def list_lot_spots(self, request, user, lot_id):
+        if user.role != 'admin':
+            return 403, {'error': 'Access denied'}, []
+        spots, active, free_by_type = api.lot_spots_selects(lot_id)
+        async with self.session(shard_for_id(lot_id, self.shards)) as session:
+            lot = await session.get(ParkingLot, lot_id)
+            if lot is None:
+                return 404, {'error': 'Lot not found'}, []
+            spots = (await session.scalars(spots)).all()
+            active = (await session.scalars(active)).all()
+            free_by_type = (await session.execute(free_by_type)).all()
+        users = []
+        if active:
+            async with self.session() as session:
+                users = (await session.scalars(api.users_select({r.user_id for r in active}))).all()
+        return 200, api.lot_spots_json(lot, spots, active, users, free_by_type), []
+
+    async def list_users(self, request, user):
+        if user.role != 'admin':
+            return 403, {'error': 'Access denied'}, []
+        async with self.session() as session:
+            users = (await session.scalars(api.users_page_select(request.args.get('q', '').strip(),
+                                                                 request.args.get('after')))).all()
+        user_ids = [listed.id for listed in users[:PER_PAGE]]
+        active = []
+        if user_ids:
+            async def shard_active(session):
+                return (await session.scalars(api.active_reservations_select(user_ids))).all()
+            active = [r for rows in await self.fan_out(shard_active) for r in rows]
+        return 200, api.users_page_json(users, active), []
+
+
+app = AsyncReads(flask_app, user_cache, threads=int(os.environ.get('WSGI_THREADS', 10)),
+                 max_reads=int(os.environ.get('ASYNC_READ_LIMIT', 10)))
@@ -0,0 +1,205 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import event
+
+from models import db, ParkingLot
+from shards import fan_out, group_by_shard, use_shard
+
+
+class InProcessBroker:
+    """Fans published messages out to the subscribers in this process.
+
+    Anything with the same publish/subscribe/unsubscribe methods can replace
+    it, e.g. a client for an external broker so that every worker process
+    sees every message.
+    """
+
+    def __init__(self, max_queued=100):
+        self.max_queued = max_queued
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # A stalled client keeps only the newest messages
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait(message)
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_queued)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+def _shard_availability(lot_ids):
+    query = db.session.query(ParkingLot.lot_id, ParkingLot.available_count, ParkingLot.occupied_count)
+    if lot_ids is None:
+        query = query.filter(ParkingLot.is_active == True)
+    else:
+        query = query.filter(ParkingLot.lot_id.in_(lot_ids))
+    return {lot_id: {'available': available, 'occupied': occupied} for lot_id, available, occupied in query}
+
+
+def lot_availability(lot_ids=None):
+    """{lot_id: {'available', 'occupied'}} from the lot counters, for all active lots or the given ones"""
+    availability = {}
+    if lot_ids is None:
+        for shard_availability in fan_out(_shard_availability, None):
+            availability.update(shard_availability)
+        return availability
+    # Only the shards holding the given lots are asked
+    for shard, ids in group_by_shard(lot_ids).items():
+        with use_shard(shard):
+            availability.update(_shard_availability(ids))
+    return availability
+
+
+class AvailabilityFeed:
+    """Publishes per-lot availability changes to subscribers.
+
+    Writers only mark lots as changed (ParkingLot.mark_changed); after their
+    transaction commits, a background thread waits AVAILABILITY_COALESCE
+    seconds to gather the rest of a burst, reads the counters of every lot
+    touched in that window in one query and publishes the lots whose
+    numbers actually moved as a single message. A lot that is removed is
+    sent as null.
+
+    Commits only reach the feed of the process that made them. With several
+    worker processes, set AVAILABILITY_POLL_INTERVAL (seconds) so each
+    process also rechecks all lot counters on that period.
+    """
+
+    def __init__(self, app=None, broker=None):
+        self.broker = broker or InProcessBroker()
+        self.published = 0
+        self._dirty = set()
+        self._last = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('AVAILABILITY_COALESCE', float(os.environ.get('AVAILABILITY_COALESCE', 0.5)))
+        app.config.setdefault('AVAILABILITY_POLL_INTERVAL', float(os.environ.get('AVAILABILITY_POLL_INTERVAL', 0)))
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    def _after_commit(self, session):
+        changed = session.info.pop('changed_lots', None)
+        if changed:
+            self.lots_changed(changed)
+
+    def _after_rollback(self, session):
+        session.info.pop('changed_lots', None)
+
+    def lots_changed(self, lot_ids):
+        """Queue lots for a recheck and publish on the next flush"""
+        with self._lock:
+            self._dirty.update(lot_ids)
+        self._ensure_started()
+        self._wakeup.set()
+
+    def subscribe(self):
+        self._ensure_started()
+        return self.broker.subscribe()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._last = None
+                threading.Thread(target=self._run, name='availability-feed', daemon=True).start()
+
+    def _run(self):
+        while True:
+            poll = self.app.config['AVAILABILITY_POLL_INTERVAL']
+            woken = self._wakeup.wait(poll or None)
+            if woken:
+                time.sleep(self.app.config['AVAILABILITY_COALESCE'])  # Let the burst finish
+            self._wakeup.clear()
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            with self.app.app_context():
+                try:
+                    self.flush(None if poll and not woken else dirty)
+                except Exception:
+                    self.app.logger.exception('Availability feed update failed')
+                finally:
+                    db.session.remove()
+
+    def flush(self, lot_ids=None):
+        """Publish the lots among lot_ids (all active lots if None) whose counters changed.
+
+        Returns the published message, or None when nothing changed.
+        """
+        if lot_ids is not None and not lot_ids:
+            return None
+        # Nothing to compare against on the first flush, so everything checked counts as changed
+        baseline = self._last is not None
+        if not baseline:
+            self._last = {}
+        current = lot_availability(lot_ids)
+        checked = set(self._last) | set(current) if lot_ids is None else set(lot_ids)
+
+        changes = {}
+        for lot_id in checked:
+            state = current.get(lot_id)
+            if not baseline or state != self._last.get(lot_id):
+                changes[lot_id] = state
+                if state is None:
+                    self._last.pop(lot_id, None)
+                else:
+                    self._last[lot_id] = state
+        if not changes:
+            return None
+        message = {'lots': changes}
+        self.published += 1
+        self.broker.publish(message)
+        return message
+
+    def stream(self, snapshot, heartbeat=15, max_age=300):
+        """Server-Sent Events: the snapshot, then each change message, until max_age seconds.
+
+        Browsers reconnect on their own when the stream ends, which keeps a
+        worker thread from being held by one client indefinitely.
+        """
+        subscriber = self.subscribe()
+        try:
+            yield 'retry: 3000\n\n'
+            yield f'event: snapshot\ndata: {json.dumps({"lots": snapshot})}\n\n'
+            deadline = time.monotonic() + max_age
+            while time.monotonic() < deadline:
+                try:
+                    message = subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f'event: availability\ndata: {json.dumps(message)}\n\n'
+        finally:
+            self.broker.unsubscribe(subscriber)
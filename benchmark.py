@@ -0,0 +1,1690 @@
+"""Benchmarks for the database hot paths of ParkEase.
+
+Each scenario seeds a throwaway SQLite database, so the application database
+in instance/ is never touched.
+
+Usage:
+    python benchmark.py utilization
+    python benchmark.py startup [--max-import-ms 800]
+    python benchmark.py pages
+    python benchmark.py reserve [--requests 4000 --workers 16]
+    python benchmark.py lots
+    python benchmark.py load [--profiles baseline wal --workers 8 --duration 10]
+    python benchmark.py session
+    python benchmark.py export [--reservations 10000 100000 300000]
+    python benchmark.py analytics [--reservations 200000]
+    python benchmark.py users [--users 10000 100000 1000000]
+    python benchmark.py feed [--reservations 500 --subscribers 200]
+    python benchmark.py api [--polls 2000 --change-every 20]
+    python benchmark.py allocation [--spots 100000 --ev-every 50]
+    python benchmark.py instrumentation [--requests 300]
+    python benchmark.py batch [--vehicles 50 200]
+    python benchmark.py login [--login-threads 16 --workers 0 1 2]
+    python benchmark.py fragments [--lots 10 50 200]
+    python benchmark.py archive [--reservations 2000000 --users 20000]
+    python benchmark.py workload [--processes 4 --duration 20 --json results.json --compare baseline.json]
+    python benchmark.py shards [--shards 1 2 4 --workers 8 --duration 10]
+    python benchmark.py asgi [--concurrency 10 50 200 500 --duration 10 --slo-ms 500]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import queue
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import Flask, has_app_context
+from sqlalchemy import event, insert
+from sqlalchemy.exc import OperationalError
+
+from werkzeug.security import generate_password_hash
+
+from database import init_database
+from models import db, ParkingLot, ParkingSpot, Reservation, Payment, User_Admin
+from shards import init_shard_routing, prepare_shards
+
+
+def make_app(path):
+    """Minimal Flask app on a scratch SQLite file, with app.py's database setup and shard routing"""
+    bench_app = Flask(__name__)
+    bench_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    environ = {'DATABASE_URL': f'sqlite:///{path}'}
+    if 'DB_PROFILE' in os.environ:
+        environ['DB_PROFILE'] = os.environ['DB_PROFILE']
+    init_database(bench_app, environ)
+    init_shard_routing(bench_app)
+    return bench_app
+
+
+@contextmanager
+def scratch_app():
+    """Yield an app context on a fresh database that is removed afterwards"""
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_app = make_app(os.path.join(tmp, 'bench.db'))
+        with bench_app.app_context():
+            # Only this app's database: db lists the bind keys of every app in the process
+            db.create_all(bind_key=None)
+            prepare_shards()
+            yield bench_app
+            db.session.remove()
+            db.engine.dispose()
+
+
+@contextmanager
+def scratch_parking_app():
+    """Yield the real application module, bound to a fresh database.
+
+    No app context is left pushed, so test client requests each get their own
+    session and g, as they would in production. app.py reads DATABASE_URL at
+    import time, so this can be used once per process.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        os.environ['EXPIRY_SWEEP_INTERVAL'] = '0'
+        import app as parking
+        with parking.app.app_context():
+            db.create_all()
+        yield parking
+        with parking.app.app_context():
+            db.engine.dispose()
+
+
+def login_as(client, user_id):
+    """Mark a test client session as logged in without going through the password hash"""
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+class QueryCounter:
+    """Counts SQL statements sent to the engine while active"""
+
+    def __init__(self, engine=None):
+        self.engine = engine or db.engine
+        self.count = 0
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_execute)
+
+
+def measure(fn, repeat=5, engine=None):
+    """Run fn repeatedly and return (best seconds, statements per run)"""
+    best = float('inf')
+    with QueryCounter(engine) as counter:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+            if has_app_context():
+                db.session.expire_all()
+    return best, counter.count // repeat
+
+
+def seed_lots(n_lots, spots_per_lot, occupied_ratio=0.3):
+    """Insert n_lots lots with spots_per_lot spots each, a share of them occupied"""
+    db.session.execute(insert(ParkingLot), [
+        {
+            'prime_location_name': f'Lot {i}',
+            'price': 20.0,
+            'capacity': spots_per_lot,
+            'address': f'{i} Bench Road',
+            'pincode': f'{600000 + i % 100}',
+            'contact': 9000000000 + i,
+            'is_active': True,
+        }
+        for i in range(1, n_lots + 1)
+    ])
+    occupied_per_lot = int(spots_per_lot * occupied_ratio)
+    lot_ids = [lot_id for (lot_id,) in db.session.query(ParkingLot.lot_id)]
+    for lot_id in lot_ids:
+        db.session.execute(insert(ParkingSpot), [
+            {
+                'lot_id': lot_id,
+                'spot_number': f'B-{lot_id}-{i:03d}',
+                'status': 'O' if i <= occupied_per_lot else 'A',
+            }
+            for i in range(1, spots_per_lot + 1)
+        ])
+    db.session.execute(db.update(ParkingLot).values(
+        available_count=spots_per_lot - occupied_per_lot,
+        occupied_count=occupied_per_lot,
+    ))
+    db.session.commit()
+
+
+def seed_users(n_users, role='user', password='password123'):
+    """Insert n_users users sharing one password and return their ids"""
+    password_hash = generate_password_hash(password)
+    start = (db.session.query(db.func.max(User_Admin.id)).scalar() or 0) + 1
+    for chunk in range(start, start + n_users, 50000):
+        db.session.execute(insert(User_Admin), [
+            {
+                'username': f'{role}{i}',
+                'email': f'{role}{i}@bench.parkease.com',
+                'password_hash': password_hash,
+                'role': role,
+            }
+            for i in range(chunk, min(chunk + 50000, start + n_users))
+        ])
+    db.session.commit()
+    return [user_id for (user_id,) in db.session.query(User_Admin.id).filter(User_Admin.id >= start)]
+
+
+def seed_history(user_ids, per_user, start=datetime(2025, 1, 1)):
+    """Insert per_user completed, paid reservations for each user, spread over all spots"""
+    spots = db.session.query(ParkingSpot.spot_id, ParkingLot.price).join(ParkingLot).all()
+    seeded = db.session.query(db.func.max(Reservation.reservation_id)).scalar() or 0
+    rows = []
+    for n, user_id in enumerate(user_ids):
+        for i in range(per_user):
+            spot_id, price = spots[(n * per_user + i) % len(spots)]
+            parked = start + timedelta(hours=7 * i + n % 24)
+            rows.append({
+                'spot_id': spot_id,
+                'user_id': user_id,
+                'reservation_timestamp': parked - timedelta(minutes=30),
+                'parking_timestamp': parked,
+                'leaving_timestamp': parked + timedelta(hours=1 + i % 5),
+                'parking_cost_per_time': price,
+                'vehicle_number': f'TN{user_id:05d}{i:05d}',
+                'payment_status': 'Paid',
+            })
+    for chunk in range(0, len(rows), 5000):
+        db.session.execute(insert(Reservation), rows[chunk:chunk + 5000])
+    db.session.execute(db.insert(Payment).from_select(
+        ['reservation_id', 'amount', 'payment_method', 'payment_status', 'payment_timestamp'],
+        db.select(
+            Reservation.reservation_id,
+            Reservation.parking_cost_per_time * 2,
+            db.literal('Cash'),
+            db.literal('Completed'),
+            Reservation.leaving_timestamp,
+        ).where(
+            Reservation.reservation_id > seeded,
+            Reservation.payment_status == 'Paid',
+        )
+    ))
+    db.session.commit()
+
+
+def seed_active_reservations(user_ids):
+    """Give every occupied spot a Pending reservation, round-robin over user_ids"""
+    occupied = db.session.query(ParkingSpot.spot_id, ParkingLot.price).join(ParkingLot) \
+        .filter(ParkingSpot.status == 'O').all()
+    now = datetime.now()
+    db.session.execute(insert(Reservation), [
+        {
+            'spot_id': spot_id,
+            'user_id': user_ids[i % len(user_ids)],
+            'reservation_timestamp': now,
+            'parking_timestamp': now,
+            'parking_cost_per_time': price,
+            'vehicle_number': f'KA{spot_id:08d}',
+            'payment_status': 'Pending',
+        }
+        for i, (spot_id, price) in enumerate(occupied)
+    ])
+    db.session.commit()
+
+
+def report(title, header, rows):
+    print(f'\n{title}')
+    print('  '.join(f'{h:>14}' for h in header))
+    for row in rows:
+        print('  '.join(f'{v:>14.2f}' if isinstance(v, float) else f'{v:>14}' for v in row))
+
+
+def bench_utilization(args):
+    """Per-lot COUNT loop of the old admin_dashboard vs reports.lot_utilization"""
+    from reports import lot_utilization, utilization_summary
+
+    def per_lot_counts():
+        ParkingSpot.query.count()
+        ParkingSpot.query.filter_by(status='A').count()
+        for lot in ParkingLot.query.all():
+            ParkingSpot.query.filter_by(lot_id=lot.lot_id).count()
+            ParkingSpot.query.filter_by(lot_id=lot.lot_id, status='O').count()
+
+    def grouped():
+        utilization_summary(lot_utilization())
+
+    rows = []
+    for n_lots in args.lots:
+        with scratch_app():
+            seed_lots(n_lots, args.spots)
+            old_time, old_queries = measure(per_lot_counts)
+            new_time, new_queries = measure(grouped)
+            rows.append((n_lots, old_queries, old_time * 1000, new_queries, new_time * 1000))
+    report(f'Lot utilization ({args.spots} spots per lot)',
+           ('lots', 'loop queries', 'loop ms', 'grouped queries', 'grouped ms'), rows)
+
+
+def bench_pages(args):
+    """SQL statements per page of the history and spot views as a user's history grows"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(3, args.spots)
+            admin_id = seed_users(1, role='admin')[0]
+            user_ids = seed_users(20)
+            seed_active_reservations(user_ids)
+            engine = db.engine
+        target = user_ids[0]
+
+        admin = parking.app.test_client()
+        login_as(admin, admin_id)
+        user = parking.app.test_client()
+        login_as(user, target)
+        pages = [
+            ('user history', admin, f'/admin/user/{target}/history'),
+            ('spots', admin, '/admin/lot/1/spots'),
+            ('history', user, '/history'),
+        ]
+
+        rows, statements = [], {}
+        seeded = 0
+        for size in args.reservations:
+            with parking.app.app_context():
+                seed_history([target], size - seeded)
+            seeded = size
+            for name, client, url in pages:
+                def fetch():
+                    assert client.get(url).status_code == 200
+                elapsed, count = measure(fetch, repeat=3, engine=engine)
+                statements.setdefault(name, set()).add(count)
+                rows.append((size, name, count, elapsed * 1000))
+        report('Statements per page', ('reservations', 'page', 'statements', 'ms'), rows)
+
+    growing = [name for name, counts in statements.items() if len(counts) > 1]
+    if growing:
+        sys.exit(f'statement count grows with history size on: {", ".join(growing)}')
+
+
+def _reserve_worker(parking, user_id, lot_id, vehicles, results):
+    with parking.app.app_context():
+        db.engine.dispose(close=False)  # Never share pooled connections across fork
+    client = parking.app.test_client()
+    login_as(client, user_id)
+    errors = 0
+    for vehicle in vehicles:
+        response = client.post(f'/reserve/{lot_id}', data={
+            'vehicle_number': vehicle,
+            'parking_time': '2026-01-01T09:00',
+        })
+        errors += response.status_code != 302
+        with client.session_transaction() as session:
+            session.pop('_flashes', None)  # Redirects are not followed, so nothing else reads them
+    results.put(errors)
+
+
+def bench_reserve(args):
+    """Parallel reservations against one lot: double-booking check and reservations/sec"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(1, args.spots, occupied_ratio=0)
+            user_ids = seed_users(args.workers)
+            lot_id = ParkingLot.query.first().lot_id
+
+        ctx = multiprocessing.get_context('fork')
+        results = ctx.Queue()
+        per_worker = args.requests // args.workers
+        workers = [
+            ctx.Process(target=_reserve_worker, args=(
+                parking, user_id, lot_id, [f'ST{n:03d}{i:05d}' for i in range(per_worker)], results))
+            for n, user_id in enumerate(user_ids)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        errors = sum(results.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        with parking.app.app_context():
+            reserved = Reservation.query.count()
+            double_booked = db.session.query(Reservation.spot_id).group_by(Reservation.spot_id) \
+                .having(db.func.count() > 1).count()
+            occupied = ParkingSpot.query.filter_by(status='O').count()
+            drifted = ParkingLot.rebuild_counts(fix=False)
+
+    report(f'Parallel reservations ({args.workers} processes, {args.spots} spots)',
+           ('requests', 'reserved', 'errors', 'double booked', 'reserv/sec'),
+           [(per_worker * args.workers, reserved, errors, double_booked, reserved / elapsed)])
+    expected = min(per_worker * args.workers, args.spots)
+    if double_booked or errors or reserved != expected or occupied != reserved or drifted:
+        sys.exit(f'allocation is inconsistent: {reserved} reservations for {occupied} occupied spots '
+                 f'(expected {expected}), {double_booked} double-booked, {errors} failed requests, '
+                 f'{len(drifted)} lot counter(s) drifted')
+
+
+def bench_lots(args):
+    """Lot creation and resizing through the admin routes, against one ORM object per spot"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            admin_id = seed_users(1, role='admin')[0]
+        admin = parking.app.test_client()
+        login_as(admin, admin_id)
+
+        def timed_post(url, data):
+            start = time.perf_counter()
+            response = admin.post(url, data=data)
+            assert response.status_code == 302, response.status_code
+            return (time.perf_counter() - start) * 1000
+
+        rows = []
+        for capacity in args.capacity:
+            orm_ms = None
+            if not args.skip_orm:
+                with parking.app.app_context():
+                    start = time.perf_counter()
+                    lot = ParkingLot(prime_location_name='ORM', price=10, capacity=capacity,
+                                     address='x', pincode='600001', contact=1)
+                    db.session.add(lot)
+                    db.session.commit()
+                    for i in range(1, capacity + 1):
+                        db.session.add(ParkingSpot(lot_id=lot.lot_id, spot_number=f'ORM-{lot.lot_id}-{i:03d}', status='A'))
+                    db.session.commit()
+                    orm_ms = (time.perf_counter() - start) * 1000
+
+            fields = {'name': f'Bench {capacity}', 'price': '10', 'address': 'x', 'pincode': '600001', 'contact': '1'}
+            create_ms = timed_post('/admin/lot/create', dict(fields, capacity=str(capacity)))
+            with parking.app.app_context():
+                lot_id = db.session.query(db.func.max(ParkingLot.lot_id)).scalar()
+            edit = f'/admin/lot/edit/{lot_id}'
+            grow_ms = timed_post(edit, {'name': fields['name'], 'option': 'capacity', 'capacity': str(capacity * 2)})
+            shrink_ms = timed_post(edit, {'name': fields['name'], 'option': 'capacity', 'capacity': str(capacity)})
+            with parking.app.app_context():
+                assert ParkingSpot.query.filter_by(lot_id=lot_id).count() == capacity
+            rows.append((capacity, orm_ms if orm_ms is not None else '-', create_ms, grow_ms, shrink_ms))
+        report('Lot creation and resizing (ms)', ('spots', 'orm create', 'create', 'grow x2', 'shrink back'), rows)
+
+
+def _load_request(client, counts, url, data=None):
+    """Issue one request, tallying it as ok, a lock error or another error"""
+    counts['requests'] += 1
+    try:
+        response = client.post(url, data=data) if data is not None else client.get(url)
+    except OperationalError as e:
+        counts['lock errors' if 'locked' in str(e.orig) else 'errors'] += 1
+        return None
+    if response.status_code >= 500:
+        counts['errors'] += 1
+    return response
+
+
+def _load_worker(parking, user_id, lot_ids, duration, results):
+    with parking.app.app_context():
+        db.engine.dispose(close=False)  # Never share pooled connections across fork
+    parking.app.testing = True  # Let database errors reach the client so they can be counted
+    client = parking.app.test_client()
+    login_as(client, user_id)
+
+    counts = Counter()
+    deadline = time.monotonic() + duration
+    n = 0
+    while time.monotonic() < deadline:
+        vehicle = f'LD{user_id:04d}{n:06d}'
+        lot_id = lot_ids[n % len(lot_ids)]
+        n += 1
+        _load_request(client, counts, '/user_dashboard')
+        _load_request(client, counts, f'/reserve/{lot_id}',
+                      {'vehicle_number': vehicle, 'parking_time': '2026-01-01T09:00'})
+        _load_request(client, counts, '/history')
+        with parking.app.app_context():
+            reservation_id = db.session.query(Reservation.reservation_id).filter_by(
+                vehicle_number=vehicle, payment_status='Pending').scalar()
+        if reservation_id:
+            _load_request(client, counts, f'/release/{reservation_id}', {})
+    results.put(counts)
+
+
+def _load_profile(profile, args, results):
+    os.environ['DB_PROFILE'] = profile
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(args.lots, args.spots, occupied_ratio=0)
+            user_ids = seed_users(args.workers)
+            lot_ids = [lot_id for (lot_id,) in db.session.query(ParkingLot.lot_id)]
+
+        ctx = multiprocessing.get_context('fork')
+        worker_results = ctx.Queue()
+        workers = [ctx.Process(target=_load_worker, args=(parking, user_id, lot_ids, args.duration, worker_results))
+                   for user_id in user_ids]
+        for worker in workers:
+            worker.start()
+        counts = sum((worker_results.get() for _ in workers), Counter())
+        for worker in workers:
+            worker.join()
+    results.put(counts)
+
+
+def bench_load(args):
+    """Mixed user traffic from parallel workers under each DB_PROFILE: requests/sec and lock errors"""
+    rows = []
+    for profile in args.profiles:
+        # A fresh interpreter per profile, since app.py applies DB_PROFILE at import
+        ctx = multiprocessing.get_context('spawn')
+        results = ctx.Queue()
+        runner = ctx.Process(target=_load_profile, args=(profile, args, results))
+        runner.start()
+        counts = results.get()
+        runner.join()
+        rows.append((profile, counts['requests'], counts['requests'] / args.duration,
+                     counts['lock errors'], 100.0 * counts['lock errors'] / max(counts['requests'], 1),
+                     counts['errors']))
+    report(f'Load test ({args.workers} workers, {args.duration}s per profile)',
+           ('profile', 'requests', 'req/sec', 'lock errors', 'lock err %', 'other errors'), rows)
+
+
+STARTUP_PROBE = '''
+import sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/')
+served = time.perf_counter()
+print(imported - start, served - imported, int('matplotlib' in sys.modules))
+'''
+
+
+def bench_session(args):
+    """SQL statements per request on the busiest user routes, with and without the user cache"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(3, args.spots, occupied_ratio=0)
+            user_id = seed_users(1)[0]
+            seed_history([user_id], 20)
+            engine = db.engine
+        client = parking.app.test_client()
+        login_as(client, user_id)
+        vehicles = (f'SESS{i:05d}' for i in range(10 ** 5))
+
+        def reserve():
+            client.post('/reserve/1', data={'vehicle_number': next(vehicles),
+                                            'parking_time': '2026-01-01T09:00'})
+            with client.session_transaction() as session:
+                session.pop('_flashes', None)
+        routes = [
+            ('user_dashboard', lambda: client.get('/user_dashboard')),
+            ('history', lambda: client.get('/history')),
+            ('reserve_spot', reserve),
+        ]
+
+        rows, saved = [], []
+        for name, fetch in routes:
+            counts = {}
+            for label, ttl in (('off', 0), ('on', 60)):
+                parking.user_cache.ttl = ttl
+                parking.user_cache.invalidate()
+                fetch()  # Warm the cache when it is on
+                elapsed, counts[label] = measure(fetch, repeat=args.repeat, engine=engine)
+                rows.append((name, label, counts[label], elapsed * 1000))
+            saved.append(counts['off'] - counts['on'])
+        report('Statements per request', ('route', 'user cache', 'statements', 'best ms'), rows)
+        print(f'\nuser cache: {parking.user_cache.stats()}')
+
+    if min(saved) < 1:
+        sys.exit('the user cache did not save a query on every route')
+
+
+def bench_export(args):
+    """Streaming reservation export: rows/sec and peak Python memory as the table grows"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(10, 100, occupied_ratio=0)
+            admin_id = seed_users(1, role='admin')[0]
+            user_ids = seed_users(100)
+        client = parking.app.test_client()
+        login_as(client, admin_id)
+
+        rows, peaks = [], []
+        seeded = 0
+        for size in args.reservations:
+            with parking.app.app_context():
+                seed_history(user_ids, (size - seeded) // len(user_ids))
+                total = db.session.query(db.func.count(Reservation.reservation_id)).scalar()
+            seeded = size
+            for fmt in ('csv', 'ndjson'):
+                tracemalloc.start()
+                start = time.perf_counter()
+                response = client.get(f'/admin/export/reservations.{fmt}', buffered=False)
+                exported = sum(chunk.count(b'\n') for chunk in response.response)
+                response.close()
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+                exported -= fmt == 'csv'  # Header line
+                if exported != total:
+                    sys.exit(f'{fmt} export returned {exported} rows, expected {total}')
+                peaks.append(peak)
+                rows.append((total, fmt, elapsed, total / elapsed, peak))
+        report('Reservation export', ('reservations', 'format', 'seconds', 'rows/sec', 'peak MiB'), rows)
+
+    if max(peaks) > 4 * min(peaks) + 1:
+        sys.exit('export memory grows with the number of reservations')
+
+
+def bench_analytics(args):
+    """Analytics range queries from the rollup tables against aggregating the raw payment rows"""
+    with scratch_parking_app() as parking:
+        from analytics import rebuild_usage_rollups, usage_report
+
+        with parking.app.app_context():
+            seed_lots(args.lots, 50, occupied_ratio=0)
+            user_ids = seed_users(100)
+            seed_history(user_ids, args.reservations // len(user_ids))
+            start = time.perf_counter()
+            payments = rebuild_usage_rollups()
+            db.session.commit()
+            print(f'Backfilled rollups from {payments} payments in {time.perf_counter() - start:.2f} s')
+
+            first = db.session.query(db.func.min(Payment.payment_timestamp)).scalar().date()
+            day = db.func.date(Payment.payment_timestamp)
+
+            def raw_report(end):
+                # What the report would cost without rollups: group every payment in range
+                return db.session.query(ParkingSpot.lot_id, day, db.func.count(), db.func.sum(Payment.amount)) \
+                    .join(Reservation, Payment.reservation_id == Reservation.reservation_id) \
+                    .join(ParkingSpot, Reservation.spot_id == ParkingSpot.spot_id) \
+                    .filter(Payment.payment_timestamp >= first, Payment.payment_timestamp < end + timedelta(days=1)) \
+                    .group_by(ParkingSpot.lot_id, day).all()
+
+            rows, slowest = [], 0
+            for days in args.days:
+                end = first + timedelta(days=days - 1)
+                rollup_s, statements = measure(lambda: usage_report(first, end), repeat=args.repeat)
+                raw_s, _ = measure(lambda: raw_report(end), repeat=args.repeat)
+                slowest = max(slowest, rollup_s)
+                rows.append((days, statements, rollup_s * 1000, raw_s * 1000))
+        report('Analytics report by range', ('days', 'statements', 'rollup ms', 'raw scan ms'), rows)
+
+    if args.max_ms and slowest * 1000 > args.max_ms:
+        sys.exit(f'slowest report took {slowest * 1000:.0f} ms, limit is {args.max_ms} ms')
+
+
+def bench_users(args):
+    """Latency of the paginated, searchable users page as the number of users grows"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(2, 100, occupied_ratio=0.5)
+            admin_id = seed_users(1, role='admin')[0]
+            parked = seed_users(50)
+            seed_active_reservations(parked)
+            seed_history(parked, 10)
+            engine = db.engine
+        client = parking.app.test_client()
+        login_as(client, admin_id)
+        middle = parking.encode_cursor
+
+        rows, latencies = [], {}
+        seeded = 51
+        for size in args.users:
+            with parking.app.app_context():
+                seed_users(size - seeded)
+                # A cursor half way through the username order
+                name, user_id = db.session.query(User_Admin.username, User_Admin.id).order_by(
+                    User_Admin.username, User_Admin.id).offset(size // 2).first()
+            seeded = size
+            pages = [
+                ('first page', '/admin/users'),
+                ('middle page', f'/admin/users?after={middle([name, user_id])}'),
+                ('sorted by email', '/admin/users?sort=email&dir=desc'),
+                ('username prefix', '/admin/users?q=user4&field=username'),
+                ('vehicle prefix', '/admin/users?q=TN0&field=vehicle'),
+                ('dashboard', '/admin_dashboard'),
+            ]
+            for name_, url in pages:
+                def fetch():
+                    assert client.get(url).status_code == 200
+                fetch()
+                elapsed, statements = measure(fetch, repeat=args.repeat, engine=engine)
+                latencies.setdefault(name_, []).append(elapsed)
+                rows.append((size, name_, statements, elapsed * 1000))
+        report('Users page latency', ('users', 'page', 'statements', 'best ms'), rows)
+
+    growing = [name for name, times in latencies.items() if max(times) > args.max_growth * min(times)]
+    if growing:
+        sys.exit(f'latency grew more than {args.max_growth}x on: {", ".join(growing)}')
+
+
+def bench_feed(args):
+    """Live availability feed: messages and queries per burst of reservations, against dashboard reloads"""
+    with scratch_parking_app() as parking:
+        parking.app.config['AVAILABILITY_COALESCE'] = args.coalesce
+        with parking.app.app_context():
+            seed_lots(args.lots, args.reservations, occupied_ratio=0)
+            user_id = seed_users(1)[0]
+            engine = db.engine
+        client = parking.app.test_client()
+        login_as(client, user_id)
+        feed = parking.availability_feed
+
+        def reload_dashboard():
+            assert client.get('/user_dashboard').status_code == 200
+        reload_s, reload_statements = measure(reload_dashboard, engine=engine)
+
+        subscribers = [feed.subscribe() for _ in range(args.subscribers)]
+        time.sleep(args.coalesce * 2)  # Let the feed thread settle before the burst
+        published_before = feed.published
+
+        start = time.perf_counter()
+        for i in range(args.reservations):
+            client.post(f'/reserve/{i % args.lots + 1}', data={
+                'vehicle_number': f'FEED{i:06d}',
+                'parking_time': '2026-01-01T09:00',
+            })
+            with client.session_transaction() as session:
+                session.pop('_flashes', None)
+        burst_s = time.perf_counter() - start
+
+        # Wait until the first subscriber has seen the final count of every lot
+        expected = {lot_id: args.reservations - (args.reservations - lot_id + args.lots) // args.lots
+                    for lot_id in range(1, args.lots + 1)}
+        seen, deadline = {}, time.monotonic() + 30
+        while seen != expected and time.monotonic() < deadline:
+            try:
+                message = subscribers[0].get(timeout=1)
+            except queue.Empty:
+                continue
+            seen.update({lot_id: state['available'] for lot_id, state in message['lots'].items()})
+        settled_s = time.perf_counter() - start - burst_s
+        if seen != expected:
+            sys.exit(f'feed did not deliver the final counts: {seen} != {expected}')
+
+        published = feed.published - published_before
+        for subscriber in subscribers:
+            feed.broker.unsubscribe(subscriber)
+
+    changes = args.reservations
+    report(f'{changes} reservations over {args.lots} lots in {burst_s:.2f} s, {args.subscribers} watchers',
+           ('delivery', 'updates sent', 'statements'),
+           [('feed', published, published),
+            ('reload/change', changes * args.subscribers, changes * args.subscribers * reload_statements)])
+    print(f'\nLast update reached watchers {settled_s * 1000:.0f} ms after the burst; '
+          f'one dashboard reload takes {reload_s * 1000:.1f} ms')
+
+
+def bench_api(args):
+    """Polling the JSON API with and without conditional requests while lots slowly change"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(args.lots, args.spots, occupied_ratio=0.2)
+            user_id = seed_users(1)[0]
+            engine = db.engine
+        client = parking.app.test_client()
+        login_as(client, user_id)
+        writer = parking.app.test_client()
+        login_as(writer, user_id)
+
+        rows, changes = [], iter(range(10 ** 6))
+        for url in ('/api/v1/lots', '/api/v1/lots/1/availability'):
+            for conditional in (False, True):
+                etag, not_modified, sent = None, 0, 0
+                start = time.perf_counter()
+                with QueryCounter(engine) as counter:
+                    for i in range(args.polls):
+                        if i % args.change_every == 0:
+                            # Someone parks in lot 1, changing its availability
+                            with QueryCounter(engine) as writes:
+                                assert writer.post('/api/v1/lots/1/reservations', json={
+                                    'vehicle_number': f'POLL{next(changes):06d}'}).status_code == 201
+                            counter.count -= writes.count
+                        headers = {'If-None-Match': etag} if conditional and etag else {}
+                        response = client.get(url, headers=headers)
+                        if response.status_code == 304:
+                            not_modified += 1
+                        else:
+                            etag = response.headers['ETag']
+                        sent += len(response.data)
+                elapsed = time.perf_counter() - start
+                rows.append((url.replace('/api/v1', ''), 'yes' if conditional else 'no', not_modified,
+                             counter.count / args.polls, elapsed / args.polls * 1000, sent // args.polls))
+        report(f'{args.polls} polls, a change every {args.change_every}',
+               ('resource', 'conditional', '304s', 'stmts/poll', 'ms/poll', 'bytes/poll'), rows)
+
+
+def bench_allocation(args):
+    """Cost of claiming the lowest free spot, typed and untyped, with and without the free-list index"""
+    from allocation import claim_spot
+
+    with scratch_app():
+        seed_lots(1, args.spots, occupied_ratio=0)
+        db.session.execute(db.update(ParkingSpot).where(ParkingSpot.spot_id % args.ev_every == 0)
+                           .values(spot_type='EV'))
+        db.session.commit()
+
+        layouts = [
+            ('empty', None),
+            ('90% full', ParkingSpot.spot_id <= args.spots * 9 // 10),
+            ('EV bays taken', ParkingSpot.spot_type == 'EV'),
+        ]
+        rows = []
+        for indexed in (True, False):
+            if not indexed:
+                db.session.execute(db.text('DROP INDEX ix_parking_spot_lot_status_type'))
+                db.session.commit()
+            for layout, occupied in layouts:
+                db.session.execute(db.update(ParkingSpot).values(status='A'))
+                if occupied is not None:
+                    db.session.execute(db.update(ParkingSpot).where(occupied).values(status='O'))
+                db.session.commit()
+                for spot_type in ('EV', None):
+                    def claim():
+                        claim_spot(1, spot_type)
+                        db.session.rollback()
+                    elapsed, statements = measure(claim, repeat=args.repeat)
+                    rows.append(('yes' if indexed else 'no', layout, spot_type or 'any',
+                                 statements, elapsed * 1000))
+    report(f'Claiming a spot in a lot of {args.spots} (every {args.ev_every}th is EV)',
+           ('free-list index', 'lot', 'type', 'statements', 'best ms'), rows)
+
+
+def bench_batch(args):
+    """Reserving and releasing a fleet: one request per vehicle against the batch endpoints"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(1, args.spots, occupied_ratio=0)
+            user_id = seed_users(1)[0]
+            engine = db.engine
+        client = parking.app.test_client()
+        login_as(client, user_id)
+        fleets = iter(range(10 ** 6))
+
+        def one_at_a_time(vehicles):
+            ids = []
+            for vehicle in vehicles:
+                response = client.post('/api/v1/lots/1/reservations', json={'vehicle_number': vehicle})
+                assert response.status_code == 201
+                ids.append(response.get_json()['reservation_id'])
+            return ids, lambda: [client.post(f'/api/v1/reservations/{i}/release') for i in ids]
+
+        def batched(vehicles):
+            response = client.post('/api/v1/lots/1/reservations/batch', json={'vehicle_numbers': vehicles})
+            ids = [result['reservation_id'] for result in response.get_json()['results']]
+            return ids, lambda: client.post('/api/v1/reservations/release', json={'reservation_ids': ids})
+
+        rows = []
+        for size in args.vehicles:
+            for mode, run in (('one at a time', one_at_a_time), ('batch', batched)):
+                fleet = next(fleets)
+                vehicles = [f'FL{fleet:04d}{i:04d}' for i in range(size)]
+                with QueryCounter(engine) as reserve_sql:
+                    start = time.perf_counter()
+                    ids, release = run(vehicles)
+                    reserve_s = time.perf_counter() - start
+                assert len(ids) == size
+                with QueryCounter(engine) as release_sql:
+                    start = time.perf_counter()
+                    release()
+                    release_s = time.perf_counter() - start
+                with parking.app.app_context():
+                    assert Payment.query.filter(Payment.reservation_id.in_(ids)).count() == size
+                rows.append((size, mode, reserve_s * 1000, size / reserve_s, reserve_sql.count,
+                             release_s * 1000, size / release_s, release_sql.count))
+    report('Fleet reservations', ('vehicles', 'mode', 'reserve ms', 'reserved/s', 'statements',
+                                  'release ms', 'released/s', 'statements'), rows)
+
+
+def bench_login(args):
+    """A login storm with the password hashing pool at several sizes: logins/sec and dashboard latency alongside"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(5, 200, occupied_ratio=0.3)
+            user_ids = seed_users(args.users)
+        config = parking.app.config
+        config['PASSWORD_HASH_QUEUE'] = args.queue
+
+        def storm(login_threads):
+            stop = threading.Event()
+            logins, dashboards = [], []
+
+            def log_in(n):
+                rng = random.Random(n)
+                while not stop.is_set():
+                    client = parking.app.test_client()
+                    start = time.perf_counter()
+                    response = client.post('/login', data={'name': f'user{rng.choice(user_ids)}',
+                                                           'password': 'password123', 'role': 'user'})
+                    logins.append((time.perf_counter() - start, response.status_code))
+
+            def browse(n):
+                client = parking.app.test_client()
+                login_as(client, user_ids[n])
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    assert client.get('/user_dashboard').status_code == 200
+                    dashboards.append(time.perf_counter() - start)
+
+            threads = [threading.Thread(target=log_in, args=(n,)) for n in range(login_threads)]
+            threads += [threading.Thread(target=browse, args=(n,)) for n in range(args.readers)]
+            for thread in threads:
+                thread.start()
+            time.sleep(args.duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            return logins, dashboards
+
+        rows = []
+        _, idle = storm(0)
+        rows.append(('no logins', '-', '-', '-', '-', *[p * 1000 for p in percentiles(idle, (50, 95))],
+                     len(idle) / args.duration))
+        for workers in args.workers:
+            config['PASSWORD_HASH_WORKERS'] = workers
+            parking.password_hasher.peak_pending = 0
+            logins, dashboards = storm(args.login_threads)
+            ok = [seconds for seconds, status in logins if status == 302]
+            rows.append(('inline' if workers == 0 else f'pool of {workers}', len(ok) / args.duration,
+                         percentiles(ok, (95,))[0] * 1000 if ok else 0,
+                         sum(status == 503 for _, status in logins),
+                         parking.password_hasher.stats()['peak_pending'],
+                         *[p * 1000 for p in percentiles(dashboards, (50, 95))], len(dashboards) / args.duration))
+    report(f'{args.login_threads} threads logging in, {args.readers} loading dashboards, {args.duration:.0f}s each',
+           ('hashing', 'logins/s', 'login p95 ms', 'turned away', 'peak queue',
+            'dash p50 ms', 'dash p95 ms', 'dash req/s'), rows)
+
+
+def server_timing(response):
+    """({span: ms}, SQL statements) from a response's Server-Timing header"""
+    spans, statements = {}, 0
+    for part in response.headers.get('Server-Timing', '').split(','):
+        if not part.strip():
+            continue
+        name, *params = [p.strip() for p in part.split(';')]
+        for param in params:
+            key, _, value = param.partition('=')
+            if key == 'dur':
+                spans[name] = float(value)
+            elif key == 'desc' and name == 'db':
+                statements = int(value.strip('"').split()[0])
+    return spans, statements
+
+
+def bench_instrumentation(args):
+    """Where request time goes per route, and what recording it costs"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(5, 200, occupied_ratio=0.3)
+            admin_id = seed_users(1, role='admin')[0]
+            user_ids = seed_users(200)
+            seed_active_reservations(user_ids)
+            seed_history(user_ids[:1], 50)
+        user, admin = parking.app.test_client(), parking.app.test_client()
+        login_as(user, user_ids[0])
+        login_as(admin, admin_id)
+        routes = [
+            ('user_dashboard', user, '/user_dashboard'),
+            ('history', user, '/history'),
+            ('api lots', user, '/api/v1/lots'),
+            ('admin_dashboard', admin, '/admin_dashboard'),
+            ('view_users', admin, '/admin/users'),
+            ('view_spots', admin, '/admin/lot/1/spots'),
+        ]
+        metrics = parking.request_metrics
+
+        rows = []
+        for name, client, url in routes:
+            samples = {True: [], False: []}
+            for i in range(args.requests):
+                # Alternate so drift in the machine's speed hits both modes alike
+                metrics.enabled = i % 2 == 0
+                start = time.perf_counter()
+                response = client.get(url)
+                samples[metrics.enabled].append(time.perf_counter() - start)
+                assert response.status_code == 200
+                if metrics.enabled:
+                    spans, statements = server_timing(response)
+            off, on = statistics.median(samples[False]), statistics.median(samples[True])
+            rows.append((name, statements, spans['db'], spans['render'], off * 1000, on * 1000,
+                         (on - off) * 1e6))
+        metrics.enabled = True
+    report(f'Median of {args.requests // 2} requests per mode',
+           ('route', 'statements', 'db ms', 'render ms', 'off ms', 'on ms', 'overhead us'), rows)
+
+
+def bench_fragments(args):
+    """user_dashboard with its lot cards rendered every time vs from the fragment cache"""
+    from fragments import LRUFragmentStore, FileFragmentStore
+
+    rows = []
+    with scratch_parking_app() as parking, tempfile.TemporaryDirectory() as shared:
+        cache = parking.lot_card_cache
+        with parking.app.app_context():
+            seed_lots(max(args.lots), 20)
+            user_ids = seed_users(50)
+            seed_active_reservations(user_ids[:10])
+        client = parking.app.test_client()
+        login_as(client, user_ids[-1])
+        for n_lots in args.lots:
+            with parking.app.app_context():
+                db.session.execute(db.update(ParkingLot).values(is_active=ParkingLot.lot_id <= n_lots))
+                db.session.commit()
+            for mode in ('off', 'memory', 'file'):
+                parking.app.config['FRAGMENT_CACHE'] = mode != 'off'
+                cache.store = FileFragmentStore(os.path.join(shared, str(n_lots))) if mode == 'file' \
+                    else LRUFragmentStore()
+                client.get('/user_dashboard')  # Fill the cache
+                samples, statements, db_ms, cards_ms = [], 0, [], []
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    response = client.get('/user_dashboard')
+                    samples.append(time.perf_counter() - start)
+                    assert response.status_code == 200
+                    spans, statements = server_timing(response)
+                    db_ms.append(spans['db'])
+                    cards_ms.append(spans['lot_cards'])
+                rows.append((n_lots, mode, statements, statistics.median(db_ms), statistics.median(cards_ms),
+                             statistics.median(samples) * 1000))
+        print(f'Fragment cache totals: {cache.stats()}')
+    report(f'user_dashboard, median of {args.requests} requests',
+           ('lots', 'cache', 'statements', 'db ms', 'lot cards ms', 'total ms'), rows)
+
+
+def bench_archive(args):
+    """Hot-path queries with years of Paid reservations in the live tables vs moved to the archive"""
+    from allocation import create_reservation, release_reservation
+    from archive import archive_reservations, archive_counts, user_reservation_page
+    from reports import user_history_stats
+    from sweeper import RESERVATION_TIMEOUT
+
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(20, 500, occupied_ratio=0.3)
+            user_ids = seed_users(args.users)
+            per_user = args.reservations // args.users
+            for chunk in range(0, len(user_ids), 500):
+                seed_history(user_ids[chunk:chunk + 500], per_user, start=datetime(2023, 1, 1))
+            seed_active_reservations(user_ids)
+            user_id = user_ids[len(user_ids) // 2]
+            parked_vehicle = db.session.query(Reservation.vehicle_number).filter_by(payment_status='Pending').first()[0]
+
+            def reserve_and_release():
+                reservation, _ = create_reservation(db.session.get(ParkingLot, 1), user_id, 'BENCH0001', datetime.now())
+                release_reservation(reservation)
+
+            paths = [
+                ('sweeper: expired Pending', lambda: db.session.query(Reservation.reservation_id).filter(
+                    Reservation.payment_status == 'Pending',
+                    Reservation.parking_timestamp < datetime.now() - RESERVATION_TIMEOUT).limit(500).all()),
+                ('reserve: vehicle already parked', lambda: Reservation.query.filter_by(
+                    vehicle_number=parked_vehicle, payment_status='Pending').first()),
+                ('history: page of 50', lambda: user_reservation_page(user_id)),
+                ('history: user stats', lambda: user_history_stats(user_id)),
+                ('reserve + release', reserve_and_release),
+            ]
+
+            def used_mib(schema):
+                # Deleted rows leave free pages behind until VACUUM, so count the pages in use
+                pages, free, size = (db.session.execute(db.text(f'PRAGMA {schema}.{name}')).scalar()
+                                     for name in ('page_count', 'freelist_count', 'page_size'))
+                return (pages - free) * size / 2 ** 20
+
+            def cold(fn):
+                # A new connection starts with an empty SQLite page cache
+                def run():
+                    db.session.remove()
+                    db.engine.dispose()
+                    fn()
+                return run
+
+            def run(label):
+                db.session.execute(db.text('PRAGMA wal_checkpoint(TRUNCATE)'))
+                counts = archive_counts()
+                print(f'{label}: {counts}, live database {used_mib("main"):.0f} MiB in use, '
+                      f'archive {used_mib("archive"):.0f} MiB')
+                return {name: (measure(fn, repeat=args.repeat), measure(cold(fn), repeat=args.repeat))
+                        for name, fn in paths}
+
+            before = run('before')
+            start = time.perf_counter()
+            moved = archive_reservations(timedelta(days=args.older_than_days), args.batch_size)
+            elapsed = time.perf_counter() - start
+            print(f'Archived {moved} reservations in {elapsed:.1f} s ({moved / elapsed:.0f}/s, '
+                  f'batches of {args.batch_size})')
+            after = run('after')
+
+        report(f'Best of {args.repeat} runs (ms); cold runs open a new connection first',
+               ('path', 'statements', 'live tables', 'archived', 'cold live', 'cold archived'),
+               [(name, before[name][0][1], before[name][0][0] * 1000, after[name][0][0] * 1000,
+                 before[name][1][0] * 1000, after[name][1][0] * 1000) for name, _ in paths])
+        # Let the availability feed finish its update for the last release before the database is removed
+        time.sleep(parking.app.config['AVAILABILITY_COALESCE'] + 1)
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """The given percentiles of samples, nearest-rank"""
+    ordered = sorted(samples)
+    return [ordered[min(len(ordered) - 1, max(0, -(-p * len(ordered) // 100) - 1))] for p in points]
+
+
+def _workload_worker(parking, n, args, user_ids, admin_id, lot_ids, results):
+    """One simulated client process: user visits and admin polls until the deadline"""
+    with parking.app.app_context():
+        db.engine.dispose(close=False)  # Never share pooled connections across fork
+    parking.app.testing = True  # Let database errors reach the client so they can be counted
+    rng = random.Random(args.seed + n)
+    samples = {}  # route -> [(seconds, statements, failed)]
+    started = time.monotonic()
+    warm_until, deadline = started + args.warmup, started + args.warmup + args.duration
+
+    def call(client, route, url, data=None):
+        start = time.perf_counter()
+        try:
+            response = client.post(url, data=data) if data is not None else client.get(url)
+            failed = response.status_code >= 500
+        except OperationalError:
+            response, failed = None, True
+        elapsed = time.perf_counter() - start
+        if time.monotonic() >= warm_until:
+            statements = server_timing(response)[1] if response is not None else 0
+            samples.setdefault(route, []).append((elapsed, statements, failed))
+        return response
+
+    admin = parking.app.test_client()
+    call(admin, 'login', '/login', {'name': 'admin1', 'password': 'password123', 'role': 'admin'})
+    visit = 0
+    while time.monotonic() < deadline:
+        if rng.random() < args.admin_share:
+            call(admin, 'admin_dashboard', '/admin_dashboard')
+            call(admin, 'utilization_api', '/admin/api/utilization')
+            continue
+
+        # One parking visit: log in, look around, reserve, park, leave
+        user_id = rng.choice(user_ids)
+        vehicle = f'WL{n:02d}{visit:07d}'
+        visit += 1
+        client = parking.app.test_client()
+        call(client, 'login', '/login', {'name': f'user{user_id}', 'password': 'password123', 'role': 'user'})
+        call(client, 'user_dashboard', '/user_dashboard')
+        call(client, 'reserve_spot', f'/reserve/{rng.choice(lot_ids)}',
+             {'vehicle_number': vehicle, 'parking_time': '2026-01-01T09:00'})
+        with parking.app.app_context():
+            reservation_id = db.session.query(Reservation.reservation_id).filter_by(
+                vehicle_number=vehicle, payment_status='Pending').scalar()
+        if reservation_id:
+            call(client, 'occupy_spot', f'/occupy/{reservation_id}', {})
+            call(client, 'user_dashboard', '/user_dashboard')
+            call(client, 'history', '/history')
+            call(client, 'release_spot', f'/release/{reservation_id}', {})
+        call(client, 'logout', '/logout')
+    parking.chart_cache.shutdown()  # The dashboard's chart renderer would otherwise keep this process alive
+    results.put(samples)
+
+
+def bench_workload(args):
+    """Mixed user and admin traffic from parallel processes: latency percentiles, throughput and SQL per route"""
+    with scratch_parking_app() as parking:
+        from analytics import rebuild_usage_rollups
+        with parking.app.app_context():
+            seed_lots(args.lots, args.spots, occupied_ratio=args.occupied)
+            admin_id = seed_users(1, role='admin')[0]
+            user_ids = seed_users(args.users)
+            seed_active_reservations(user_ids)
+            seed_history(user_ids, args.history)
+            rebuild_usage_rollups()
+            db.session.commit()
+            lot_ids = [lot_id for (lot_id,) in db.session.query(ParkingLot.lot_id)]
+
+        ctx = multiprocessing.get_context('fork')
+        results = ctx.Queue()
+        workers = [ctx.Process(target=_workload_worker,
+                               args=(parking, n, args, user_ids[n::args.processes], admin_id, lot_ids, results))
+                   for n in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        samples = {}
+        for _ in workers:
+            for route, route_samples in results.get().items():
+                samples.setdefault(route, []).extend(route_samples)
+        for worker in workers:
+            worker.join()
+
+    routes = {}
+    for route, route_samples in sorted(samples.items()):
+        p50, p95, p99 = percentiles([seconds for seconds, _, _ in route_samples])
+        routes[route] = {
+            'requests': len(route_samples),
+            'per_second': len(route_samples) / args.duration,
+            'p50_ms': p50 * 1000,
+            'p95_ms': p95 * 1000,
+            'p99_ms': p99 * 1000,
+            'statements': sum(n for _, n, _ in route_samples) / len(route_samples),
+            'errors': sum(failed for _, _, failed in route_samples),
+        }
+    total = sum(route['requests'] for route in routes.values())
+    results = {
+        'scenario': 'workload',
+        'commit': _git_commit(),
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+        'args': {name: value for name, value in vars(args).items() if name not in ('func', 'json', 'compare')},
+        'requests': total,
+        'per_second': total / args.duration,
+        'routes': routes,
+    }
+    report(f'{args.processes} processes, {args.duration:.0f}s: {total} requests, {results["per_second"]:.1f} req/s',
+           ('route', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'statements', 'errors'),
+           [(route, r['requests'], r['per_second'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['statements'],
+             r['errors']) for route, r in routes.items()])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults written to {args.json}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        _compare_workloads(baseline, results, args.max_regression)
+
+
+def _shards_worker(parking, user_id, lot_ids, duration, results):
+    """Reserve and release through the API in random lots until the deadline"""
+    with parking.app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)  # Never share pooled connections across fork
+    parking.app.testing = True  # Let database errors reach the client so they can be counted
+    client = parking.app.test_client()
+    login_as(client, user_id)
+    rng = random.Random(user_id)
+    counts, latencies = Counter(), []
+
+    def write(url, data):
+        start = time.perf_counter()
+        try:
+            response = client.post(url, json=data)
+        except OperationalError as e:
+            counts['lock errors' if 'locked' in str(e.orig) else 'errors'] += 1
+            return None
+        latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            counts['errors'] += 1
+            return None
+        counts['writes'] += 1
+        return response.get_json()
+
+    deadline = time.monotonic() + duration
+    n = 0
+    while time.monotonic() < deadline:
+        reservation = write(f'/api/v1/lots/{rng.choice(lot_ids)}/reservations',
+                            {'vehicle_number': f'SH{user_id:04d}{n:07d}'})
+        n += 1
+        if reservation:
+            write(f'/api/v1/reservations/{reservation["reservation_id"]}/release', {})
+    results.put((counts, latencies))
+
+
+def _shards_run(count, args, results):
+    """Serve writers from a fresh interpreter with count databases: the default one plus count - 1 shards"""
+    os.environ['DB_PROFILE'] = args.profile
+    with tempfile.TemporaryDirectory() as tmp:
+        names = [f'region{i}' for i in range(1, count)]
+        os.environ['DATABASE_SHARDS'] = ','.join(f'{name}=sqlite:///{os.path.join(tmp, name)}.db' for name in names)
+        os.environ['SHARD_REGIONS'] = ','.join(f'{i}={name}' for i, name in enumerate(names, start=1))
+        with scratch_parking_app() as parking:
+            from shards import prepare_shards, fan_out, shard_for_id
+            with parking.app.app_context():
+                prepare_shards()
+                admin_id = seed_users(1, role='admin')[0]
+                user_ids = seed_users(args.workers)
+            admin = parking.app.test_client()
+            login_as(admin, admin_id)
+            for i in range(args.lots):
+                # Pincodes starting with 1..count-1 go to those regions, 0 to the default database
+                admin.post('/admin/lot/create', data={
+                    'name': f'Lot {i}', 'price': '20', 'capacity': str(args.spots), 'address': 'Bench road',
+                    'pincode': f'{i % count}{i:05d}', 'contact': '0',
+                })
+            with parking.app.app_context():
+                lot_ids = sorted(lot_id for ids in fan_out(
+                    lambda: [lot_id for (lot_id,) in db.session.query(ParkingLot.lot_id)]) for lot_id in ids)
+                per_shard = Counter(shard_for_id(lot_id) for lot_id in lot_ids)
+
+            ctx = multiprocessing.get_context('fork')
+            worker_results = ctx.Queue()
+            workers = [ctx.Process(target=_shards_worker, args=(parking, user_id, lot_ids, args.duration,
+                                                                 worker_results))
+                       for user_id in user_ids]
+            for worker in workers:
+                worker.start()
+            counts, latencies = Counter(), []
+            for _ in workers:
+                worker_counts, worker_latencies = worker_results.get()
+                counts += worker_counts
+                latencies += worker_latencies
+            for worker in workers:
+                worker.join()
+
+            with parking.app.app_context():
+                drifted = sum(fan_out(lambda: len(ParkingLot.rebuild_counts(fix=False))))
+                active = sum(fan_out(lambda: Reservation.query.filter_by(payment_status='Pending').count()))
+            # Let the availability feed finish its update for the last lot before the databases are removed
+            time.sleep(parking.app.config['AVAILABILITY_COALESCE'] + 1)
+    results.put((counts, percentiles(latencies, (50, 99)) if latencies else [0, 0],
+                 sorted(per_shard.values()), drifted, active))
+
+
+def bench_shards(args):
+    """Reserve/release write throughput with lots spread over 1, 2, 4... SQLite databases by pincode region"""
+    rows = []
+    for count in args.shards:
+        # A fresh interpreter per shard count, since app.py reads DATABASE_SHARDS at import
+        ctx = multiprocessing.get_context('spawn')
+        results = ctx.Queue()
+        runner = ctx.Process(target=_shards_run, args=(count, args, results))
+        runner.start()
+        counts, (p50, p99), lots_per_shard, drifted, active = results.get()
+        runner.join()
+        if drifted or active:
+            sys.exit(f'{count} shard(s): {drifted} lot counter(s) drifted, {active} reservation(s) left Pending')
+        rows.append((count, '/'.join(map(str, lots_per_shard)), counts['writes'], counts['writes'] / args.duration,
+                     counts['lock errors'], counts['errors'], p50 * 1000, p99 * 1000))
+    baseline = rows[0][3] or 1
+    rows = [(*row, row[3] / baseline) for row in rows]
+    report(f'Sharded writes ({args.workers} writer processes, {args.lots} lots, {args.duration}s, '
+           f'DB_PROFILE={args.profile})',
+           ('databases', 'lots each', 'writes', 'writes/sec', 'lock errors', 'other errors', 'p50 ms', 'p99 ms',
+            'speedup'), rows)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _process_tree(pid):
+    """pid and all of its descendants, from /proc"""
+    children = {}
+    for entry in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        tree.append(pending.pop())
+        pending += children.get(tree[-1], [])
+    return tree
+
+
+def _memory_mb(pid):
+    """Proportional set size of a process tree in MiB, so pages shared after fork are counted once"""
+    total = 0
+    for member in _process_tree(pid):
+        try:
+            with open(f'/proc/{member}/smaps_rollup') as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+        except (OSError, StopIteration):
+            continue
+    return total / 1024
+
+
+@contextmanager
+def _server(command, port):
+    """Run a server command until the block ends, once it accepts connections on port"""
+    env = dict(os.environ, EXPIRY_SWEEP_INTERVAL='0')
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    sys.exit(f'{command[0]} did not start: {" ".join(command)}')
+                time.sleep(0.2)
+        yield server
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+async def _http_get(reader, writer, path, cookie):
+    """One keep-alive GET; returns (status, whether the server keeps the connection open)"""
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n\r\n'.encode())
+    await writer.drain()
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    headers = dict(line.lower().split(': ', 1) for line in head[1:] if ': ' in line)
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    return int(head[0].split()[1]), headers.get('connection') != 'close'
+
+
+async def _http_client(port, requests, deadline, timeout, seed, latencies, counts):
+    """Send requests one after another over a keep-alive connection, reconnecting when the server closes it"""
+    rng = random.Random(seed)
+    connection = None
+    while time.monotonic() < deadline:
+        path, cookie = rng.choice(requests)
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+            status, keep_alive = await asyncio.wait_for(_http_get(*connection, path, cookie), timeout)
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            counts['errors'] += 1
+            keep_alive = False
+        else:
+            latencies.append(time.perf_counter() - start)
+            counts['ok' if status < 400 else 'errors'] += 1
+        if not keep_alive and connection is not None:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+def _http_load(port, requests, concurrency, duration, timeout):
+    """(counts, latencies) of concurrency keep-alive clients hitting port for duration seconds"""
+    counts, latencies = Counter(), []
+
+    async def run():
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(_http_client(port, requests, deadline, timeout, n, latencies, counts)
+                               for n in range(concurrency)))
+    asyncio.run(run())
+    return counts, latencies
+
+
+def bench_asgi(args):
+    """Read-path capacity of uvicorn asgi:app against gunicorn sync workers using the same memory"""
+    with scratch_parking_app() as parking:
+        with parking.app.app_context():
+            seed_lots(args.lots, args.spots)
+            admin_id = seed_users(1, role='admin')[0]
+            user_ids = seed_users(args.users)
+            seed_history(user_ids, args.history)
+            seed_active_reservations(user_ids)
+            lot_ids = [lot_id for (lot_id,) in db.session.query(ParkingLot.lot_id)]
+        serializer = parking.app.session_interface.get_signing_serializer(parking.app)
+        cookie_name = parking.app.config['SESSION_COOKIE_NAME']
+
+        def cookie(user_id):
+            return f'{cookie_name}={serializer.dumps({"_user_id": str(user_id), "_fresh": True})}'
+
+        # Lot availability as the user dashboard polls it, history, and the admin listings
+        rng = random.Random(1)
+        users = [cookie(user_id) for user_id in rng.sample(user_ids, min(len(user_ids), 200))]
+        admin = cookie(admin_id)
+        requests = [(f'/api/v1/lots/{rng.choice(lot_ids)}/availability', rng.choice(users)) for _ in range(40)] + \
+            [('/api/v1/lots', rng.choice(users)) for _ in range(20)] + \
+            [('/api/v1/reservations', rng.choice(users)) for _ in range(20)] + \
+            [(f'/api/v1/admin/lots/{rng.choice(lot_ids)}/spots', admin) for _ in range(10)] + \
+            [('/api/v1/admin/users', admin) for _ in range(10)]
+
+        def run(name, command, port):
+            rows = []
+            with _server(command, port) as server:
+                _http_load(port, requests, 10, 2, args.timeout)  # Warm up pools and caches
+                for concurrency in args.concurrency:
+                    counts, latencies = _http_load(port, requests, concurrency, args.duration, args.timeout)
+                    p50, p99 = percentiles(latencies, (50, 99)) if latencies else (0, 0)
+                    rows.append((name, concurrency, counts['ok'] / args.duration, p50 * 1000, p99 * 1000,
+                                 counts['errors'], _memory_mb(server.pid)))
+            return rows
+
+        port = _free_port()
+        rows = run('uvicorn asgi:app', [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port),
+                                        '--log-level', 'warning'], port)
+        async_memory = max(row[-1] for row in rows)
+
+        workers = args.gunicorn_workers
+        if workers is None:
+            # One worker first, to learn what the master and each worker take
+            port = _free_port()
+            with _server(['gunicorn', '-k', 'sync', '-w', '1', '-b', f'127.0.0.1:{port}', 'app:app'], port) as server:
+                _http_load(port, requests, 4, 2, args.timeout)
+                tree = _process_tree(server.pid)
+                total, worker = _memory_mb(server.pid), sum(_memory_mb(pid) for pid in tree[1:])
+            workers = max(1, 1 + int((async_memory - total) // worker))
+        port = _free_port()
+        rows += run(f'gunicorn sync x{workers}', ['gunicorn', '-k', 'sync', '-w', str(workers), '-b',
+                                                  f'127.0.0.1:{port}', 'app:app'], port)
+
+    report(f'Read endpoints ({args.lots} lots, {args.users} users with {args.history} past reservations each, '
+           f'{args.duration}s per level, {os.cpu_count()} CPU(s))',
+           ('server', 'connections', 'req/sec', 'p50 ms', 'p99 ms', 'errors', 'memory MiB'), rows)
+    for name in dict.fromkeys(row[0] for row in rows):
+        within = [row[1] for row in rows if row[0] == name and row[4] <= args.slo_ms and not row[5]]
+        print(f'{name}: {max(within) if within else "none"} concurrent connections within p99 {args.slo_ms:.0f} ms')
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _compare_workloads(baseline, current, max_regression):
+    """Print per-route changes against an earlier run and fail on a p95 or SQL regression"""
+    differing = sorted(name for name in current['args'] if baseline['args'].get(name) != current['args'][name])
+    if differing:
+        print(f'\nNote: the baseline was run with different {", ".join(differing)}')
+    rows, regressed = [], []
+    for route, now in current['routes'].items():
+        before = baseline['routes'].get(route)
+        if before is None:
+            continue
+        p95_ratio = now['p95_ms'] / before['p95_ms'] if before['p95_ms'] else 1.0
+        rows.append((route, before['p95_ms'], now['p95_ms'], p95_ratio,
+                     before['statements'], now['statements']))
+        if p95_ratio > max_regression or now['statements'] > before['statements'] + 0.5:
+            regressed.append(route)
+    report(f'Against {baseline.get("commit") or "baseline"} ({baseline.get("recorded_at")}): '
+           f'{baseline["per_second"]:.1f} -> {current["per_second"]:.1f} req/s',
+           ('route', 'p95 ms before', 'p95 ms now', 'ratio', 'stmts before', 'stmts now'), rows)
+    if regressed:
+        sys.exit(f'regressed (p95 over {max_regression}x or more SQL per request): {", ".join(regressed)}')
+
+
+def bench_startup(args):
+    """Cold import time of app.py and time to serve the first request"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=here,
+                             capture_output=True, text=True, check=True).stdout.split()
+        samples.append((float(out[0]) * 1000, float(out[1]) * 1000, out[2] == '1'))
+
+    import_ms = statistics.median(s[0] for s in samples)
+    first_request_ms = statistics.median(s[1] for s in samples)
+    charting_loaded = any(s[2] for s in samples)
+    report(f'Startup (median of {args.runs} cold starts)',
+           ('import ms', 'first req ms', 'matplotlib'),
+           [(import_ms, first_request_ms, 'loaded' if charting_loaded else 'lazy')])
+
+    if charting_loaded:
+        sys.exit('matplotlib was imported at startup')
+    if args.max_import_ms and import_ms > args.max_import_ms:
+        sys.exit(f'import took {import_ms:.0f} ms, limit is {args.max_import_ms} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='scenario', required=True)
+
+    p = sub.add_parser('utilization', help=bench_utilization.__doc__)
+    p.add_argument('--lots', type=int, nargs='+', default=[1, 100, 1000])
+    p.add_argument('--spots', type=int, default=50)
+    p.set_defaults(func=bench_utilization)
+
+    p = sub.add_parser('startup', help=bench_startup.__doc__)
+    p.add_argument('--runs', type=int, default=5)
+    p.add_argument('--max-import-ms', type=float, help='Fail when the median import time exceeds this.')
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser('pages', help=bench_pages.__doc__)
+    p.add_argument('--reservations', type=int, nargs='+', default=[10, 100, 2000])
+    p.add_argument('--spots', type=int, default=100)
+    p.set_defaults(func=bench_pages)
+
+    p = sub.add_parser('reserve', help=bench_reserve.__doc__)
+    p.add_argument('--requests', type=int, default=4000)
+    p.add_argument('--workers', type=int, default=16)
+    p.add_argument('--spots', type=int, default=3000)
+    p.set_defaults(func=bench_reserve)
+
+    p = sub.add_parser('lots', help=bench_lots.__doc__)
+    p.add_argument('--capacity', type=int, nargs='+', default=[100, 10000, 100000])
+    p.add_argument('--skip-orm', action='store_true', help='Do not time the per-object ORM baseline.')
+    p.set_defaults(func=bench_lots)
+
+    p = sub.add_parser('load', help=bench_load.__doc__)
+    p.add_argument('--profiles', nargs='+', default=['baseline', 'wal'])
+    p.add_argument('--workers', type=int, default=8)
+    p.add_argument('--duration', type=float, default=10)
+    p.add_argument('--lots', type=int, default=5)
+    p.add_argument('--spots', type=int, default=500)
+    p.set_defaults(func=bench_load)
+
+    p = sub.add_parser('session', help=bench_session.__doc__)
+    p.add_argument('--repeat', type=int, default=20)
+    p.add_argument('--spots', type=int, default=200)
+    p.set_defaults(func=bench_session)
+
+    p = sub.add_parser('export', help=bench_export.__doc__)
+    p.add_argument('--reservations', type=int, nargs='+', default=[10000, 100000, 300000])
+    p.set_defaults(func=bench_export)
+
+    p = sub.add_parser('analytics', help=bench_analytics.__doc__)
+    p.add_argument('--reservations', type=int, default=200000)
+    p.add_argument('--lots', type=int, default=20)
+    p.add_argument('--days', type=int, nargs='+', default=[7, 30, 365])
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--max-ms', type=float, help='Fail when a report takes longer than this.')
+    p.set_defaults(func=bench_analytics)
+
+    p = sub.add_parser('users', help=bench_users.__doc__)
+    p.add_argument('--users', type=int, nargs='+', default=[10000, 100000, 1000000])
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--max-growth', type=float, default=3,
+                   help='Fail when a page gets this many times slower between the smallest and largest size.')
+    p.set_defaults(func=bench_users)
+
+    p = sub.add_parser('feed', help=bench_feed.__doc__)
+    p.add_argument('--reservations', type=int, default=500)
+    p.add_argument('--lots', type=int, default=5)
+    p.add_argument('--subscribers', type=int, default=200)
+    p.add_argument('--coalesce', type=float, default=0.5)
+    p.set_defaults(func=bench_feed)
+
+    p = sub.add_parser('api', help=bench_api.__doc__)
+    p.add_argument('--polls', type=int, default=2000)
+    p.add_argument('--change-every', type=int, default=20)
+    p.add_argument('--lots', type=int, default=50)
+    p.add_argument('--spots', type=int, default=1000)
+    p.set_defaults(func=bench_api)
+
+    p = sub.add_parser('allocation', help=bench_allocation.__doc__)
+    p.add_argument('--spots', type=int, default=100000)
+    p.add_argument('--ev-every', type=int, default=50)
+    p.add_argument('--repeat', type=int, default=20)
+    p.set_defaults(func=bench_allocation)
+
+    p = sub.add_parser('instrumentation', help=bench_instrumentation.__doc__)
+    p.add_argument('--requests', type=int, default=300)
+    p.set_defaults(func=bench_instrumentation)
+
+    p = sub.add_parser('batch', help=bench_batch.__doc__)
+    p.add_argument('--vehicles', type=int, nargs='+', default=[50, 200])
+    p.add_argument('--spots', type=int, default=1000)
+    p.set_defaults(func=bench_batch)
+
+    p = sub.add_parser('login', help=bench_login.__doc__)
+    p.add_argument('--login-threads', type=int, default=16)
+    p.add_argument('--readers', type=int, default=2)
+    p.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2],
+                   help='PASSWORD_HASH_WORKERS values to compare; 0 hashes on the request thread.')
+    p.add_argument('--queue', type=int, default=32)
+    p.add_argument('--users', type=int, default=500)
+    p.add_argument('--duration', type=float, default=10)
+    p.set_defaults(func=bench_login)
+
+    p = sub.add_parser('fragments', help=bench_fragments.__doc__)
+    p.add_argument('--lots', type=int, nargs='+', default=[10, 50, 200])
+    p.add_argument('--requests', type=int, default=200)
+    p.set_defaults(func=bench_fragments)
+
+    p = sub.add_parser('archive', help=bench_archive.__doc__)
+    p.add_argument('--reservations', type=int, default=2000000)
+    p.add_argument('--users', type=int, default=20000)
+    p.add_argument('--older-than-days', type=int, default=90)
+    p.add_argument('--batch-size', type=int, default=5000)
+    p.add_argument('--repeat', type=int, default=20)
+    p.set_defaults(func=bench_archive)
+
+    p = sub.add_parser('workload', help=bench_workload.__doc__)
+    p.add_argument('--lots', type=int, default=20)
+    p.add_argument('--spots', type=int, default=200)
+    p.add_argument('--occupied', type=float, default=0.3, help='Share of spots occupied before the run.')
+    p.add_argument('--users', type=int, default=2000)
+    p.add_argument('--history', type=int, default=20, help='Past paid reservations per user.')
+    p.add_argument('--processes', type=int, default=4)
+    p.add_argument('--duration', type=float, default=20, help='Measured seconds, after the warmup.')
+    p.add_argument('--warmup', type=float, default=2)
+    p.add_argument('--admin-share', type=float, default=0.1,
+                   help='Share of iterations that poll the admin dashboard instead of a user visit.')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--json', help='Write the results to this file.')
+    p.add_argument('--compare', help='Compare with results written earlier by --json.')
+    p.add_argument('--max-regression', type=float, default=1.25,
+                   help='With --compare, fail when a route\'s p95 grows by more than this factor.')
+    p.set_defaults(func=bench_workload)
+
+    p = sub.add_parser('shards', help=bench_shards.__doc__)
+    p.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4],
+                   help='Databases to spread the lots over, the default one included.')
+    p.add_argument('--workers', type=int, default=8)
+    p.add_argument('--duration', type=float, default=10)
+    p.add_argument('--lots', type=int, default=8)
+    p.add_argument('--spots', type=int, default=200)
+    p.add_argument('--profile', default='wal', help='DB_PROFILE of every database.')
+    p.set_defaults(func=bench_shards)
+
+    p = sub.add_parser('asgi', help=bench_asgi.__doc__)
+    p.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200, 500],
+                   help='Simultaneous keep-alive connections.')
+    p.add_argument('--duration', type=float, default=10)
+    p.add_argument('--lots', type=int, default=20)
+    p.add_argument('--spots', type=int, default=100)
+    p.add_argument('--users', type=int, default=2000)
+    p.add_argument('--history', type=int, default=60, help='Past reservations per user.')
+    p.add_argument('--gunicorn-workers', type=int,
+                   help='Default: as many as fit in the memory the uvicorn process uses.')
+    p.add_argument('--timeout', type=float, default=10, help='Seconds before a request counts as an error.')
+    p.add_argument('--slo-ms', type=float, default=500, help='p99 a concurrency level must stay within.')
+    p.set_defaults(func=bench_asgi)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+def generate_chart(data, chart_type='bar', title='Chart'):
+    """Render a chart of data and return it as PNG bytes"""
+    # matplotlib (with numpy and the font cache) is only loaded by the process
+    # that renders, so web workers do not pay for it at startup
+    import matplotlib
+    matplotlib.use('Agg')  # Headless mode
+    import matplotlib.pyplot as plt
+
+    # Set figure size based on chart type
+    if chart_type == 'bar':
+        fig, ax = plt.subplots(figsize=(9, 9))
+    else:
+        fig, ax = plt.subplots(figsize=(9, 9))
+
+    labels = list(data.keys())
+    values = list(data.values())
+
+    # Handle empty or all-zero data
+    if not values or all(v == 0 for v in values):
+        labels = ['No Data']
+        values = [1]
+        chart_type = 'bar'  # Avoid pie chart for invalid data
+        title = 'No Data Available'
+
+    if chart_type == 'bar':
+        bars = ax.bar(labels, values, color='skyblue')
+        # Rotate x-axis labels to prevent overlapping
+        plt.xticks(rotation=45, ha='right')
+        # Add value labels on top of bars
+        for bar, value in zip(bars, values):
+            height = bar.get_height()
+            ax.text(bar.get_x() + bar.get_width()/2., height + 0.5,
+                   f'{value}%', ha='center', va='bottom', fontsize=9)
+        # Adjust bottom margin to prevent label cutoff
+        plt.subplots_adjust(bottom=0.25)
+    elif chart_type == 'pie':
+        ax.pie(values, labels=labels, autopct='%1.1f%%', startangle=90)
+
+    ax.set_title(title, fontsize=12, fontweight='bold', pad=15)
+
+    # Adjust layout with proper spacing to prevent label cutoff
+    plt.tight_layout(pad=1.5)
+    img = io.BytesIO()
+    plt.savefig(img, format='png', dpi=100)
+    plt.close(fig)
+
+    return img.getvalue()
+
+
+def chart_key(data, chart_type, title):
+    """Stable digest of the chart inputs, used as cache key and ETag"""
+    payload = json.dumps([list(data.items()), chart_type, title], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class ChartCache:
+    """LRU cache of rendered chart PNGs with a time-to-live.
+
+    Charts are rendered in a separate process pool so the matplotlib work
+    never runs on a request thread. Entries hold the render future, so
+    concurrent requests for the same chart share a single render. A render
+    process that dies breaks the pool; it is then replaced by a new one.
+    """
+
+    def __init__(self, max_entries=32, ttl=300, workers=1):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.workers = workers
+        self._entries = OrderedDict()  # key -> (expires_at, future)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def _render(self, data, chart_type, title):
+        """Submit a render, replacing a pool broken by a dead process first (lock held)"""
+        try:
+            return self._executor().submit(generate_chart, dict(data), chart_type, title)
+        except BrokenProcessPool:
+            pool, self._pool = self._pool, None
+            pool.shutdown(wait=False, cancel_futures=True)
+            return self._executor().submit(generate_chart, dict(data), chart_type, title)
+
+    def _submit(self, data, chart_type, title):
+        key = chart_key(data, chart_type, title)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                return key, entry[1]
+            future = self._render(data, chart_type, title)
+            self._entries[key] = (now + self.ttl, future)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return key, future
+
+    def prefetch(self, data, chart_type='bar', title='Chart'):
+        """Start rendering the chart unless it is cached, and return its key"""
+        return self._submit(data, chart_type, title)[0]
+
+    def get(self, data, chart_type='bar', title='Chart', timeout=30):
+        """Return (key, PNG bytes) for the chart, waiting for a render if needed"""
+        for attempt in range(2):
+            key, future = self._submit(data, chart_type, title)
+            try:
+                return key, future.result(timeout=timeout)
+            except Exception as e:
+                with self._lock:
+                    if key in self._entries and self._entries[key][1] is future:
+                        del self._entries[key]
+                # A render lost with its pool is tried once more on the new pool
+                if attempt or not isinstance(e, BrokenProcessPool):
+                    raise
+
+    def shutdown(self):
+        """Stop the render processes and drop cached charts; the next render starts a new pool"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._entries.clear()
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,170 @@
+import os
+
+from sqlalchemy import event
+
+from models import db, ARCHIVE_SCHEMA
+
+# Connection profiles, picked with DB_PROFILE. 'pragmas' are run on every new
+# SQLite connection; 'engine_options' go to SQLAlchemy's create_engine.
+DB_PROFILES = {
+    # SQLite as it behaves out of the box: rollback journal, full fsync
+    'baseline': {
+        'pragmas': {},
+        'engine_options': {},
+    },
+    # SQLite tuned for several gunicorn workers: readers no longer block the
+    # writer, writers wait for the lock instead of failing with
+    # "database is locked", and hot pages stay in memory
+    'wal': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 10000,      # ms
+            'cache_size': -64000,       # KiB, per connection
+            'mmap_size': 268435456,     # 256 MiB
+            'temp_store': 'MEMORY',
+        },
+        'engine_options': {
+            'pool_size': 10,
+            'max_overflow': 10,
+        },
+    },
+    # Client/server databases such as PostgreSQL
+    'server': {
+        'pragmas': {},
+        'engine_options': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 10,
+            'pool_recycle': 1800,
+            'pool_pre_ping': True,
+        },
+    },
+}
+
+
+def database_url(environ=os.environ):
+    """DATABASE_URL from the environment, defaulting to the bundled SQLite file"""
+    url = environ.get('DATABASE_URL', 'sqlite:///parking_system.db')
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def shard_binds(environ=os.environ):
+    """DATABASE_SHARDS from the environment as {name: url}, e.g. 'north=sqlite:///north.db,south=...'"""
+    binds = {}
+    for entry in filter(None, (part.strip() for part in environ.get('DATABASE_SHARDS', '').split(','))):
+        name, sep, url = entry.partition('=')
+        if not sep or not name.strip() or not url.strip():
+            raise ValueError(f'DATABASE_SHARDS entries must look like name=url, not {entry!r}')
+        binds[name.strip()] = url.strip()
+    return binds
+
+
+def shard_regions(shards, environ=os.environ):
+    """SHARD_REGIONS from the environment as {pincode prefix: shard}, e.g. '11=north,40=west,56=south'"""
+    regions = {}
+    for entry in filter(None, (part.strip() for part in environ.get('SHARD_REGIONS', '').split(','))):
+        prefix, _, shard = (part.strip() for part in entry.partition('='))
+        if shard not in shards:
+            raise ValueError(f'SHARD_REGIONS maps {prefix!r} to unknown shard {shard!r}; '
+                             f'DATABASE_SHARDS has {", ".join(shards) or "none"}')
+        regions[prefix] = shard
+    return regions
+
+
+def init_database(app, environ=os.environ):
+    """Configure the database URI, shards and connection profile, bind db to app and attach the archive databases.
+
+    The settings are read from environ, the process environment unless a
+    mapping of the same variables is given (as the benchmarks do).
+    """
+    url = database_url(environ)
+    default_profile = 'wal' if url.startswith('sqlite') else 'server'
+    profile_name = environ.get('DB_PROFILE', default_profile)
+    if profile_name not in DB_PROFILES:
+        raise ValueError(f'Unknown DB_PROFILE {profile_name!r}; choose from {", ".join(DB_PROFILES)}')
+    profile = DB_PROFILES[profile_name]
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(profile['engine_options'])
+    app.config['DB_PROFILE'] = profile_name
+    # Lots, their spots, reservations, payments and rollups can be spread over
+    # extra databases by pincode region (see shards.py); None is the default database
+    binds = shard_binds(environ)
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.config['SHARDS'] = [None, *binds]
+    app.config['SHARD_REGIONS'] = shard_regions(binds, environ)
+    db.init_app(app)
+
+    with app.app_context():
+        for shard, engine in db.engines.items():
+            if engine.dialect.name == 'sqlite':
+                path = _setup_sqlite(engine, profile, environ.get('ARCHIVE_DATABASE') if shard is None else None)
+                if shard is None:
+                    app.config['ARCHIVE_DATABASE'] = path
+
+
+# Async drivers for the ASGI read paths (asgi.py), by sync dialect
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def create_async_engines(app):
+    """{shard: AsyncEngine} for the default database and every shard, with the same profile and archive"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    profile = DB_PROFILES[app.config['DB_PROFILE']]
+    engines = {}
+    with app.app_context():
+        for shard, engine in db.engines.items():
+            if engine.dialect.name not in ASYNC_DRIVERS:
+                raise ValueError(f'No async driver for {engine.dialect.name}; '
+                                 f'supported: {", ".join(ASYNC_DRIVERS)}')
+            async_engine = create_async_engine(engine.url.set(drivername=ASYNC_DRIVERS[engine.dialect.name]),
+                                               **profile['engine_options'])
+            if engine.dialect.name == 'sqlite':
+                _setup_sqlite(async_engine.sync_engine, profile,
+                              app.config.get('ARCHIVE_DATABASE') if shard is None else None)
+            engines[shard] = async_engine
+    return engines
+
+
+def _setup_sqlite(engine, profile, archive=None):
+    """Attach the archive (by default next to the database) and apply the profile's pragmas on each new connection.
+
+    Returns the archive path.
+    """
+    path = archive_path(engine.url.database, archive)
+    # Attached first, so the pragmas below apply to the archive as well
+    event.listen(engine, 'connect', _archive_attacher(path))
+    if profile['pragmas']:
+        event.listen(engine, 'connect', _pragma_setter(profile['pragmas']))
+    return path
+
+
+def archive_path(main_path, configured=None):
+    """The configured archive file (ARCHIVE_DATABASE), or a file next to the SQLite database it belongs to"""
+    if configured:
+        return configured
+    if not main_path or main_path == ':memory:':
+        return ':memory:'
+    root, ext = os.path.splitext(main_path)
+    return f'{root}-archive{ext or ".db"}'
+
+
+def _archive_attacher(path):
+    def attach_archive(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (path,))
+        cursor.close()
+    return attach_archive
+
+
+def _pragma_setter(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+    return set_pragmas
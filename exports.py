@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from archive import STORES, merge_by_id
+from models import db, User_Admin, Reservation, Payment, ParkingSpot, ParkingLot
+from shards import is_sharded, shard_for_id, shard_names, use_shard
+
+EXPORT_CHUNK_SIZE = 1000
+
+
+def export_columns(R=Reservation, P=Payment):
+    """(name, column) pairs of an export row, for the live or the archived reservation and payment tables"""
+    return [
+        ('reservation_id', R.reservation_id),
+        ('user_id', R.user_id),
+        ('username', User_Admin.username),
+        ('vehicle_number', R.vehicle_number),
+        ('lot_id', ParkingLot.lot_id),
+        ('lot_name', ParkingLot.prime_location_name),
+        ('pincode', ParkingLot.pincode),
+        ('spot_number', ParkingSpot.spot_number),
+        ('reservation_timestamp', R.reservation_timestamp),
+        ('parking_timestamp', R.parking_timestamp),
+        ('leaving_timestamp', R.leaving_timestamp),
+        ('price_per_hour', R.parking_cost_per_time),
+        ('reservation_status', R.payment_status),
+        ('payment_id', P.payment_id),
+        ('amount', P.amount),
+        ('payment_method', P.payment_method),
+        ('payment_status', P.payment_status),
+        ('payment_timestamp', P.payment_timestamp),
+    ]
+
+
+EXPORT_FIELDS = [name for name, _ in export_columns()]
+
+
+def parse_export_date(value, end=False):
+    """Datetime from an ISO date or datetime string; a bare end date covers that whole day"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return parsed
+
+
+USERNAME = EXPORT_FIELDS.index('username')
+
+
+def _with_usernames(rows):
+    """rows with the username column filled in from the default database, where the users are"""
+    usernames = dict(db.session.query(User_Admin.id, User_Admin.username)
+                     .filter(User_Admin.id.in_({row.user_id for row in rows})))
+    return [(*row[:USERNAME], usernames.get(row.user_id), *row[USERNAME + 1:]) for row in rows]
+
+
+def _store_rows(R, P, start, end, lot_id, chunk_size, shard=None):
+    # Users live on the default database, so with shards their names are looked up per chunk instead of joined
+    join_users = not is_sharded()
+    columns = [column for _, column in export_columns(R, P)]
+    if not join_users:
+        columns[USERNAME] = db.null().label('username')
+    query = db.select(*columns).select_from(R) \
+        .join(ParkingSpot, R.spot_id == ParkingSpot.spot_id) \
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.lot_id)
+    if join_users:
+        query = query.join(User_Admin, R.user_id == User_Admin.id)
+    query = query.outerjoin(P, P.reservation_id == R.reservation_id).order_by(R.reservation_id)
+    if start is not None:
+        query = query.where(R.reservation_timestamp >= start)
+    if end is not None:
+        query = query.where(R.reservation_timestamp <= end)
+    if lot_id is not None:
+        query = query.where(ParkingLot.lot_id == lot_id)
+
+    with use_shard(shard):
+        result = db.session.execute(query.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        yield from partition if join_users else _with_usernames(partition)
+
+
+def export_rows(start=None, end=None, lot_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield one tuple per reservation, in EXPORT_FIELDS order, joined to its spot, lot, user and payment.
+
+    Live and archived reservations of each shard are read from one
+    streaming cursor each, chunk_size rows at a time, and merged by
+    reservation id, so memory use does not grow with the number of
+    reservations exported. start and end bound the reservation timestamp,
+    both inclusive.
+    """
+    shards = shard_names() if lot_id is None else [shard_for_id(lot_id)]
+    yield from merge_by_id(*[_store_rows(R, P, start, end, lot_id, chunk_size, shard)
+                             for shard in shards for R, P in STORES])
+
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def csv_chunks(rows, rows_per_chunk=EXPORT_CHUNK_SIZE):
+    """Encode rows as CSV text, a header line first, in chunks of rows_per_chunk rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    pending = 0
+    for row in rows:
+        writer.writerow([_export_value(value) for value in row])
+        pending += 1
+        if pending == rows_per_chunk:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(rows, rows_per_chunk=EXPORT_CHUNK_SIZE):
+    """Encode rows as newline-delimited JSON objects, in chunks of rows_per_chunk rows"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({name: _export_value(value) for name, value in zip(EXPORT_FIELDS, row)}))
+        if len(lines) == rows_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_chunks, 'text/csv'),
+    'ndjson': (ndjson_chunks, 'application/x-ndjson'),
+}
@@ -0,0 +1,196 @@
+import glob
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import render_template, request
+from markupsafe import Markup
+
+from instrumentation import RequestMetrics
+from models import db, ParkingLot, SPOT_TYPES
+from shards import fan_out, group_by_shard, use_shard
+
+
+class LRUFragmentStore:
+    """Rendered fragments kept in this process, least recently used dropped first"""
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileFragmentStore:
+    """Rendered fragments in a directory shared by every worker process on the host.
+
+    Anything with the same get/set methods can replace it, e.g. a memcached
+    or Redis client, to share fragments between hosts.
+    """
+
+    def __init__(self, directory, max_entries=16):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'fragment-{key}.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        with open(f'{path}.{os.getpid()}.tmp', 'w') as f:
+            json.dump(value, f)
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
+        paths = glob.glob(os.path.join(self.directory, 'fragment-*.json'))
+        if len(paths) > self.max_entries:
+            for old in sorted(paths, key=os.path.getmtime)[:-self.max_entries]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return len(glob.glob(os.path.join(self.directory, 'fragment-*.json')))
+
+
+def hole(marker, kind, lot_id):
+    """Placeholder for a per-request value of one lot, filled in by LotCardCache"""
+    return Markup(f'{marker}{kind}:{lot_id}{marker}')
+
+
+class LotCardCache:
+    """The lot cards of the user dashboard, rendered once and shared by every user.
+
+    Cards only change when an admin creates, edits or deletes a lot, so the
+    cache key is built from the active lot ids, their created_at (an id can
+    be given to a new lot after a delete) and their details_version, which
+    ParkingLot.touch() bumps. Live availability changes with every
+    reservation and is left out of the cached markup: the template marks it
+    with hole() and each request fills the holes from the same one small
+    query that produces the key.
+
+    Fragments are kept per process in an LRU of FRAGMENT_CACHE_SIZE entries,
+    or in FRAGMENT_CACHE_DIR when set so that worker processes render each
+    version only once between them. FRAGMENT_CACHE=0 renders on every
+    request.
+    """
+
+    template = '_lot_cards.html'
+
+    def __init__(self, app=None, store=None):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.render_seconds = 0.0
+        self._template_digest = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('FRAGMENT_CACHE', os.environ.get('FRAGMENT_CACHE', '1') != '0')
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', int(os.environ.get('FRAGMENT_CACHE_SIZE', 16)))
+        app.config.setdefault('FRAGMENT_CACHE_DIR', os.environ.get('FRAGMENT_CACHE_DIR'))
+        if self.store is None:
+            directory = app.config['FRAGMENT_CACHE_DIR']
+            self.store = FileFragmentStore(directory, app.config['FRAGMENT_CACHE_SIZE']) if directory \
+                else LRUFragmentStore(app.config['FRAGMENT_CACHE_SIZE'])
+
+    def _key(self, versions):
+        if self._template_digest is None:
+            source = self.app.jinja_loader.get_source(self.app.jinja_env, self.template)[0]
+            self._template_digest = hashlib.sha1(source.encode()).hexdigest()
+        payload = '|'.join([self._template_digest, request.script_root, ','.join(SPOT_TYPES),
+                            ','.join(f'{lot_id}:{created_at}:{version}' for lot_id, created_at, version in versions)])
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def _render(self, lot_ids):
+        lots = []
+        for shard, ids in group_by_shard(lot_ids).items():
+            with use_shard(shard):
+                lots += ParkingLot.query.filter(ParkingLot.lot_id.in_(ids)).all()
+        lots.sort(key=lambda lot: lot.lot_id)
+        # A new marker per render, so that no lot name or address can contain it
+        marker = f'\x00{secrets.token_hex(16)}\x00'
+        html = render_template(self.template, lots=lots, spot_types=SPOT_TYPES,
+                               hole=lambda kind, lot_id: hole(marker, kind, lot_id))
+        return html.split(marker)  # Holes at the odd positions
+
+    def render(self):
+        """The lot cards of all active lots with their current availability"""
+        rows = sorted(tuple(row) for shard_rows in fan_out(
+            lambda: db.session.query(ParkingLot.lot_id, ParkingLot.created_at, ParkingLot.details_version,
+                                     ParkingLot.available_count)
+            .filter(ParkingLot.is_active == True).all()) for row in shard_rows)
+        available = {lot_id: count for lot_id, *_, count in rows}
+
+        start = time.perf_counter()
+        parts = None
+        if self.app.config['FRAGMENT_CACHE']:
+            key = self._key((lot_id, created_at, version) for lot_id, created_at, version, _ in rows)
+            parts = self.store.get(key)
+        if parts is None:
+            parts = self._render(list(available))
+            if self.app.config['FRAGMENT_CACHE']:
+                self.store.set(key, parts)
+            with self._lock:
+                self.misses += 1
+                self.render_seconds += time.perf_counter() - start
+        else:
+            with self._lock:
+                self.hits += 1
+
+        out = []
+        for i, part in enumerate(parts):
+            if i % 2 == 0:
+                out.append(part)
+                continue
+            kind, lot_id = part.split(':')
+            count = available.get(int(lot_id), 0)
+            out.append(str(count) if kind == 'available' else 'disabled' if count == 0 else '')
+        timings = RequestMetrics.current()
+        if timings is not None:
+            timings.add('lot_cards', time.perf_counter() - start)
+        return Markup(''.join(out))
+
+    def stats(self):
+        with self._lock:
+            average = self.render_seconds / self.misses if self.misses else 0.0
+            return {
+                'enabled': self.app.config['FRAGMENT_CACHE'],
+                'backend': type(self.store).__name__,
+                'entries': len(self.store) if hasattr(self.store, '__len__') else None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'render_seconds': round(self.render_seconds, 3),
+                # Each hit skips loading the full lot rows and rendering the cards
+                'estimated_seconds_saved': round(self.hits * average, 3),
+            }
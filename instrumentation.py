@@ -0,0 +1,318 @@
+import glob
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+from models import db
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestTimings:
+    """What one request spent its time on"""
+    __slots__ = ('start', 'statements', 'spans', 'log', 'render_depth', 'render_start')
+
+    def __init__(self, log_statements):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.spans = {'db': 0.0, 'render': 0.0}
+        self.log = [] if log_statements else None  # (seconds, SQL) when the slow log is on
+        self.render_depth = 0
+        self.render_start = 0.0
+
+    def add(self, span, seconds):
+        self.spans[span] = self.spans.get(span, 0.0) + seconds
+
+    def merge(self, other):
+        """Add the statements and spans another thread recorded for this request"""
+        self.statements += other.statements
+        for span, seconds in other.spans.items():
+            self.add(span, seconds)
+        if self.log is not None and other.log:
+            self.log.extend(other.log)
+
+
+# Timings of the request a worker thread (see shards.fan_out) is querying for
+_worker = threading.local()
+
+
+@contextmanager
+def worker_timings(parent):
+    """Collect this thread's SQL timings separately, for the request whose timings are parent.
+
+    Threads started for a request run outside its request context, so
+    RequestMetrics.current() would not see their queries. Yields the new
+    RequestTimings (None when parent is None) for the request's thread to
+    merge() once the worker is done.
+    """
+    if parent is None:
+        yield None
+        return
+    timings = RequestTimings(log_statements=parent.log is not None)
+    previous = getattr(_worker, 'timings', None)
+    _worker.timings = timings
+    try:
+        yield timings
+    finally:
+        _worker.timings = previous
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _empty_route():
+    return {
+        'requests': 0,
+        'errors': 0,
+        'seconds': 0.0,
+        'buckets': [0] * len(LATENCY_BUCKETS),
+        'statements': 0,
+        'spans': {},
+    }
+
+
+class RequestMetrics:
+    """Per-route request duration, SQL statement count, DB time and template/chart render time.
+
+    Engine events and Flask's template signals add up the time each request
+    spends in SQL and in rendering; nothing else is recorded per statement,
+    so it can stay on in production. Each response gets a Server-Timing
+    header (SERVER_TIMING=0 turns it off), totals per route are served in
+    Prometheus text format by prometheus(), and requests slower than
+    SLOW_REQUEST_MS are logged with their slowest and most repeated
+    statements.
+
+    Totals are kept per process. With several workers, set METRICS_DIR to a
+    directory they share: each worker writes its totals there at most every
+    METRICS_FLUSH_INTERVAL seconds and prometheus() adds up the files of the
+    workers still running, deleting those of workers that have exited.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('SERVER_TIMING', os.environ.get('SERVER_TIMING', '1') != '0')
+        app.config.setdefault('SLOW_REQUEST_MS', float(os.environ.get('SLOW_REQUEST_MS', 0)))
+        app.config.setdefault('METRICS_DIR', os.environ.get('METRICS_DIR'))
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', float(os.environ.get('METRICS_FLUSH_INTERVAL', 1)))
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    @staticmethod
+    def current():
+        """Timings of the request being handled, or None outside requests or when disabled"""
+        if has_request_context():
+            return g.get('_request_timings')
+        return getattr(_worker, 'timings', None)
+
+    @contextmanager
+    def timed(self, span):
+        """Add the time spent in the block to a named span of the current request"""
+        timings = self.current()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if timings is not None:
+                timings.add(span, time.perf_counter() - start)
+
+    def _before_request(self):
+        if self.enabled:
+            g._request_timings = RequestTimings(log_statements=self.app.config['SLOW_REQUEST_MS'] > 0)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None and self.current() is not None:
+            context.request_metrics_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, 'request_metrics_start', None)
+        timings = self.current()
+        if start is None or timings is None:
+            return
+        elapsed = time.perf_counter() - start
+        timings.statements += 1
+        timings.spans['db'] += elapsed
+        if timings.log is not None:
+            timings.log.append((elapsed, statement))
+
+    def _render_started(self, sender, template, context, **extra):
+        timings = self.current()
+        if timings is not None:
+            if timings.render_depth == 0:
+                timings.render_start = time.perf_counter()
+            timings.render_depth += 1
+
+    def _render_finished(self, sender, template, context, **extra):
+        timings = self.current()
+        if timings is not None and timings.render_depth:
+            timings.render_depth -= 1
+            if timings.render_depth == 0:
+                timings.spans['render'] += time.perf_counter() - timings.render_start
+
+    def _after_request(self, response):
+        timings = g.pop('_request_timings', None)
+        if timings is None:
+            return response
+        total = self._finish(timings, response.status_code)
+
+        if self.app.config['SERVER_TIMING']:
+            parts = [f'db;dur={timings.spans["db"] * 1000:.1f};desc="{timings.statements} queries"']
+            parts += [f'{span};dur={seconds * 1000:.1f}' for span, seconds in timings.spans.items() if span != 'db']
+            parts.append(f'total;dur={total * 1000:.1f}')
+            response.headers.add('Server-Timing', ', '.join(parts))
+        return response
+
+    def _teardown_request(self, exc):
+        # after_request functions are skipped when an exception propagates out
+        # of the request (PROPAGATE_EXCEPTIONS, or an error handler or
+        # after_request function that raised); the request still counts, as a 500
+        timings = g.pop('_request_timings', None)
+        if timings is not None:
+            self._finish(timings, 500)
+
+    def _finish(self, timings, status):
+        """Add a finished request to the route totals and the slow-request log; returns its duration"""
+        total = time.perf_counter() - timings.start
+        route = request.url_rule.endpoint if request.url_rule else 'unmatched'
+        self._record(route, request.method, status, total, timings)
+        slow_ms = self.app.config['SLOW_REQUEST_MS']
+        if slow_ms and total * 1000 >= slow_ms:
+            self._log_slow(route, total, timings)
+        return total
+
+    def _record(self, route, method, status, total, timings):
+        with self._lock:
+            stats = self._routes.get((route, method))
+            if stats is None:
+                stats = self._routes[route, method] = _empty_route()
+            stats['requests'] += 1
+            stats['errors'] += status >= 500
+            stats['seconds'] += total
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if total <= bound:
+                    stats['buckets'][i] += 1
+                    break
+            stats['statements'] += timings.statements
+            for span, seconds in timings.spans.items():
+                stats['spans'][span] = stats['spans'].get(span, 0.0) + seconds
+
+        if self.app.config['METRICS_DIR'] and \
+                time.monotonic() - self._flushed_at >= self.app.config['METRICS_FLUSH_INTERVAL']:
+            self.flush()
+
+    def _log_slow(self, route, total, timings):
+        log = timings.log or []
+        repeated = Counter(statement for _, statement in log)
+        lines = [f'Slow request {request.method} {request.path} ({route}): {total * 1000:.0f} ms, '
+                 f'{timings.statements} statements in {timings.spans["db"] * 1000:.0f} ms, '
+                 + ', '.join(f'{span} {seconds * 1000:.0f} ms' for span, seconds in timings.spans.items()
+                             if span != 'db')]
+        for seconds, statement in sorted(log, key=lambda entry: entry[0], reverse=True)[:5]:
+            lines.append(f'  {seconds * 1000:8.1f} ms  {" ".join(statement.split())[:300]}')
+        for statement, count in repeated.most_common(3):
+            if count > 1:
+                lines.append(f'  {count:5d} x  {" ".join(statement.split())[:300]}')
+        self.app.logger.warning('\n'.join(lines))
+
+    def snapshot(self):
+        """{(route, method): totals} recorded by this process"""
+        with self._lock:
+            return {key: {**stats, 'buckets': list(stats['buckets']), 'spans': dict(stats['spans'])}
+                    for key, stats in self._routes.items()}
+
+    def flush(self):
+        """Write this process's totals to METRICS_DIR for prometheus() in other workers to read"""
+        self._flushed_at = time.monotonic()
+        path = os.path.join(self.app.config['METRICS_DIR'], f'metrics-{os.getpid()}.json')
+        rows = [[route, method, stats] for (route, method), stats in self.snapshot().items()]
+        with open(path + '.tmp', 'w') as f:
+            json.dump(rows, f)
+        os.replace(path + '.tmp', path)
+
+    def _all_processes(self):
+        if not self.app.config['METRICS_DIR']:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for path in glob.glob(os.path.join(self.app.config['METRICS_DIR'], 'metrics-*.json')):
+            pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+            if pid.isdigit() and not _process_alive(int(pid)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    rows = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for route, method, stats in rows:
+                total = merged.setdefault((route, method), _empty_route())
+                for name in ('requests', 'errors', 'seconds', 'statements'):
+                    total[name] += stats[name]
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], stats['buckets'])]
+                for span, seconds in stats['spans'].items():
+                    total['spans'][span] = total['spans'].get(span, 0.0) + seconds
+        return merged
+
+    def prometheus(self):
+        """All route totals in the Prometheus text exposition format"""
+        routes = sorted(self._all_processes().items())
+        out = [
+            '# HELP parkease_request_duration_seconds Time to build the response.',
+            '# TYPE parkease_request_duration_seconds histogram',
+        ]
+        for (route, method), stats in routes:
+            labels = f'route="{route}",method="{method}"'
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, stats['buckets']):
+                cumulative += n
+                out.append(f'parkease_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            out.append(f'parkease_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats["requests"]}')
+            out.append(f'parkease_request_duration_seconds_sum{{{labels}}} {stats["seconds"]:.6f}')
+            out.append(f'parkease_request_duration_seconds_count{{{labels}}} {stats["requests"]}')
+
+        def counter(name, help_text, value):
+            out.extend([f'# HELP {name} {help_text}', f'# TYPE {name} counter'])
+            for (route, method), stats in routes:
+                out.append(f'{name}{{route="{route}",method="{method}"}} {value(stats)}')
+        counter('parkease_request_errors_total', 'Responses with a 5xx status.', lambda s: s['errors'])
+        counter('parkease_sql_statements_total', 'SQL statements executed.', lambda s: s['statements'])
+
+        out.extend(['# HELP parkease_request_span_seconds_total Time spent in SQL (db), templates (render) '
+                    'and other named spans.',
+                    '# TYPE parkease_request_span_seconds_total counter'])
+        for (route, method), stats in routes:
+            for span, seconds in sorted(stats['spans'].items()):
+                out.append(f'parkease_request_span_seconds_total{{route="{route}",method="{method}",'
+                           f'span="{span}"}} {seconds:.6f}')
+        return '\n'.join(out) + '\n'
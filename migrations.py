@@ -0,0 +1,164 @@
+from datetime import datetime
+
+from models import db, ParkingLot, ParkingSpot, Reservation, Payment, User_Admin, ArchivedReservation, ArchivedPayment
+from analytics import rebuild_usage_rollups
+
+
+def add_lot_counter_columns(conn):
+    """Add the occupancy counter columns to parking_lot and fill them from parking_spot"""
+    columns = {column['name'] for column in db.inspect(conn).get_columns('parking_lot')}
+    if {'available_count', 'occupied_count'} <= columns:
+        return
+    for name in ('available_count', 'occupied_count'):
+        if name not in columns:
+            conn.exec_driver_sql(f'ALTER TABLE parking_lot ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0')
+
+    def spots_with(status):
+        return db.select(db.func.count(ParkingSpot.spot_id)).where(
+            ParkingSpot.lot_id == ParkingLot.lot_id,
+            ParkingSpot.status == status
+        ).scalar_subquery()
+    conn.execute(db.update(ParkingLot).values(
+        available_count=spots_with('A'),
+        occupied_count=spots_with('O'),
+    ))
+
+
+def add_lot_version_columns(conn):
+    """Add the change version and timestamp columns used for conditional API requests"""
+    columns = {column['name'] for column in db.inspect(conn).get_columns('parking_lot')}
+    if 'version' not in columns:
+        conn.exec_driver_sql('ALTER TABLE parking_lot ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+    if 'updated_at' not in columns:
+        conn.exec_driver_sql('ALTER TABLE parking_lot ADD COLUMN updated_at DATETIME')
+        conn.execute(db.update(ParkingLot).values(updated_at=datetime.utcnow()))
+
+
+def add_lot_details_version_column(conn):
+    """Add the version that changes only with a lot's own columns, which keys the dashboard lot cards"""
+    columns = {column['name'] for column in db.inspect(conn).get_columns('parking_lot')}
+    if 'details_version' not in columns:
+        conn.exec_driver_sql('ALTER TABLE parking_lot ADD COLUMN details_version INTEGER NOT NULL DEFAULT 1')
+
+
+def add_lot_created_at_column(conn):
+    """Add the creation time that tells apart two lots given the same id, filled from updated_at"""
+    columns = {column['name'] for column in db.inspect(conn).get_columns('parking_lot')}
+    if 'created_at' not in columns:
+        column_type = db.DateTime().compile(dialect=conn.dialect)
+        conn.exec_driver_sql(f'ALTER TABLE parking_lot ADD COLUMN created_at {column_type}')
+        conn.execute(db.update(ParkingLot).values(
+            created_at=db.func.coalesce(ParkingLot.updated_at, datetime.utcnow())))
+
+
+def widen_spot_number_column(conn):
+    """Make room for spot numbers of lots with 1000+ spots; SQLite does not enforce the length"""
+    if conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql('ALTER TABLE parking_spot ALTER COLUMN spot_number TYPE VARCHAR(20)')
+
+
+def create_archive_tables(conn):
+    """Create the archive copies of the reservation and payment tables"""
+    db.metadata.create_all(conn, tables=[ArchivedReservation.__table__, ArchivedPayment.__table__])
+
+
+def create_missing_indexes(conn):
+    """Create every index declared on the models that the database does not have yet"""
+    inspector = db.inspect(conn)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name, schema=table.schema):
+            continue  # Shards only have the lot tables
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+def backfill_usage_rollups(conn):
+    """Fill the analytics rollup tables from the payments recorded so far"""
+    rebuild_usage_rollups(conn=conn)
+
+
+# Applied in order; each step must also be safe on a database created by
+# db.create_all() from the current models
+MIGRATIONS = [
+    (1, add_lot_counter_columns),
+    (2, create_missing_indexes),
+    (3, backfill_usage_rollups),
+    (4, create_missing_indexes),
+    (5, add_lot_version_columns),
+    (6, create_missing_indexes),
+    (7, add_lot_details_version_column),
+    (8, create_archive_tables),
+    (9, add_lot_created_at_column),
+    (10, widen_spot_number_column),
+]
+
+
+def run_migrations(engine=None):
+    """Apply the migrations newer than the database's (or a shard engine's) schema version, returning their numbers"""
+    applied = []
+    with (engine or db.engine).begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+        current = conn.exec_driver_sql('SELECT MAX(version) FROM schema_version').scalar() or 0
+        for version, migration in MIGRATIONS:
+            if version > current:
+                migration(conn)
+                conn.execute(db.text('INSERT INTO schema_version (version) VALUES (:version)'),
+                             {'version': version})
+                applied.append(version)
+    return applied
+
+
+def hot_queries():
+    """The queries on the busy request and sweep paths, with representative parameters"""
+    now = datetime.now()
+    return {
+        'reserve_spot: free EV spot in lot': ParkingSpot.query.filter_by(
+            lot_id=1, status='A', spot_type='EV').order_by(ParkingSpot.spot_id).limit(1),
+        'reserve_spot: free spot in lot': ParkingSpot.query.filter_by(
+            lot_id=1, status='A').order_by(ParkingSpot.spot_id).limit(1),
+        'reserve_spot: vehicle already parked': Reservation.query.filter_by(
+            vehicle_number='TN01AB1234', payment_status='Pending').limit(1),
+        'sweeper: expired reservations': Reservation.query.filter(
+            Reservation.payment_status == 'Pending', Reservation.parking_timestamp < now),
+        'history: reservations of user': Reservation.query.filter_by(user_id=1).order_by(
+            Reservation.reservation_timestamp.desc(), Reservation.reservation_id.desc()).limit(50),
+        'history: payment of reservation': Payment.query.filter_by(reservation_id=1),
+        'history: archived reservations of user': ArchivedReservation.query.filter_by(user_id=1).order_by(
+            ArchivedReservation.reservation_timestamp.desc(), ArchivedReservation.reservation_id.desc()).limit(50),
+        'history: archived payment of reservation': ArchivedPayment.query.filter_by(reservation_id=1),
+        'archive: paid reservations parked before cutoff': Reservation.query.filter(
+            Reservation.payment_status == 'Paid', Reservation.parking_timestamp < now).order_by(
+            Reservation.parking_timestamp).limit(5000),
+        'view_spots: active reservations in lot': Reservation.query.join(ParkingSpot).filter(
+            ParkingSpot.lot_id == 1, Reservation.payment_status == 'Pending'),
+        'delete_lot: occupied spots in lot': ParkingSpot.query.filter_by(lot_id=1, status='O'),
+        'view_users: page by username': User_Admin.query.filter(
+            db.tuple_(User_Admin.username, User_Admin.id) > db.tuple_('m', 1)).order_by(
+            User_Admin.username, User_Admin.id).limit(51),
+        'view_users: page by email': User_Admin.query.filter(
+            db.tuple_(User_Admin.email, User_Admin.id) > db.tuple_('m', 1)).order_by(
+            User_Admin.email, User_Admin.id).limit(51),
+        'view_users: users with vehicle prefix': User_Admin.query.filter(User_Admin.id.in_(
+            db.select(Reservation.user_id).where(
+                Reservation.vehicle_number >= 'TN', Reservation.vehicle_number < 'TN\U0010ffff'))).limit(51),
+        'view_users: admin users': User_Admin.query.filter_by(role='admin'),
+        'admin_dashboard: page of lots by name': ParkingLot.query.order_by(
+            ParkingLot.prime_location_name, ParkingLot.lot_id).limit(51),
+    }
+
+
+def check_query_plans():
+    """Run EXPLAIN QUERY PLAN on each hot query.
+
+    Returns {name: (plan lines, full table scans)}. SQLite only.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError('Query plan checks are only implemented for SQLite')
+    conn = db.session.connection()
+    results = {}
+    for name, query in hot_queries().items():
+        sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        plan = [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql)]
+        scans = [line for line in plan if line.startswith('SCAN') and 'USING' not in line]
+        results[name] = (plan, scans)
+    return results
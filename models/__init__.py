@@ -1,9 +1,13 @@
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from .sharding import ShardedSession, SHARDED_TABLES
+
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 
 from .user_admin import User_Admin
 from .reservation import Reservation
 from .payments import Payment
-from .parking_spot import ParkingSpot
-from .parking_lot import ParkingLot
\ No newline at end of file
+from .parking_spot import ParkingSpot, SPOT_TYPES
+from .parking_lot import ParkingLot
+from .lot_usage import LotUsageHourly, LotUsageDaily, LotStayHistogram, STAY_BUCKETS
+from .archive import ArchivedReservation, ArchivedPayment, ARCHIVE_SCHEMA
@@ -0,0 +1,53 @@
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import foreign
+
+from . import db
+from .parking_spot import ParkingSpot
+from .user_admin import User_Admin
+
+# Completed reservations and their payments are moved out of the hot tables
+# into these copies. On SQLite 'archive' is a separate database file attached
+# to every connection (see database.py); on PostgreSQL it is a schema.
+ARCHIVE_SCHEMA = 'archive'
+
+event.listen(db.metadata, 'before_create',
+             DDL(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}').execute_if(dialect='postgresql'))
+
+
+class ArchivedReservation(db.Model):
+    """A Paid reservation moved out of the reservation table; same columns, no foreign keys"""
+    __tablename__ = 'reservation'
+    __table_args__ = (
+        db.Index('ix_archived_reservation_user_reserved', 'user_id', 'reservation_timestamp'),
+        db.Index('ix_archived_reservation_spot', 'spot_id'),
+        {'schema': ARCHIVE_SCHEMA},
+    )
+    reservation_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    spot_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    reservation_timestamp = db.Column(db.DateTime)
+    parking_timestamp = db.Column(db.DateTime)
+    leaving_timestamp = db.Column(db.DateTime, nullable=True)
+    parking_cost_per_time = db.Column(db.Float, nullable=False)
+    vehicle_number = db.Column(db.String(20), nullable=False)
+    payment_status = db.Column(db.String(20))
+
+    spot = db.relationship(ParkingSpot, primaryjoin=foreign(spot_id) == ParkingSpot.spot_id, viewonly=True)
+    user = db.relationship(User_Admin, primaryjoin=foreign(user_id) == User_Admin.id, viewonly=True)
+    payment = db.relationship('ArchivedPayment', primaryjoin='ArchivedReservation.reservation_id == '
+                              'foreign(ArchivedPayment.reservation_id)', uselist=False, viewonly=True)
+
+
+class ArchivedPayment(db.Model):
+    """The payment of an ArchivedReservation"""
+    __tablename__ = 'payment'
+    __table_args__ = (
+        db.Index('ix_archived_payment_reservation', 'reservation_id'),
+        {'schema': ARCHIVE_SCHEMA},
+    )
+    payment_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    reservation_id = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    payment_method = db.Column(db.String(50), nullable=False)
+    payment_status = db.Column(db.String(20))
+    payment_timestamp = db.Column(db.DateTime)
@@ -0,0 +1,43 @@
+from . import db
+
+# Upper edges, in minutes, of the stay-duration histogram buckets. Bucket i
+# counts stays shorter than STAY_BUCKETS[i]; the last bucket is open-ended.
+STAY_BUCKETS = (15, 30, 60, 120, 180, 240, 360, 480, 720, 1440)
+
+
+class LotUsageHourly(db.Model):
+    """Completed reservations, revenue and parked time of a lot per hour of payment"""
+    __tablename__ = 'lot_usage_hourly'
+    __table_args__ = (
+        db.Index('ix_lot_usage_hourly_hour', 'hour'),
+    )
+    lot_id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)  # Start of the hour
+    reservations = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    stay_minutes = db.Column(db.Float, nullable=False, default=0)
+
+
+class LotUsageDaily(db.Model):
+    """Completed reservations, revenue and parked time of a lot per day of payment"""
+    __tablename__ = 'lot_usage_daily'
+    __table_args__ = (
+        db.Index('ix_lot_usage_daily_day', 'day'),
+    )
+    lot_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    reservations = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    stay_minutes = db.Column(db.Float, nullable=False, default=0)
+
+
+class LotStayHistogram(db.Model):
+    """Completed reservations of a lot per day, counted by stay-duration bucket"""
+    __tablename__ = 'lot_stay_histogram'
+    __table_args__ = (
+        db.Index('ix_lot_stay_histogram_day', 'day'),
+    )
+    lot_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)  # Index into STAY_BUCKETS
+    reservations = db.Column(db.Integer, nullable=False, default=0)
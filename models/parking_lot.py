@@ -1,7 +1,14 @@
+from datetime import datetime
+
 from . import db
 
 class ParkingLot(db.Model):
     __tablename__ = 'parking_lot'
+    __table_args__ = (
+        db.Index('ix_parking_lot_name', 'prime_location_name'),
+        # Ids are never reused, and each shard hands them out from its own range (shards.py)
+        {'sqlite_autoincrement': True},
+    )
     lot_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     prime_location_name = db.Column(db.String(50), nullable=False)
     price = db.Column(db.Float, nullable=False)
@@ -10,15 +17,69 @@ class ParkingLot(db.Model):
     pincode = db.Column(db.String(10), nullable=False)
     contact = db.Column(db.BigInteger, nullable=False)
     is_active = db.Column(db.Boolean, default=True)
+    available_count = db.Column(db.Integer, nullable=False, default=0)  # Kept in step with spot status changes
+    occupied_count = db.Column(db.Integer, nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Bumped on every change API clients can see
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    details_version = db.Column(db.Integer, nullable=False, default=1)  # Bumped only when the lot's own columns change
+    # Databases made before AUTOINCREMENT give a deleted lot's id to the next
+    # lot; the creation time tells the two apart in cache keys and ETags
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     spots = db.relationship('ParkingSpot', backref='lot', lazy=True, cascade="all, delete")
     
     @property
     def available(self):
         """Number of available spots in this lot"""
-        return len([spot for spot in self.spots if spot.status == 'A'])
+        return self.available_count
     
     @property
     def occupied(self):
         """Number of occupied spots in this lot"""
-        return len([spot for spot in self.spots if spot.status == 'O'])
+        return self.occupied_count
+
+    @classmethod
+    def adjust_counts(cls, lot_id, available=0, occupied=0):
+        """Shift the occupancy counters of a lot in a single UPDATE statement"""
+        cls.query.filter_by(lot_id=lot_id).update({
+            cls.available_count: cls.available_count + available,
+            cls.occupied_count: cls.occupied_count + occupied,
+            cls.version: cls.version + 1,
+            cls.updated_at: datetime.utcnow(),
+        })
+        cls.mark_changed(lot_id)
+
+    def touch(self):
+        """Bump the versions after editing the lot's own columns"""
+        self.version = (self.version or 0) + 1
+        self.details_version = (self.details_version or 0) + 1
+        self.updated_at = datetime.utcnow()
+
+    @staticmethod
+    def mark_changed(lot_id):
+        """Note that the current transaction changes the lot's availability, for the live feed"""
+        db.session.info.setdefault('changed_lots', set()).add(lot_id)
+
+    @classmethod
+    def rebuild_counts(cls, fix=True):
+        """Recount spots per lot and return the lots whose counters had drifted"""
+        from .parking_spot import ParkingSpot
+
+        rows = db.session.query(
+            ParkingSpot.lot_id,
+            db.func.sum(db.case((ParkingSpot.status == 'A', 1), else_=0)),
+            db.func.sum(db.case((ParkingSpot.status == 'O', 1), else_=0)),
+        ).group_by(ParkingSpot.lot_id).all()
+        actual = {lot_id: (available or 0, occupied or 0) for lot_id, available, occupied in rows}
+
+        drifted = []
+        for lot in cls.query.all():
+            available, occupied = actual.get(lot.lot_id, (0, 0))
+            if (lot.available_count, lot.occupied_count) != (available, occupied):
+                drifted.append((lot, lot.available_count, lot.occupied_count, available, occupied))
+                if fix:
+                    lot.available_count = available
+                    lot.occupied_count = occupied
+        if fix and drifted:
+            db.session.commit()
+        return drifted
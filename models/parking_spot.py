@@ -1,10 +1,21 @@
 from . import db
 
+SPOT_TYPES = ('Standard', 'EV', 'Accessible')
+
+
 class ParkingSpot(db.Model):
     __tablename__ = 'parking_spot'
+    __table_args__ = (
+        db.Index('ix_parking_spot_lot_status', 'lot_id', 'status'),
+        # Free list per lot and spot type: entries are ordered by spot_id
+        # within each (lot, status, type), so the lowest free spot of a type
+        # is the first entry of its range
+        db.Index('ix_parking_spot_lot_status_type', 'lot_id', 'status', 'spot_type'),
+        {'sqlite_autoincrement': True},
+    )
     spot_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.lot_id'), nullable=False)
-    spot_number = db.Column(db.String(10), unique=True, nullable=False)
+    spot_number = db.Column(db.String(20), unique=True, nullable=False)
     status = db.Column(db.String(1), default="A")  # A = Available, O = Occupied
     spot_type = db.Column(db.String(20), default="Standard")
 
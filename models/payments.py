@@ -3,6 +3,10 @@ from datetime import datetime
 
 class Payment(db.Model):
     __tablename__ = 'payment'
+    __table_args__ = (
+        db.Index('ix_payment_reservation', 'reservation_id'),
+        {'sqlite_autoincrement': True},
+    )
     payment_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     reservation_id = db.Column(db.Integer, db.ForeignKey('reservation.reservation_id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
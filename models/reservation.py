@@ -3,6 +3,13 @@ from datetime import datetime
 
 class Reservation(db.Model):
     __tablename__ = 'reservation'
+    __table_args__ = (
+        db.Index('ix_reservation_status_parking', 'payment_status', 'parking_timestamp'),
+        db.Index('ix_reservation_vehicle_status', 'vehicle_number', 'payment_status'),
+        db.Index('ix_reservation_user_reserved', 'user_id', 'reservation_timestamp'),
+        db.Index('ix_reservation_spot_status', 'spot_id', 'payment_status'),
+        {'sqlite_autoincrement': True},
+    )
     reservation_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     spot_id = db.Column(db.Integer, db.ForeignKey('parking_spot.spot_id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user_admin.id'), nullable=False)
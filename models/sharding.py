@@ -0,0 +1,34 @@
+import sqlalchemy as sa
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.util import find_tables
+
+# Tables whose rows belong to one lot. They live on the lot's shard, chosen
+# by pincode; users and everything else stay on the default database.
+SHARDED_TABLES = frozenset({
+    'parking_lot', 'parking_spot', 'reservation', 'payment',
+    'lot_usage_hourly', 'lot_usage_daily', 'lot_stay_histogram',
+})
+
+
+class ShardedSession(Session):
+    """Sends statements on SHARDED_TABLES to the bind named by info['shard'].
+
+    Without a shard set, or with None (the default database), every
+    statement goes where Flask-SQLAlchemy would send it. shards.bind_shard()
+    and shards.use_shard() set the shard for the current session.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = self.info.get('shard')
+        if bind is None and shard is not None and _touches_sharded_table(mapper, clause):
+            return self._db.engines[shard]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _touches_sharded_table(mapper, clause):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table.name in SHARDED_TABLES
+    if clause is not None:
+        return any(getattr(table, 'name', None) in SHARDED_TABLES
+                   for table in find_tables(clause, include_crud=True, include_joins=True))
+    return False
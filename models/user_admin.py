@@ -4,6 +4,9 @@ from flask_login import UserMixin
 
 class User_Admin(db.Model, UserMixin):
     __tablename__ = 'user_admin'
+    __table_args__ = (
+        db.Index('ix_user_admin_role', 'role'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -0,0 +1,64 @@
+import base64
+import json
+from datetime import datetime
+
+from models import db
+
+PER_PAGE = 50
+
+
+def keyset_page(query, columns, after=None, per_page=PER_PAGE, descending=True):
+    """Fetch one page of query ordered by columns, starting after the cursor values.
+
+    Returns (rows, has_more). The cursor is the column values of the last row
+    of the previous page, so each page is an index range scan instead of an
+    OFFSET that grows with the page number.
+    """
+    rows = keyset_select(query, columns, after, per_page, descending).all()
+    return rows[:per_page], len(rows) > per_page
+
+
+def keyset_select(statement, columns, after=None, per_page=PER_PAGE, descending=True):
+    """A Query or select() narrowed to one keyset page, plus one row that tells whether more follow"""
+    if after is not None:
+        key, bound = db.tuple_(*columns), db.tuple_(*after)
+        statement = statement.where(key < bound if descending else key > bound)
+    statement = statement.order_by(*[column.desc() if descending else column.asc() for column in columns])
+    return statement.limit(per_page + 1)
+
+
+def timestamp_cursor(timestamp, row_id):
+    """Cursor string for a (timestamp, id) sort key"""
+    return f'{timestamp.isoformat()}~{row_id}'
+
+
+def parse_timestamp_cursor(cursor):
+    """(timestamp, id) from a timestamp_cursor string, or None if absent or malformed"""
+    try:
+        timestamp, row_id = cursor.rsplit('~', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def encode_cursor(values):
+    """Opaque URL-safe cursor string for a row's sort key values (strings and numbers)"""
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """Sort key values from an encode_cursor string, or None if absent or malformed"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return tuple(values)
+
+
+def prefix_filter(column, text):
+    """Match values of column starting with text as a range, so an index on column can be used"""
+    return db.and_(column >= text, column < text + '\U0010ffff')
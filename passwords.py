@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from models import db
+
+
+class HashingBusyError(Exception):
+    """More password checks are waiting than PASSWORD_HASH_QUEUE allows"""
+
+
+class PasswordHasher:
+    """Runs password hashing on a small pool of threads with a bounded queue.
+
+    scrypt and pbkdf2 release the GIL, so without a cap a burst of logins
+    runs one hash per request thread and starves every other request of
+    CPU. Here at most PASSWORD_HASH_WORKERS hashes run at once per process
+    (0 hashes inline on the request thread, as before); further logins wait
+    their turn, and once PASSWORD_HASH_QUEUE are waiting new ones are
+    turned away with HashingBusyError instead of piling up.
+
+    PASSWORD_HASH_METHOD is the werkzeug method for new hashes, e.g.
+    'scrypt' or 'pbkdf2:sha256:600000'. Hashes made with other settings
+    are replaced on the user's next successful login that finds room in
+    the queue.
+    """
+
+    def __init__(self, app=None):
+        self.pending = 0
+        self.running = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_seconds = 0.0
+        self.hash_seconds = 0.0
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._workers = None
+        self._method_prefix = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['password_hasher'] = self
+        app.config.setdefault('PASSWORD_HASH_METHOD', os.environ.get('PASSWORD_HASH_METHOD', 'scrypt'))
+        app.config.setdefault('PASSWORD_HASH_WORKERS', int(os.environ.get('PASSWORD_HASH_WORKERS', 2)))
+        app.config.setdefault('PASSWORD_HASH_QUEUE', int(os.environ.get('PASSWORD_HASH_QUEUE', 32)))
+
+    def _executor(self):
+        """This process's hashing pool, or None to hash inline; rebuilt after fork or a resize"""
+        workers = self.app.config['PASSWORD_HASH_WORKERS']
+        if self._pid != os.getpid() or self._workers != workers:
+            with self._lock:
+                if self._pid != os.getpid() or self._workers != workers:
+                    old = self._pool if self._pid == os.getpid() else None
+                    self._pid, self._workers = os.getpid(), workers
+                    self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash') \
+                        if workers > 0 else None
+                    if old is not None:
+                        old.shutdown(wait=False)
+        return self._pool
+
+    def _run(self, fn, *args, optional=False):
+        with self._lock:
+            limit = self.app.config['PASSWORD_HASH_QUEUE'] + max(self.app.config['PASSWORD_HASH_WORKERS'], 1)
+            if self.pending >= limit:
+                if optional:
+                    return None
+                self.rejected += 1
+                raise HashingBusyError('Too many sign-ins right now, please try again in a moment.')
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            with self._lock:
+                self.running += 1
+                self.wait_seconds += started - submitted
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.hash_seconds += time.perf_counter() - started
+
+        try:
+            pool = self._executor()
+            return pool.submit(timed).result() if pool else timed()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def hash(self, password, optional=False):
+        """A new hash of password with PASSWORD_HASH_METHOD; None instead of HashingBusyError if optional"""
+        return self._run(generate_password_hash, password, self.app.config['PASSWORD_HASH_METHOD'],
+                         optional=optional)
+
+    def needs_rehash(self, password_hash):
+        """True when password_hash was not made with the current PASSWORD_HASH_METHOD"""
+        if self._method_prefix is None or self._method_prefix[0] != self.app.config['PASSWORD_HASH_METHOD']:
+            method = self.app.config['PASSWORD_HASH_METHOD']
+            # werkzeug spells out the defaults, e.g. 'scrypt' becomes 'scrypt:32768:8:1'
+            self._method_prefix = (method, generate_password_hash('', method).split('$', 1)[0])
+        return password_hash.split('$', 1)[0] != self._method_prefix[1]
+
+    def verify(self, user, password):
+        """Check user's password; on success, upgrade an outdated hash and commit it"""
+        if not self._run(check_password_hash, user.password_hash, password):
+            return False
+        if self.needs_rehash(user.password_hash):
+            # The password is already checked, so a full queue only puts the upgrade off to a later login
+            password_hash = self.hash(password, optional=True)
+            if password_hash is not None:
+                user.password_hash = password_hash
+                try:
+                    db.session.commit()
+                except SQLAlchemyError as e:
+                    # Likewise a database that cannot take the write right now
+                    db.session.rollback()
+                    self.app.logger.warning('Could not upgrade the password hash of user %s: %s', user.id, e)
+                    return True
+                with self._lock:
+                    self.rehashed += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'method': self.app.config['PASSWORD_HASH_METHOD'],
+                'workers': self.app.config['PASSWORD_HASH_WORKERS'],
+                'max_queue': self.app.config['PASSWORD_HASH_QUEUE'],
+                'pending': self.pending,
+                'running': self.running,
+                'peak_pending': self.peak_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'rehashed': self.rehashed,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'hash_seconds': round(self.hash_seconds, 3),
+            }
+
+    def prometheus(self):
+        """Queue depth and totals in the Prometheus text exposition format"""
+        stats = self.stats()
+        metrics = [
+            ('parkease_password_hash_pending', 'gauge', 'Password hashes waiting or running.', stats['pending']),
+            ('parkease_password_hash_running', 'gauge', 'Password hashes running.', stats['running']),
+            ('parkease_password_hash_total', 'counter', 'Password hashes finished.', stats['completed']),
+            ('parkease_password_hash_rejected_total', 'counter', 'Logins turned away with a full queue.',
+             stats['rejected']),
+            ('parkease_password_rehashed_total', 'counter', 'Hashes upgraded to PASSWORD_HASH_METHOD on login.',
+             stats['rehashed']),
+            ('parkease_password_hash_wait_seconds_total', 'counter', 'Time hashes spent queued.',
+             stats['wait_seconds']),
+            ('parkease_password_hash_seconds_total', 'counter', 'Time spent hashing.', stats['hash_seconds']),
+        ]
+        out = []
+        for name, kind, help_text, value in metrics:
+            out.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}'])
+        return '\n'.join(out) + '\n'
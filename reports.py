@@ -0,0 +1,141 @@
+import time
+from collections import Counter
+
+from archive import STORES
+from models import db, ParkingLot, ParkingSpot, Reservation, User_Admin
+from shards import fan_out, is_sharded
+
+
+def _lot_utilization_rows():
+    occupied = db.func.coalesce(db.func.sum(db.case((ParkingSpot.status == 'O', 1), else_=0)), 0)
+    return db.session.query(
+        ParkingLot.lot_id,
+        ParkingLot.prime_location_name,
+        db.func.count(ParkingSpot.spot_id),
+        occupied,
+    ).outerjoin(ParkingSpot, ParkingSpot.lot_id == ParkingLot.lot_id) \
+     .group_by(ParkingLot.lot_id, ParkingLot.prime_location_name) \
+     .order_by(ParkingLot.lot_id).all()
+
+
+def lot_utilization():
+    """Per-lot spot totals, occupied counts and utilization from one grouped query per shard"""
+    rows = sorted(tuple(row) for shard_rows in fan_out(_lot_utilization_rows) for row in shard_rows)
+
+    report = []
+    for lot_id, name, total, occ in rows:
+        report.append({
+            'lot_id': lot_id,
+            'name': name,
+            'total': total,
+            'occupied': occ,
+            'available': total - occ,
+            'utilization': round((occ / total) * 100, 2) if total > 0 else 0,
+        })
+    return report
+
+
+def utilization_summary(report):
+    """Totals across all lots of a lot_utilization() report"""
+    total = sum(row['total'] for row in report)
+    occupied = sum(row['occupied'] for row in report)
+    return {
+        'total': total,
+        'occupied': occupied,
+        'available': total - occupied,
+        'utilization': round((occupied / total) * 100, 2) if total > 0 else 0,
+    }
+
+
+def _stay_hours(R):
+    """SQL for the hours between parking and leaving of reservations in R"""
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.extract('epoch', R.leaving_timestamp - R.parking_timestamp) / 3600
+    return (db.func.julianday(R.leaving_timestamp) - db.func.julianday(R.parking_timestamp)) * 24
+
+
+def _user_history_figures(user_id):
+    """(total, completed, active, spent, first reservation, lot uses, hours parked, stays) on the current shard"""
+    total = completed = active = spent = hours = stays = 0
+    first_reservation, lot_uses = None, Counter()
+    for R, P in STORES:
+        n, paid, pending, amount, first, parked, left = db.session.query(
+            db.func.count(R.reservation_id),
+            db.func.coalesce(db.func.sum(db.case((R.payment_status == 'Paid', 1), else_=0)), 0),
+            db.func.coalesce(db.func.sum(db.case((R.payment_status == 'Pending', 1), else_=0)), 0),
+            db.func.coalesce(db.func.sum(P.amount), 0),
+            db.func.min(R.reservation_timestamp),
+            db.func.coalesce(db.func.sum(_stay_hours(R)), 0),
+            db.func.count(R.leaving_timestamp),
+        ).outerjoin(P, P.reservation_id == R.reservation_id) \
+         .filter(R.user_id == user_id).one()
+        total, completed, active, spent = total + n, completed + paid, active + pending, spent + amount
+        hours, stays = hours + parked, stays + left
+        if first is not None and (first_reservation is None or first < first_reservation):
+            first_reservation = first
+
+        for lot_id, name, uses in db.session.query(
+                ParkingLot.lot_id, ParkingLot.prime_location_name, db.func.count(R.reservation_id)) \
+                .join(ParkingSpot, ParkingSpot.lot_id == ParkingLot.lot_id) \
+                .join(R, R.spot_id == ParkingSpot.spot_id) \
+                .filter(R.user_id == user_id) \
+                .group_by(ParkingLot.lot_id, ParkingLot.prime_location_name):
+            lot_uses[lot_id, name] += uses
+    return total, completed, active, spent, first_reservation, lot_uses, hours, stays
+
+
+def user_history_stats(user_id):
+    """Summary figures over all of a user's live and archived reservations, in a fixed number of queries per shard"""
+    total = completed = active = spent = hours = stays = 0
+    first_reservation, lot_uses = None, Counter()
+    for n, paid, pending, amount, first, uses, parked, left in fan_out(_user_history_figures, user_id):
+        total, completed, active, spent = total + n, completed + paid, active + pending, spent + amount
+        hours, stays = hours + parked, stays + left
+        if first is not None and (first_reservation is None or first < first_reservation):
+            first_reservation = first
+        lot_uses += uses
+    most_used_lot = lot_uses.most_common(1)[0][0][1] if lot_uses else None
+
+    return {
+        'total': total,
+        'completed': completed,
+        'active': active,
+        'spent': spent,
+        'first_reservation': first_reservation,
+        'most_used_lot': most_used_lot,
+        'average_hours': hours / stays if stays else None,
+    }
+
+
+def parked_user_count():
+    """Users with an active reservation"""
+    if not is_sharded():
+        return db.session.query(db.func.count(db.distinct(Reservation.user_id))) \
+            .filter(Reservation.payment_status == 'Pending').scalar()
+    # Someone can be parked in two regions at once, so the shards' user ids are combined before counting
+    parked = db.select(Reservation.user_id).where(Reservation.payment_status == 'Pending').distinct()
+    return len(set().union(*fan_out(lambda: db.session.scalars(parked).all())))
+
+
+USER_COUNTS_MAX_AGE = 30  # seconds
+_user_counts = {'at': None, 'counts': None}
+
+
+def user_counts(max_age=USER_COUNTS_MAX_AGE):
+    """Total, regular and currently parked user counts for the users page.
+
+    Counting every user is a full index scan, so the result is reused for up
+    to max_age seconds in each process instead of recounted per page view.
+    """
+    now = time.monotonic()
+    if _user_counts['at'] is not None and now - _user_counts['at'] < max_age:
+        return _user_counts['counts']
+
+    total = db.session.query(db.func.count(User_Admin.id)).scalar()
+    counts = {
+        'total': total,
+        'regular': total - User_Admin.query.filter_by(role='admin').count(),
+        'parked': parked_user_count(),
+    }
+    _user_counts.update(at=now, counts=counts)
+    return counts
@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import current_app
+
+from instrumentation import RequestMetrics, worker_timings
+from models import db, SHARDED_TABLES
+
+# Each shard hands out lot, spot, reservation and payment ids from its own
+# range, starting at its position in SHARDS << SHARD_ID_BITS, so an id alone
+# tells which database holds the row
+SHARD_ID_BITS = 40
+
+# URL values naming a row that lives on a shard; a request that has one only
+# ever touches that row's shard
+SHARD_URL_KEYS = ('lot_id', 'spot_id', 'reservation_id')
+
+
+def shard_names():
+    """Bind key of every shard, the default database (None) first"""
+    return current_app.config['SHARDS']
+
+
+def is_sharded():
+    return len(shard_names()) > 1
+
+
+def shard_for_pincode(pincode):
+    """Shard of a new lot: the region with the longest SHARD_REGIONS prefix of pincode, else the default"""
+    regions = current_app.config['SHARD_REGIONS']
+    matches = [prefix for prefix in regions if str(pincode or '').startswith(prefix)]
+    return regions[max(matches, key=len)] if matches else None
+
+
+def shard_for_id(row_id, names=None):
+    """Shard holding the lot, spot, reservation or payment with this id, among names (default: SHARDS)"""
+    names = shard_names() if names is None else names
+    index = int(row_id) >> SHARD_ID_BITS
+    return names[index] if 0 <= index < len(names) else None
+
+
+def local_id(row_id):
+    """The part of an id below its shard's range, as small as an unsharded id"""
+    return int(row_id) & ((1 << SHARD_ID_BITS) - 1)
+
+
+def group_by_shard(ids):
+    """{shard: [ids on it]}, keeping the order of ids within each shard"""
+    groups = {}
+    for row_id in ids:
+        groups.setdefault(shard_for_id(row_id), []).append(row_id)
+    return groups
+
+
+def bind_shard(shard):
+    """Send the current session's lot tables to shard until the session ends"""
+    db.session.info['shard'] = shard
+
+
+@contextmanager
+def use_shard(shard):
+    """Send the current session's lot tables to shard inside the block"""
+    previous = db.session.info.get('shard')
+    db.session.info['shard'] = shard
+    try:
+        yield
+    finally:
+        db.session.info['shard'] = previous
+
+
+def fan_out(fn, *args, shards=None):
+    """fn(*args) on every shard (or the given ones) at once, returning the results in shard order.
+
+    Each shard gets its own thread, app context and session, so anything fn
+    returns must already be loaded: ORM objects come back detached. With a
+    single shard fn simply runs in the current session. The threads' SQL
+    statements and DB time are added to the current request's metrics.
+    """
+    shards = shard_names() if shards is None else list(shards)
+    if len(shards) == 1:
+        with use_shard(shards[0]):
+            return [fn(*args)]
+
+    app = current_app._get_current_object()
+    parent = RequestMetrics.current()
+    recorded = []
+
+    def run(shard):
+        with app.app_context(), worker_timings(parent) as timings:
+            recorded.append(timings)
+            bind_shard(shard)
+            return fn(*args)
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix='shard') as pool:
+            return list(pool.map(run, shards))
+    finally:
+        for timings in recorded:
+            if timings is not None:
+                parent.merge(timings)
+
+
+def init_shard_routing(app):
+    """Bind each request whose URL names a lot, spot or reservation to that row's shard"""
+    @app.url_value_preprocessor
+    def route_to_shard(endpoint, values):
+        if not values or len(app.config['SHARDS']) == 1:
+            return
+        for key in SHARD_URL_KEYS:
+            if isinstance(values.get(key), int):
+                bind_shard(shard_for_id(values[key]))
+                return
+
+
+def _sharded_tables():
+    return [table for table in db.metadata.sorted_tables if table.name in SHARDED_TABLES]
+
+
+def _reserve_id_range(conn, index):
+    """Start the shard's autoincrement ids at its range, unless it has already handed some out"""
+    first = index << SHARD_ID_BITS
+    for table in _sharded_tables():
+        if not table.dialect_options['sqlite'].get('autoincrement'):
+            continue
+        column = table.primary_key.columns[0]
+        if conn.dialect.name == 'sqlite':
+            highest = conn.exec_driver_sql(f'SELECT MAX({column.name}) FROM {table.name}').scalar()
+            seq = conn.exec_driver_sql('SELECT seq FROM sqlite_sequence WHERE name = ?', (table.name,)).scalar()
+            start = max(first, highest or 0, seq or 0)
+            conn.exec_driver_sql('DELETE FROM sqlite_sequence WHERE name = ?', (table.name,))
+            conn.exec_driver_sql('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table.name, start))
+        elif conn.dialect.name == 'postgresql':
+            conn.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', '{column.name}'), "
+                f"GREATEST(:first, (SELECT COALESCE(MAX({column.name}), 0) FROM {table.name})) + 1, false)"),
+                {'first': first})
+
+
+def prepare_shards():
+    """Create the lot tables on every shard, apply migrations and set up its id range.
+
+    The default database is created by db.create_all() as before; shards
+    only get SHARDED_TABLES, since users and everything else stay on the
+    default database. Returns {shard: applied migration numbers}.
+    """
+    from migrations import run_migrations  # migrations imports the modules that fan out
+
+    applied = {}
+    for index, shard in enumerate(shard_names()):
+        if shard is None:
+            continue
+        engine = db.engines[shard]
+        db.metadata.create_all(engine, tables=_sharded_tables())
+        applied[shard] = run_migrations(engine)
+        with engine.begin() as conn:
+            _reserve_id_range(conn, index)
+    return applied
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from models import db, Reservation, Payment, ParkingSpot, ParkingLot
+from analytics import record_usage
+from shards import shard_names, use_shard
+
+RESERVATION_TIMEOUT = timedelta(hours=24)
+MAX_CHARGE_HOURS = 24
+
+
+def sweep_expired_reservations(batch_size=500, now=None):
+    """Close reservations pending past the timeout and auto-charge them.
+
+    Works in batches of batch_size reservations, one transaction each. A
+    reservation is only charged by the sweep that flips it from Pending, and
+    no payment is inserted for a reservation that already has one, so
+    overlapping sweeps from several workers never double-charge.
+    Each shard is swept in turn. Returns the number of reservations closed.
+    """
+    closed = 0
+    for shard in shard_names():
+        with use_shard(shard):
+            closed += _sweep_shard(batch_size, (now or datetime.now()) - RESERVATION_TIMEOUT)
+    return closed
+
+
+def _sweep_shard(batch_size, cutoff_time):
+    closed = 0
+
+    while True:
+        ids = [rid for (rid,) in db.session.query(Reservation.reservation_id).filter(
+            Reservation.payment_status == 'Pending',
+            Reservation.parking_timestamp < cutoff_time
+        ).order_by(Reservation.reservation_id).limit(batch_size)]
+        if not ids:
+            break
+
+        # Claim the batch; rows another sweeper got to first are not returned
+        claimed = db.session.execute(
+            db.update(Reservation)
+            .where(Reservation.reservation_id.in_(ids), Reservation.payment_status == 'Pending')
+            .values(payment_status='Paid', leaving_timestamp=cutoff_time)
+            .returning(Reservation.reservation_id, Reservation.spot_id)
+        ).all()
+        if claimed:
+            claimed_ids = [row.reservation_id for row in claimed]
+
+            # Auto-charge the maximum duration, skipping reservations already paid
+            charged = db.session.execute(db.insert(Payment).from_select(
+                ['reservation_id', 'amount', 'payment_method', 'payment_status', 'payment_timestamp'],
+                db.select(
+                    Reservation.reservation_id,
+                    Reservation.parking_cost_per_time * MAX_CHARGE_HOURS,
+                    db.literal('Auto-charge'),
+                    db.literal('Completed'),
+                    db.literal(datetime.now(), db.DateTime),
+                ).where(
+                    Reservation.reservation_id.in_(claimed_ids),
+                    ~db.exists().where(Payment.reservation_id == Reservation.reservation_id),
+                )
+            ).returning(Payment.payment_id)).scalars().all()
+            record_usage(charged)
+
+            # Free the spots and move the lot counters by what actually changed
+            freed = db.session.execute(
+                db.update(ParkingSpot)
+                .where(ParkingSpot.spot_id.in_({row.spot_id for row in claimed}), ParkingSpot.status == 'O')
+                .values(status='A')
+                .returning(ParkingSpot.lot_id)
+            ).all()
+            for lot_id, count in Counter(row.lot_id for row in freed).items():
+                ParkingLot.adjust_counts(lot_id, available=count, occupied=-count)
+
+        db.session.commit()
+        closed += len(claimed)
+        if len(ids) < batch_size:
+            break
+
+    return closed
+
+
+class ExpirySweeper:
+    """Runs sweep_expired_reservations on a background thread.
+
+    The thread is started by the first request each worker process serves,
+    so gunicorn workers forked from a preloaded app each get their own.
+    EXPIRY_SWEEP_INTERVAL (seconds) sets the period; 0 disables the thread,
+    leaving expiry to the 'flask sweep-expired' command run from cron.
+    """
+
+    def __init__(self, app=None):
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('EXPIRY_SWEEP_INTERVAL', int(os.environ.get('EXPIRY_SWEEP_INTERVAL', 60)))
+        app.config.setdefault('EXPIRY_SWEEP_BATCH_SIZE', int(os.environ.get('EXPIRY_SWEEP_BATCH_SIZE', 500)))
+        app.before_request(self._ensure_started)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() or not self.app.config['EXPIRY_SWEEP_INTERVAL']:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='expiry-sweeper', daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    closed = sweep_expired_reservations(self.app.config['EXPIRY_SWEEP_BATCH_SIZE'])
+                    if closed:
+                        self.app.logger.info('Closed %d expired reservation(s)', closed)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Expiry sweep failed')
+                finally:
+                    db.session.remove()
+            time.sleep(self.app.config['EXPIRY_SWEEP_INTERVAL'])
@@ -0,0 +1,100 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py reads its configuration at import time. The tests run against a
+# default database plus one shard ('north', pincodes starting with 9), so
+# both the single-database and the fan-out paths are exercised.
+_tmp = tempfile.mkdtemp(prefix='parkease-tests-')
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{os.path.join(_tmp, "test.db")}',
+    'DATABASE_SHARDS': f'north=sqlite:///{os.path.join(_tmp, "north.db")}',
+    'SHARD_REGIONS': '9=north',
+    'EXPIRY_SWEEP_INTERVAL': '0',
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+})
+for name in ('FRAGMENT_CACHE_DIR', 'METRICS_DIR', 'METRICS_TOKEN', 'SLOW_REQUEST_MS'):
+    os.environ.pop(name, None)
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from models import db, ParkingLot, User_Admin  # noqa: E402
+
+PASSWORD = 'password123'
+PASSWORD_HASH = generate_password_hash(PASSWORD, 'pbkdf2:sha256:1000')
+
+
+@pytest.fixture(scope='session')
+def parking():
+    import app as parking
+    parking.app.testing = True
+    return parking
+
+
+@pytest.fixture
+def app(parking):
+    """The application on empty databases, with its per-process caches cleared"""
+    from fragments import LRUFragmentStore
+    from shards import prepare_shards
+
+    with parking.app.app_context():
+        for engine in db.engines.values():
+            db.metadata.drop_all(engine)
+        db.create_all()
+        prepare_shards()
+    parking.user_cache.invalidate()
+    parking.lot_card_cache.store = LRUFragmentStore(parking.app.config['FRAGMENT_CACHE_SIZE'])
+    yield parking.app
+    with parking.app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username, role='user'):
+        with app.app_context():
+            user = User_Admin(username=username, email=f'{username}@test.parkease.com', role=role,
+                              password_hash=PASSWORD_HASH)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return make_user
+
+
+@pytest.fixture
+def login(app):
+    def login(user_id):
+        """A test client logged in as user_id, without going through the password hash"""
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+    return login
+
+
+@pytest.fixture
+def admin_client(make_user, login):
+    return login(make_user('admin', role='admin'))
+
+
+@pytest.fixture
+def make_lot(app, admin_client):
+    def make_lot(name, capacity=10, pincode='600001', price=20):
+        """Create a lot through the admin form and return its id"""
+        from shards import fan_out
+
+        response = admin_client.post('/admin/lot/create', data={
+            'name': name, 'price': str(price), 'capacity': str(capacity), 'address': f'{name} Road',
+            'pincode': pincode, 'contact': '9000000000',
+        })
+        assert response.status_code == 302
+        with app.app_context():
+            ids = fan_out(lambda: db.session.query(ParkingLot.lot_id)
+                          .filter_by(prime_location_name=name).order_by(ParkingLot.lot_id.desc()).first())
+        return max(row.lot_id for row in ids if row)
+    return make_lot
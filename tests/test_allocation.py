@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from models import db, ParkingLot, ParkingSpot, Reservation
+from shards import use_shard, shard_for_id
+
+
+@pytest.mark.parametrize('pincode', ['600001', '900001'], ids=['default database', 'shard'])
+def test_parallel_reservations_never_double_book(app, make_lot, make_user, login, pincode):
+    spots, threads, per_thread = 40, 8, 15
+    lot_id = make_lot('Harbour', capacity=spots, pincode=pincode)
+    clients = [login(make_user(f'driver{n}')) for n in range(threads)]
+    statuses, lock = [], threading.Lock()
+
+    def reserve(n, client):
+        for i in range(per_thread):
+            response = client.post(f'/api/v1/lots/{lot_id}/reservations',
+                                   json={'vehicle_number': f'ST{n:02d}{i:04d}'})
+            with lock:
+                statuses.append(response.status_code)
+
+    workers = [threading.Thread(target=reserve, args=(n, client)) for n, client in enumerate(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # Every request either got a spot or was told the lot is full
+    assert statuses.count(201) == spots
+    assert statuses.count(409) == threads * per_thread - spots
+    with app.app_context(), use_shard(shard_for_id(lot_id)):
+        double_booked = db.session.query(Reservation.spot_id).filter_by(payment_status='Pending') \
+            .group_by(Reservation.spot_id).having(db.func.count() > 1).count()
+        assert double_booked == 0
+        assert Reservation.query.filter_by(payment_status='Pending').count() == spots
+        assert ParkingSpot.query.filter_by(lot_id=lot_id, status='O').count() == spots
+        assert ParkingLot.rebuild_counts(fix=False) == []
+
+
+@pytest.mark.parametrize('pincode', ['600001', '900001'], ids=['default database', 'shard'])
+def test_as_many_parallel_reservations_as_spots_all_succeed(app, make_lot, make_user, login, pincode):
+    spots = 12
+    lot_id = make_lot('Harbour', capacity=spots, pincode=pincode)
+    clients = [login(make_user(f'driver{n}')) for n in range(spots)]
+    start, statuses = threading.Barrier(spots), []
+
+    def reserve(n, client):
+        start.wait()
+        statuses.append(client.post(f'/api/v1/lots/{lot_id}/reservations',
+                                    json={'vehicle_number': f'ST{n:04d}'}).status_code)
+
+    workers = [threading.Thread(target=reserve, args=(n, client)) for n, client in enumerate(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert statuses == [201] * spots
+
+
+def test_lost_races_do_not_report_a_free_lot_as_full(app, make_lot, make_user, login):
+    lot_id = make_lot('Harbour', capacity=3)
+    client = login(make_user('driver'))
+    with app.app_context():
+        engine = db.engine
+    lost = []
+
+    # SQLite runs one writer at a time, so a claim only loses a race on a
+    # server database; here the first claims match nothing as if they had
+    def lose_race(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE parking_spot') and len(lost) < 12:
+            lost.append(statement)
+            statement = statement.replace('WHERE parking_spot.spot_id =', 'WHERE 0 = 1 AND parking_spot.spot_id =', 1)
+        return statement, parameters
+
+    event.listen(engine, 'before_cursor_execute', lose_race, retval=True)
+    try:
+        response = client.post(f'/api/v1/lots/{lot_id}/reservations', json={'vehicle_number': 'ST0001'})
+    finally:
+        event.remove(engine, 'before_cursor_execute', lose_race)
+    assert len(lost) == 12
+    assert response.status_code == 201, response.get_json()
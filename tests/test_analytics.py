@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, LotStayHistogram, LotUsageDaily, LotUsageHourly, Payment, Reservation
+from shards import fan_out, use_shard
+from sweeper import MAX_CHARGE_HOURS, sweep_expired_reservations
+from test_query_counts import park
+from test_sweeper import expire
+
+
+def rollups():
+    """Every rollup row on every shard, with the float counters rounded"""
+    def shard_rows():
+        rows = []
+        for model in (LotUsageHourly, LotUsageDaily, LotStayHistogram):
+            for row in db.session.query(model):
+                values = {column.name: getattr(row, column.name) for column in model.__table__.columns}
+                rows.append((model.__tablename__, *(round(value, 6) if isinstance(value, float) else value
+                                                    for value in values.values())))
+        return rows
+    return sorted(row for rows in fan_out(shard_rows) for row in rows)
+
+
+def daily(lot_id):
+    row = LotUsageDaily.query.filter_by(lot_id=lot_id).one_or_none()
+    return (row.reservations, round(row.revenue, 2)) if row else (0, 0)
+
+
+@pytest.mark.parametrize('pincode', ['600001', '900001'], ids=['default database', 'shard'])
+def test_release_and_expiry_add_to_the_rollups(app, make_lot, make_user, login, pincode):
+    lot_id = make_lot('Harbour', pincode=pincode, price=20)
+    client = login(make_user('driver'))
+    park(client, lot_id, ['TN01AB0001'])
+    park(client, lot_id, ['TN01AB0002'], release=False)
+    shard = app.config['SHARD_REGIONS'].get(pincode[0])
+
+    with app.app_context(), use_shard(shard):
+        paid = Payment.query.one().amount
+        assert daily(lot_id) == (1, round(paid, 2))
+        assert db.session.query(db.func.sum(LotStayHistogram.reservations)).scalar() == 1
+
+    expire(app, lot_id, ['TN01AB0002'])
+    with app.app_context():
+        assert sweep_expired_reservations() == 1
+        with use_shard(shard):
+            assert daily(lot_id) == (2, round(paid + 20 * MAX_CHARGE_HOURS, 2))
+            assert db.session.query(db.func.sum(LotUsageHourly.reservations)).scalar() == 2
+            assert db.session.query(db.func.sum(LotStayHistogram.reservations)).scalar() == 2
+
+
+def test_rebuild_reproduces_the_incremental_rollups(app, make_lot, make_user, login):
+    south_id, north_id = make_lot('Southgate', pincode='600001'), make_lot('Northgate', pincode='900001', price=35)
+    client = login(make_user('driver'))
+    park(client, south_id, ['TN01AB0001', 'TN01AB0002'], release=False)
+    park(client, north_id, ['TN01AB0003', 'TN01AB0004', 'TN01AB0005'], release=False)
+    # Stays of different lengths, one of them long enough to be archived once paid
+    with app.app_context():
+        for shard in app.config['SHARDS']:
+            with use_shard(shard):
+                for hours, vehicle in ((3, 'TN01AB0001'), (2400, 'TN01AB0003'), (30, 'TN01AB0004')):
+                    db.session.query(Reservation).filter_by(vehicle_number=vehicle).update(
+                        {'parking_timestamp': datetime.now() - timedelta(hours=hours)})
+                db.session.commit()
+        ids = fan_out(lambda: db.session.scalars(db.select(Reservation.reservation_id).where(
+            Reservation.vehicle_number.in_(['TN01AB0001', 'TN01AB0003']))).all())
+    body = client.post('/api/v1/reservations/release', json={'reservation_ids': [i for s in ids for i in s]})
+    assert body.get_json()['released'] == 2
+    with app.app_context():
+        assert sweep_expired_reservations() == 1  # TN01AB0004
+    park(client, north_id, ['TN01AB0006'])
+    runner = app.test_cli_runner()
+    assert 'Archived 1 reservation(s)' in runner.invoke(args=['archive-reservations']).output
+
+    with app.app_context():
+        incremental = rollups()
+    assert len({row[1] for row in incremental if row[0] == 'lot_usage_daily'}) == 2
+    assert 'Rolled up 4 payment(s).' in runner.invoke(args=['rebuild-analytics']).output
+    with app.app_context():
+        assert rollups() == incremental
@@ -0,0 +1,31 @@
+from models import db
+
+
+def test_unchanged_lot_revalidates_with_304(make_lot, make_user, login):
+    lot_id = make_lot('Harbour')
+    client = login(make_user('driver'))
+    first = client.get(f'/api/v1/lots/{lot_id}')
+    assert first.status_code == 200
+    again = client.get(f'/api/v1/lots/{lot_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_etag_of_deleted_lot_does_not_match_lot_reusing_its_id(app, admin_client, make_lot, make_user, login):
+    client = login(make_user('driver'))
+    old_id = make_lot('OLDNAME')
+    old = client.get(f'/api/v1/lots/{old_id}')
+    old_list = client.get('/api/v1/lots')
+
+    admin_client.post(f'/admin/lot/delete/{old_id}')
+    with app.app_context():
+        # Databases created before AUTOINCREMENT hand the highest deleted id out again
+        db.session.execute(db.text("DELETE FROM sqlite_sequence WHERE name = 'parking_lot'"))
+        db.session.commit()
+    assert make_lot('NEWNAME') == old_id
+
+    response = client.get(f'/api/v1/lots/{old_id}', headers={'If-None-Match': old.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'NEWNAME'
+    response = client.get('/api/v1/lots', headers={'If-None-Match': old_list.headers['ETag']})
+    assert response.status_code == 200
+    assert [lot['name'] for lot in response.get_json()['lots']] == ['NEWNAME']
@@ -0,0 +1,135 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from archive import archive_reservations, user_reservation_page, user_reservations, _copy
+from models import db, Reservation, Payment, ArchivedReservation, ArchivedPayment
+from shards import use_shard
+from test_query_counts import park
+
+OLD = timedelta(days=90)
+
+
+def backdate(app, shard, vehicles, parked_at=datetime(2025, 1, 1, 9)):
+    with app.app_context(), use_shard(shard):
+        db.session.query(Reservation).filter(Reservation.vehicle_number.in_(vehicles)).update(
+            {'parking_timestamp': parked_at}, synchronize_session=False)
+        db.session.commit()
+
+
+def stored():
+    """{reservation id: (vehicle, status, payment id, amount)} over the live and archived tables, and the archived ids"""
+    rows, archived = {}, set()
+    for R, P in ((Reservation, Payment), (ArchivedReservation, ArchivedPayment)):
+        for reservation_id, vehicle, status, payment_id, amount in db.session.execute(
+                db.select(R.reservation_id, R.vehicle_number, R.payment_status, P.payment_id, P.amount)
+                .outerjoin(P, P.reservation_id == R.reservation_id)):
+            assert reservation_id not in rows
+            rows[reservation_id] = (vehicle, status, payment_id, amount)
+            if R is ArchivedReservation:
+                archived.add(reservation_id)
+    return rows, archived
+
+
+@pytest.mark.parametrize('pincode', ['600001', '900001'], ids=['default database', 'shard'])
+def test_interrupted_archiving_resumes_without_losing_or_duplicating_rows(app, make_lot, make_user, login, pincode):
+    lot_id = make_lot('Harbour', pincode=pincode)
+    vehicles = [f'TN01AB{i:04d}' for i in range(9)]
+    park(login(make_user('driver')), lot_id, vehicles)
+    shard = app.config['SHARD_REGIONS'].get(pincode[0])
+    backdate(app, shard, vehicles)
+
+    with app.app_context(), use_shard(shard):
+        before, _ = stored()
+        newest = max(before)
+        # A run stopped after one batch
+        assert archive_reservations(OLD, batch_size=2, max_batches=1) == 2
+        # A batch that fails halfway is rolled back as a whole
+        engine = db.engines[shard]
+
+        def disk_failure(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('DELETE FROM reservation'):
+                raise OperationalError(statement, parameters, sqlite3.OperationalError('disk I/O error'))
+        event.listen(engine, 'before_cursor_execute', disk_failure)
+        try:
+            with pytest.raises(OperationalError):
+                archive_reservations(OLD, batch_size=2)
+        finally:
+            event.remove(engine, 'before_cursor_execute', disk_failure)
+            db.session.rollback()
+        rows, archived = stored()
+        assert rows == before and len(archived) == 2
+        # The archive file committed a batch but the database it came from did not
+        pending = db.select(Reservation.reservation_id).where(Reservation.reservation_id < newest).limit(3)
+        _copy(Reservation, ArchivedReservation, Reservation.reservation_id.in_(pending))
+        _copy(Payment, ArchivedPayment, Payment.reservation_id.in_(pending))
+        db.session.commit()
+
+        assert archive_reservations(OLD, batch_size=2) == 6
+        after, archived = stored()
+        assert after == before
+        assert archived == set(before) - {newest}
+        assert db.session.query(Reservation.reservation_id).all() == [(newest,)]
+
+
+@pytest.mark.parametrize('pincode', ['600001', '900001'], ids=['default database', 'shard'])
+def test_newest_reservation_and_payment_stay_live(app, make_lot, make_user, login, pincode):
+    lot_id = make_lot('Harbour', pincode=pincode)
+    client = login(make_user('driver'))
+    ids = [client.post(f'/api/v1/lots/{lot_id}/reservations', json={'vehicle_number': f'TN01AB{i:04d}'})
+           .get_json()['reservation_id'] for i in range(4)]
+    # Released out of order, so the newest payment belongs to an older reservation
+    for reservation_id in (ids[0], ids[3], ids[2], ids[1]):
+        assert client.post(f'/api/v1/reservations/{reservation_id}/release').status_code == 200
+    shard = app.config['SHARD_REGIONS'].get(pincode[0])
+    backdate(app, shard, [f'TN01AB{i:04d}' for i in range(4)])
+
+    with app.app_context(), use_shard(shard):
+        assert archive_reservations(OLD) == 2
+        assert sorted(db.session.scalars(db.select(Reservation.reservation_id))) == [ids[1], ids[3]]
+        assert sorted(db.session.scalars(db.select(ArchivedPayment.reservation_id))) == [ids[0], ids[2]]
+        archived_payment_ids = set(db.session.scalars(db.select(ArchivedPayment.payment_id)))
+    park(client, lot_id, ['TN01AB0009'])
+    with app.app_context(), use_shard(shard):
+        newest = db.session.query(Reservation).filter_by(vehicle_number='TN01AB0009').one()
+        assert newest.reservation_id > ids[3]
+        assert newest.payment.payment_id not in archived_payment_ids
+
+
+def test_history_pages_merge_live_and_archived_reservations_newest_first(app, make_lot, make_user, login):
+    south_id, north_id = make_lot('Southgate', pincode='600001'), make_lot('Northgate', pincode='900001')
+    user_id = make_user('driver')
+    client = login(user_id)
+    vehicles = [f'TN01AB{i:04d}' for i in range(10)]
+    park(client, south_id, vehicles[:5])
+    park(client, north_id, vehicles[5:])
+    # Booking times interleave the shards, and the archived with the live reservations
+    days = [7, 2, 9, 4, 1, 10, 3, 8, 5, 6]
+    with app.app_context():
+        for shard in app.config['SHARDS']:
+            with use_shard(shard):
+                for vehicle, day in zip(vehicles, days):
+                    db.session.query(Reservation).filter_by(vehicle_number=vehicle).update(
+                        {'reservation_timestamp': datetime(2025, 1, day, 9)})
+                db.session.commit()
+        for shard in app.config['SHARDS']:
+            backdate(app, shard, vehicles)
+        archived = 0
+        for shard in app.config['SHARDS']:
+            with use_shard(shard):
+                archived += archive_reservations(OLD)
+        assert archived == 8
+
+        pages, after = [], None
+        while True:
+            rows, has_more = user_reservation_page(user_id, after=after, per_page=3)
+            pages.extend(rows)
+            if not has_more:
+                break
+            after = rows[-1].reservation_timestamp, rows[-1].reservation_id
+        assert [r.vehicle_number for r in pages] == [v for _, v in sorted(zip(days, vehicles), reverse=True)]
+        assert {type(r) for r in pages} == {Reservation, ArchivedReservation}
+        assert [r.reservation_id for r in pages] == [r.reservation_id for r in user_reservations(user_id)]
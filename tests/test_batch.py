@@ -0,0 +1,87 @@
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from api import MAX_BATCH_SIZE
+from models import db, ParkingLot
+from shards import use_shard
+
+
+def reserve_batch(client, lot_id, vehicles):
+    return client.post(f'/api/v1/lots/{lot_id}/reservations/batch', json={'vehicle_numbers': vehicles})
+
+
+def test_partly_unsatisfiable_batch_reports_each_vehicle(app, make_lot, make_user, login):
+    lot_id = make_lot('Harbour', capacity=3)
+    client = login(make_user('fleet'))
+    assert client.post(f'/api/v1/lots/{lot_id}/reservations', json={'vehicle_number': 'KA01AA0001'}).status_code == 201
+
+    response = reserve_batch(client, lot_id, ['KA01AA0002', 'KA01AA0001', 'KA01AA0003', 'KA01AA0002', 'KA01AA0004'])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['reserved'] == 2
+    assert [result['vehicle_number'] for result in body['results']] == \
+        ['KA01AA0002', 'KA01AA0001', 'KA01AA0003', 'KA01AA0002', 'KA01AA0004']
+    reserved, active, third, repeated, no_room = body['results']
+    assert 'reservation_id' in reserved and 'reservation_id' in third
+    assert all('error' in result for result in (active, repeated, no_room))
+    with app.app_context():
+        lot = db.session.get(ParkingLot, lot_id)
+        assert (lot.available_count, lot.occupied_count) == (0, 3)
+
+
+def test_batches_over_the_limit_are_rejected(app, make_lot, make_user, login):
+    lot_id = make_lot('Harbour')
+    client = login(make_user('fleet'))
+    response = reserve_batch(client, lot_id, [f'KA01{n:06d}' for n in range(MAX_BATCH_SIZE + 1)])
+    assert response.status_code == 400
+    response = client.post('/api/v1/reservations/release', json={'reservation_ids': list(range(MAX_BATCH_SIZE + 1))})
+    assert response.status_code == 400
+    with app.app_context():
+        assert db.session.get(ParkingLot, lot_id).occupied_count == 0
+
+
+def test_batch_release_spans_shards(app, make_lot, make_user, login):
+    south_id, north_id = make_lot('Southgate', pincode='600001'), make_lot('Northgate', pincode='900001')
+    client = login(make_user('fleet'))
+    south = [r['reservation_id'] for r in reserve_batch(client, south_id, ['KA01S1', 'KA01S2']).get_json()['results']]
+    north = [r['reservation_id'] for r in reserve_batch(client, north_id, ['KA01N1', 'KA01N2']).get_json()['results']]
+    client.post(f'/api/v1/reservations/{south[1]}/release')
+
+    ids = [north[0], south[0], north[1], south[1], 999]
+    body = client.post('/api/v1/reservations/release', json={'reservation_ids': ids}).get_json()
+    assert body['released'] == 3
+    assert body['retry'] == []
+    assert [result['reservation_id'] for result in body['results']] == ids
+    assert ['amount' in result for result in body['results']] == [True, True, True, False, False]
+    with app.app_context():
+        for shard, lot_id in ((None, south_id), ('north', north_id)):
+            with use_shard(shard):
+                lot = db.session.get(ParkingLot, lot_id)
+                assert (lot.available_count, lot.occupied_count) == (10, 0)
+                assert ParkingLot.rebuild_counts(fix=False) == []
+
+
+def test_batch_release_lists_the_reservations_of_a_failed_shard_for_retry(app, make_lot, make_user, login):
+    south_id, north_id = make_lot('Southgate', pincode='600001'), make_lot('Northgate', pincode='900001')
+    client = login(make_user('fleet'))
+    south = reserve_batch(client, south_id, ['KA01S1']).get_json()['results'][0]['reservation_id']
+    north = reserve_batch(client, north_id, ['KA01N1']).get_json()['results'][0]['reservation_id']
+    with app.app_context():
+        north_engine = db.engines['north']
+
+    def disk_failure(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE reservation'):
+            raise OperationalError(statement, parameters, sqlite3.OperationalError('disk I/O error'))
+    event.listen(north_engine, 'before_cursor_execute', disk_failure)
+    try:
+        body = client.post('/api/v1/reservations/release', json={'reservation_ids': [north, south]}).get_json()
+    finally:
+        event.remove(north_engine, 'before_cursor_execute', disk_failure)
+    assert body['released'] == 1
+    assert body['retry'] == [north]
+    assert 'error' in body['results'][0] and 'amount' in body['results'][1]
+
+    body = client.post('/api/v1/reservations/release', json={'reservation_ids': body['retry']}).get_json()
+    assert body['released'] == 1
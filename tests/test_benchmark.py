@@ -0,0 +1,67 @@
+"""benchmark.py scenarios run to completion at tiny sizes, on scratch apps set up like app.py"""
+import os
+import re
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SMALL = {
+    'utilization': '--lots 1 3 --spots 5',
+    'startup': '--runs 1',
+    'pages': '--reservations 3 6 --spots 10',
+    'reserve': '--requests 20 --workers 2 --spots 30',
+    'lots': '--capacity 10 20',
+    'load': '--profiles baseline wal --workers 2 --duration 0.5 --lots 1 --spots 10',
+    'session': '--repeat 2 --spots 10',
+    'export': '--reservations 50 100',
+    'analytics': '--reservations 200 --lots 2 --days 7 --repeat 1',
+    'users': '--users 50 100 --repeat 1 --max-growth 100',
+    'feed': '--reservations 10 --lots 1 --subscribers 3 --coalesce 0.05',
+    'api': '--polls 10 --change-every 5 --lots 2 --spots 20',
+    'allocation': '--spots 1000 --repeat 2',
+    'instrumentation': '--requests 10',
+    'batch': '--vehicles 3 5 --spots 20',
+    'login': '--login-threads 2 --readers 1 --workers 0 1 --queue 4 --users 5 --duration 0.5',
+    'fragments': '--lots 2 4 --requests 5',
+    'archive': '--reservations 300 --users 10 --batch-size 50 --repeat 1',
+    'workload': '--lots 2 --spots 10 --users 10 --history 2 --processes 1 --duration 0.5 --warmup 0.2',
+    'shards': '--shards 1 2 --workers 2 --duration 0.5 --lots 2 --spots 10',
+    'asgi': '--concurrency 2 --duration 0.5 --lots 2 --spots 10 --users 10 --history 2',
+}
+
+
+def run_benchmark(*args):
+    # The benchmarks make their own scratch databases; the test run's settings must not leak in
+    env = {name: value for name, value in os.environ.items()
+           if name not in ('DATABASE_URL', 'DATABASE_SHARDS', 'SHARD_REGIONS')}
+    return subprocess.run([sys.executable, 'benchmark.py', *args], cwd=ROOT, env=env,
+                          capture_output=True, text=True, timeout=300)
+
+
+def test_every_scenario_has_a_smoke_run():
+    usage = run_benchmark('--help').stdout
+    assert set(re.search(r'\{([\w,-]+)\}', usage).group(1).split(',')) == set(SMALL)
+
+
+@pytest.mark.parametrize('scenario', SMALL)
+def test_benchmark_runs(scenario):
+    result = run_benchmark(scenario, *SMALL[scenario].split())
+    assert result.returncode == 0, result.stdout[-2000:] + result.stderr[-2000:]
+
+
+def test_scratch_app_runs_shard_aware_code():
+    import benchmark
+    from allocation import create_reservation
+    from models import db, ParkingLot
+    from reports import lot_utilization
+
+    with benchmark.scratch_app() as bench_app:
+        benchmark.seed_lots(1, 5, occupied_ratio=0)
+        user_id = benchmark.seed_users(1)[0]
+        create_reservation(db.session.get(ParkingLot, 1), user_id, 'KA01AB0001', datetime.now())
+        assert lot_utilization()[0]['occupied'] == 1
+    assert [fn.__name__ for fn in bench_app.url_value_preprocessors[None]] == ['route_to_shard']
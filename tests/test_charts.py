@@ -0,0 +1,15 @@
+import os
+
+from charts import ChartCache
+
+
+def test_chart_cache_recovers_from_a_dead_render_process():
+    cache = ChartCache(workers=1)
+    try:
+        png = cache.get({'North': 40, 'South': 60})[1]
+        assert png.startswith(b'\x89PNG')
+        cache._executor().submit(os._exit, 1)  # A render process dies, e.g. killed for memory
+        for data in ({'North': 40, 'South': 60}, {'North': 50, 'South': 50}):
+            assert cache.get(data, title='After the crash')[1].startswith(b'\x89PNG')
+    finally:
+        cache.shutdown()
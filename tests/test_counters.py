@@ -0,0 +1,77 @@
+from models import db, ParkingLot, ParkingSpot
+from shards import fan_out, use_shard, shard_for_id
+from sweeper import sweep_expired_reservations
+from test_sweeper import expire
+
+
+def counters(app):
+    with app.app_context():
+        lots = fan_out(lambda: db.session.query(
+            ParkingLot.lot_id, ParkingLot.available_count, ParkingLot.occupied_count).all())
+    return {lot_id: (available, occupied) for rows in lots for lot_id, available, occupied in rows}
+
+
+def assert_counters(app, expected):
+    """The counters are as expected and check-counters finds them matching a recount of the spots"""
+    assert counters(app) == expected
+    result = app.test_cli_runner().invoke(args=['check-counters'])
+    assert (result.exit_code, result.output) == (0, 'All lot counters are consistent.\n')
+
+
+def reserve(client, lot_id, vehicle):
+    response = client.post(f'/api/v1/lots/{lot_id}/reservations', json={'vehicle_number': vehicle})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['reservation_id']
+
+
+def test_counters_follow_every_change_of_spot_status(app, admin_client, make_lot, make_user, login):
+    south, north = make_lot('Southgate', capacity=6, pincode='600001'), make_lot('Northgate', capacity=6, pincode='900001')
+    client = login(make_user('driver'))
+    assert_counters(app, {south: (6, 0), north: (6, 0)})
+
+    singles = [reserve(client, lot_id, f'TN01AB{i}{lot_id % 10}') for lot_id in (south, north) for i in range(2)]
+    batch = client.post(f'/api/v1/lots/{south}/reservations/batch',
+                        json={'vehicle_numbers': ['TN02AA0001', 'TN02AA0002', 'TN02AA0003']}).get_json()
+    batch_ids = [result['reservation_id'] for result in batch['results']]
+    assert_counters(app, {south: (1, 5), north: (4, 2)})
+
+    for reservation_id in (singles[0], singles[2]):
+        assert client.post(f'/api/v1/reservations/{reservation_id}/release').status_code == 200
+    assert_counters(app, {south: (2, 4), north: (5, 1)})
+
+    body = client.post('/api/v1/reservations/release', json={'reservation_ids': batch_ids[:2] + [singles[3]]})
+    assert body.get_json()['released'] == 3
+    assert_counters(app, {south: (4, 2), north: (6, 0)})
+
+    expire(app, south, ['TN02AA0003'])
+    with app.app_context():
+        assert sweep_expired_reservations() == 1
+    assert_counters(app, {south: (5, 1), north: (6, 0)})
+
+    reserve(client, north, 'TN03AA0001')
+    for lot_id, name, capacity in ((south, 'Southgate', 9), (north, 'Northgate', 4)):
+        response = admin_client.post(f'/admin/lot/edit/{lot_id}', data={
+            'name': name, 'option': 'capacity', 'capacity': str(capacity)})
+        assert response.status_code == 302
+    assert_counters(app, {south: (8, 1), north: (3, 1)})
+
+    with app.app_context(), use_shard(shard_for_id(north)):
+        spot_id = db.session.query(ParkingSpot.spot_id).filter_by(lot_id=north, status='A').first().spot_id
+    admin_client.post(f'/admin/spot/{spot_id}/type', data={'spot_type': 'EV'})
+    assert_counters(app, {south: (8, 1), north: (3, 1)})
+
+
+def test_check_counters_reports_and_fixes_drift(app, make_lot, make_user, login):
+    lot_id = make_lot('Northgate', capacity=4, pincode='900001')
+    reserve(login(make_user('driver')), lot_id, 'TN01AB0001')
+    with app.app_context(), use_shard(shard_for_id(lot_id)):
+        ParkingLot.adjust_counts(lot_id, available=2)
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['check-counters'])
+    assert result.exit_code == 1
+    assert f'Lot {lot_id} (Northgate): counters 5/1, actual 3/1' in result.output
+    result = runner.invoke(args=['check-counters', '--fix'])
+    assert 'Rebuilt counters for 1 lot(s).' in result.output
+    assert_counters(app, {lot_id: (3, 1)})
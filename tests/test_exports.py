@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, Reservation, ArchivedReservation
+from shards import fan_out, use_shard
+from test_query_counts import park
+
+# Vehicle i is parked on day i of January, at nine
+VEHICLES = [f'TN01AB{i:04d}' for i in range(1, 9)]
+
+
+def parked_on(vehicle):
+    return datetime(2026, 1, int(vehicle[-4:]), 9)
+
+
+@pytest.fixture
+def history(app, make_lot, make_user, login):
+    """Released and active reservations on two shards, the older Paid ones moved to the archive"""
+    south_id, north_id = make_lot('Southgate', pincode='600001'), make_lot('Northgate', pincode='900001')
+    alice, bob = login(make_user('alice')), login(make_user('bob'))
+    park(alice, south_id, VEHICLES[0:2])
+    park(bob, north_id, VEHICLES[2:3])
+    park(bob, south_id, VEHICLES[3:4], release=False)  # Live between archived ids
+    park(alice, north_id, VEHICLES[4:7])
+    park(alice, south_id, VEHICLES[7:8])
+    with app.app_context():
+        for shard in app.config['SHARDS']:
+            with use_shard(shard):
+                for vehicle in VEHICLES:
+                    db.session.query(Reservation).filter_by(vehicle_number=vehicle).update({
+                        'reservation_timestamp': parked_on(vehicle), 'parking_timestamp': parked_on(vehicle)})
+                db.session.commit()
+    assert 'Archived 5 reservation(s)' in app.test_cli_runner().invoke(args=['archive-reservations']).output
+    with app.app_context():
+        archived = fan_out(lambda: db.session.query(ArchivedReservation).count())
+    assert all(archived)
+    return south_id, north_id
+
+
+def export(admin_client, fmt, query=''):
+    response = admin_client.get(f'/admin/export/reservations.{fmt}{query}')
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    if fmt == 'csv':
+        return list(csv.DictReader(io.StringIO(text)))
+    return [json.loads(line) for line in text.splitlines()]
+
+
+def as_csv(row):
+    return {name: '' if value is None else str(value) for name, value in row.items()}
+
+
+@pytest.mark.parametrize('query, vehicles', [
+    ('', VEHICLES),
+    ('?lot_id={north}', VEHICLES[2:3] + VEHICLES[4:7]),
+    ('?lot_id={south}&start=2026-01-02&end=2026-01-04', VEHICLES[1:2] + VEHICLES[3:4]),
+], ids=['everything', 'one lot', 'lot and dates'])
+def test_export_merges_live_and_archived_rows_of_every_shard(admin_client, history, query, vehicles):
+    south_id, north_id = history
+    rows = export(admin_client, 'ndjson', query.format(south=south_id, north=north_id))
+    ids = [row['reservation_id'] for row in rows]
+    assert ids == sorted(ids)
+    assert sorted(row['vehicle_number'] for row in rows) == vehicles
+    owners = {'TN01AB0003': 'bob', 'TN01AB0004': 'bob'}
+    for row in rows:
+        assert row['username'] == owners.get(row['vehicle_number'], 'alice')
+        assert row['reservation_timestamp'] == parked_on(row['vehicle_number']).isoformat()
+        active = row['vehicle_number'] == 'TN01AB0004'
+        assert (row['reservation_status'], row['payment_id'] is None) == (('Pending', True) if active else ('Paid', False))
+    assert export(admin_client, 'csv', query.format(south=south_id, north=north_id)) == [as_csv(row) for row in rows]
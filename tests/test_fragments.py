@@ -0,0 +1,39 @@
+from models import db
+
+
+def test_dashboard_shows_lot_cards(make_lot, make_user, login):
+    make_lot('Marina Lot')
+    page = login(make_user('driver')).get('/user_dashboard').get_data(as_text=True)
+    assert 'Marina Lot' in page
+
+
+def test_lot_given_a_deleted_lots_id_gets_its_own_card(app, admin_client, make_lot, make_user, login):
+    user = login(make_user('driver'))
+    old_id = make_lot('OLDNAME')
+    assert 'OLDNAME' in user.get('/user_dashboard').get_data(as_text=True)
+
+    assert admin_client.post(f'/admin/lot/delete/{old_id}').status_code == 302
+    with app.app_context():
+        # Databases created before AUTOINCREMENT hand the highest deleted id out again
+        db.session.execute(db.text("DELETE FROM sqlite_sequence WHERE name = 'parking_lot'"))
+        db.session.commit()
+    assert make_lot('NEWNAME') == old_id
+
+    page = user.get('/user_dashboard').get_data(as_text=True)
+    assert 'NEWNAME' in page
+    assert 'OLDNAME' not in page
+
+
+def test_lot_text_cannot_open_a_hole(app, admin_client, make_lot, make_user, login):
+    lot_id = make_lot('Pier')
+    # Stored as typed, and looking like the placeholder markup
+    assert admin_client.post(f'/admin/lot/edit/{lot_id}', data={
+        'name': f'Pier \x00disabled:{lot_id}\x00 One \x00', 'option': 'price', 'price': '20'}).status_code == 302
+
+    driver = login(make_user('driver'))
+    for _ in range(2):  # Rendered, then from the cache
+        page = driver.get('/user_dashboard').get_data(as_text=True)
+        card = page[page.index(f'data-lot="{lot_id}"'):]
+        assert f'Pier \x00disabled:{lot_id}\x00 One \x00' in card
+        assert '<span class="badge bg-success" data-available>10</span>' in card
+        assert 'w-100" >Reserve in This Lot' in card
@@ -0,0 +1,41 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+
+def test_metrics_of_exited_workers_are_dropped(app, parking, admin_client, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'METRICS_DIR', str(tmp_path))
+    exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                            capture_output=True, text=True, check=True)
+    stale = tmp_path / f'metrics-{exited.stdout.strip()}.json'
+    stale.write_text(json.dumps([['stale_route', 'GET', {
+        'requests': 7, 'errors': 0, 'seconds': 0.5, 'buckets': [7] + [0] * 10, 'statements': 7, 'spans': {}}]]))
+
+    admin_client.get('/admin/users')
+    with app.app_context():
+        text = parking.request_metrics.prometheus()
+    assert 'route="view_users"' in text
+    assert 'stale_route' not in text
+    assert not stale.exists()
+
+
+def test_failed_requests_are_measured(app, parking, admin_client, monkeypatch):
+    def broken_view():
+        raise RuntimeError('broken')
+    monkeypatch.setitem(app.view_functions, 'view_users', broken_view)
+
+    def errors():
+        return parking.request_metrics.snapshot().get(('view_users', 'GET'), {}).get('errors', 0)
+    before = errors()
+    with pytest.raises(RuntimeError):  # In testing mode the exception propagates past after_request
+        admin_client.get('/admin/users')
+    assert errors() == before + 1
+
+    monkeypatch.setattr(app, 'testing', False)
+    assert admin_client.get('/admin/users').status_code == 500
+    assert errors() == before + 2
+    with app.app_context():
+        assert f'parkease_request_errors_total{{route="view_users",method="GET"}} {before + 2}\n' in \
+            parking.request_metrics.prometheus()
@@ -0,0 +1,55 @@
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from conftest import PASSWORD
+from models import db, User_Admin
+
+
+def test_login_upgrades_outdated_hash(app, make_user, monkeypatch):
+    user_id = make_user('driver')
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:2000')
+    response = app.test_client().post('/api/v1/session', json={'username': 'driver', 'password': PASSWORD})
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.get(User_Admin, user_id).password_hash.startswith('pbkdf2:sha256:2000$')
+
+
+def test_busy_hashing_pool_does_not_fail_a_verified_login(app, make_user, monkeypatch):
+    user_id = make_user('driver')
+    hasher = app.extensions['password_hasher']
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:2000')
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_QUEUE', 0)
+    needs_rehash = hasher.needs_rehash
+
+    def queue_fills_up(password_hash):
+        hasher.pending += 1  # Another sign-in takes the only slot once the password is checked
+        return needs_rehash(password_hash)
+    monkeypatch.setattr(hasher, 'needs_rehash', queue_fills_up)
+    rejected = hasher.stats()['rejected']
+    try:
+        response = app.test_client().post('/api/v1/session', json={'username': 'driver', 'password': PASSWORD})
+    finally:
+        hasher.pending -= 1
+    assert response.status_code == 200
+    assert hasher.stats()['rejected'] == rejected
+    with app.app_context():
+        assert db.session.get(User_Admin, user_id).password_hash.startswith('pbkdf2:sha256:1000$')
+
+
+def test_failed_hash_upgrade_does_not_fail_a_verified_login(app, make_user, monkeypatch):
+    user_id = make_user('driver')
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:2000')
+
+    def locked(session):
+        raise OperationalError('UPDATE user_admin', {}, sqlite3.OperationalError('database is locked'))
+    event.listen(db.session, 'before_commit', locked)
+    try:
+        response = app.test_client().post('/api/v1/session', json={'username': 'driver', 'password': PASSWORD})
+    finally:
+        event.remove(db.session, 'before_commit', locked)
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.get(User_Admin, user_id).password_hash.startswith('pbkdf2:sha256:1000$')
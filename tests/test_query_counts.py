@@ -0,0 +1,87 @@
+"""SQL statements per page must not grow with the rows on it (no N+1 queries)"""
+import threading
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from models import db
+
+# Threads that query on their own schedule, not for the request being counted
+BACKGROUND_THREADS = ('availability-feed', 'expiry-sweeper')
+
+
+@contextmanager
+def count_statements(app):
+    """Yields a list whose length is the number of statements sent to any database inside the block"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if threading.current_thread().name not in BACKGROUND_THREADS:
+            statements.append(statement)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', record)
+
+
+def statements_for(app, client, url):
+    client.get(url)  # Warm the user cache and anything else loaded once per process
+    with count_statements(app) as statements:
+        assert client.get(url).status_code == 200
+    return len(statements)
+
+
+def park(client, lot_id, vehicles, release=True):
+    for vehicle in vehicles:
+        response = client.post(f'/api/v1/lots/{lot_id}/reservations', json={'vehicle_number': vehicle})
+        assert response.status_code == 201, response.get_json()
+        if release:
+            reservation_id = response.get_json()['reservation_id']
+            assert client.post(f'/api/v1/reservations/{reservation_id}/release').status_code == 200
+
+
+@pytest.fixture
+def driver(make_user, login):
+    user_id = make_user('driver')
+    return user_id, login(user_id)
+
+
+@pytest.mark.parametrize('pincode', ['600001', '900001'], ids=['default database', 'shard'])
+def test_history_pages_do_not_grow_with_history(app, admin_client, make_lot, driver, pincode):
+    user_id, client = driver
+    lot_id = make_lot('Harbour', capacity=80, pincode=pincode)
+    pages = [(admin_client, f'/admin/user/{user_id}/history'), (client, '/history')]
+
+    park(client, lot_id, [f'TN01{i:04d}' for i in range(3)])
+    few = [statements_for(app, page_client, url) for page_client, url in pages]
+    park(client, lot_id, [f'TN02{i:04d}' for i in range(60)])  # More than one page of history
+    many = [statements_for(app, page_client, url) for page_client, url in pages]
+    assert many == few
+
+
+@pytest.mark.parametrize('pincode', ['600001', '900001'], ids=['default database', 'shard'])
+def test_spots_page_does_not_grow_with_occupied_spots(app, admin_client, make_lot, make_user, login, pincode):
+    lot_id = make_lot('Harbour', capacity=20, pincode=pincode)
+    url = f'/admin/lot/{lot_id}/spots'
+
+    park(login(make_user('first')), lot_id, ['KA010001'], release=False)
+    few = statements_for(app, admin_client, url)
+    for n in range(8):
+        park(login(make_user(f'driver{n}')), lot_id, [f'KA02{n:04d}'], release=False)
+    assert statements_for(app, admin_client, url) == few
+
+
+def test_users_page_does_not_grow_with_active_reservations(app, admin_client, make_lot, make_user, login):
+    lot_id = make_lot('Harbour', capacity=20)
+    park(login(make_user('first')), lot_id, ['KA010001'], release=False)
+    few = statements_for(app, admin_client, '/admin/users')
+    for n in range(8):
+        park(login(make_user(f'driver{n}')), lot_id, [f'KA02{n:04d}'], release=False)
+    assert statements_for(app, admin_client, '/admin/users') == few
@@ -0,0 +1,10 @@
+from migrations import check_query_plans
+
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        results = check_query_plans()
+    scanning = {name: plan for name, (plan, scans) in results.items() if scans}
+    assert results
+    assert not scanning, 'full table scans:\n' + '\n'.join(
+        f'{name}: {"; ".join(plan)}' for name, plan in scanning.items())
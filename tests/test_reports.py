@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+
+from models import db, Reservation
+from reports import user_history_stats
+from shards import use_shard
+from test_query_counts import park
+
+
+def test_average_stay_covers_every_shard(app, make_lot, make_user, login):
+    south_id, north_id = make_lot('Southgate', pincode='600001'), make_lot('Northgate', pincode='900001')
+    user_id = make_user('driver')
+    client = login(user_id)
+    park(client, south_id, ['TN01AB0001', 'TN01AB0002'])
+    park(client, north_id, ['TN01AB0003'])
+    park(client, north_id, ['TN01AB0004'], release=False)  # Still parked, so not part of the average
+
+    parked_at = datetime(2026, 1, 5, 9)
+    stays = {'TN01AB0001': 1, 'TN01AB0002': 2.5, 'TN01AB0003': 4.5}
+    with app.app_context():
+        for shard in app.config['SHARDS']:
+            with use_shard(shard):
+                for vehicle, hours in stays.items():
+                    db.session.query(Reservation).filter_by(vehicle_number=vehicle).update({
+                        'parking_timestamp': parked_at, 'leaving_timestamp': parked_at + timedelta(hours=hours)})
+                db.session.commit()
+        stats = user_history_stats(user_id)
+    assert stats['total'] == 4
+    assert abs(stats['average_hours'] - 8 / 3) < 1e-6
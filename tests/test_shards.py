@@ -0,0 +1,68 @@
+import html
+import re
+
+import pytest
+
+from models import db, ParkingSpot
+from shards import shard_for_id, use_shard
+from test_query_counts import count_statements, park
+
+
+def test_lot_on_shard_gets_short_spot_numbers(app, make_lot):
+    lot_id = make_lot('Northgate', capacity=3, pincode='900001')
+    assert shard_for_id(lot_id, app.config['SHARDS']) == 'north'
+    with app.app_context(), use_shard('north'):
+        numbers = [number for (number,) in db.session.query(ParkingSpot.spot_number)
+                   .filter_by(lot_id=lot_id).order_by(ParkingSpot.spot_id)]
+    assert numbers == ['Nor-1-001', 'Nor-1-002', 'Nor-1-003']
+    assert all(len(number) <= ParkingSpot.spot_number.type.length for number in numbers)
+
+
+def test_vehicle_holds_one_active_reservation_across_regions(make_lot, make_user, login):
+    south_id, north_id = make_lot('Southgate', pincode='600001'), make_lot('Northgate', pincode='900001')
+    client = login(make_user('driver'))
+
+    reserved = client.post(f'/api/v1/lots/{south_id}/reservations', json={'vehicle_number': 'TN01AB1234'})
+    assert reserved.status_code == 201
+    response = client.post(f'/api/v1/lots/{north_id}/reservations', json={'vehicle_number': 'TN01AB1234'})
+    assert response.status_code == 409
+    batch = client.post(f'/api/v1/lots/{north_id}/reservations/batch',
+                        json={'vehicle_numbers': ['TN01AB1234', 'KA02CD5678']}).get_json()
+    assert [('error' in result) for result in batch['results']] == [True, False]
+
+    client.post(f'/api/v1/reservations/{reserved.get_json()["reservation_id"]}/release')
+    response = client.post(f'/api/v1/lots/{north_id}/reservations', json={'vehicle_number': 'TN01AB1234'})
+    assert response.status_code == 201
+
+
+def test_request_metrics_count_fanned_out_queries(app, make_lot, admin_client):
+    make_lot('Southgate', pincode='600001')
+    make_lot('Northgate', pincode='900001')
+    admin_client.get('/api/v1/lots')
+    with count_statements(app) as statements:
+        response = admin_client.get('/api/v1/lots')
+    reported = re.search(r'desc="(\d+) queries"', response.headers['Server-Timing'])
+    assert int(reported.group(1)) == len(statements) >= 2
+
+
+@pytest.mark.parametrize('descending', [False, True], ids=['ascending', 'descending'])
+def test_vehicle_search_pages_through_every_shard(app, parking, monkeypatch, make_lot, make_user, login,
+                                                  admin_client, descending):
+    south_id, north_id = make_lot('Southgate', pincode='600001'), make_lot('Northgate', pincode='900001')
+    names = [f'driver{n:02d}' for n in range(9)]
+    for n, name in enumerate(names):
+        client = login(make_user(name))
+        park(client, north_id if n % 2 else south_id, [f'KA01{n:04d}'], release=False)
+        if n == 0:
+            park(client, north_id, ['KA01N000'])  # Found on both shards, listed once
+    make_user('walker')
+    # Small enough that both the id chunks and the pages are exercised
+    monkeypatch.setattr(parking, 'VEHICLE_SEARCH_CHUNK', 2)
+    monkeypatch.setattr(parking, 'PER_PAGE', 4)
+
+    listed, url = [], f'/admin/users?q=KA01&field=vehicle&sort=username&dir={"desc" if descending else "asc"}'
+    while url:
+        page = admin_client.get(url).get_data(as_text=True)
+        listed += re.findall(r'<strong>(\w+)</strong>', page)
+        url = next((html.unescape(link) for link in re.findall(r'href="([^"]*after=[^"]*)"', page)), None)
+    assert listed == sorted(names, reverse=descending)
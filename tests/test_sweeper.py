@@ -0,0 +1,91 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, ParkingLot, ParkingSpot, Payment, Reservation
+from shards import shard_for_id, use_shard
+from sweeper import MAX_CHARGE_HOURS, sweep_expired_reservations
+from test_query_counts import park
+
+
+@pytest.fixture
+def driver(make_user, login):
+    return login(make_user('driver'))
+
+
+def expire(app, lot_id, vehicles):
+    """Move the vehicles' reservations back to before the sweep's timeout"""
+    with app.app_context(), use_shard(shard_for_id(lot_id)):
+        db.session.query(Reservation).filter(Reservation.vehicle_number.in_(vehicles)) \
+            .update({'parking_timestamp': datetime.now() - timedelta(hours=25)})
+        db.session.commit()
+
+
+@pytest.mark.parametrize('pincode', ['600001', '900001'], ids=['default database', 'shard'])
+def test_expired_reservation_is_released_once(app, make_lot, driver, pincode):
+    lot_id = make_lot('Harbour', capacity=5, pincode=pincode, price=20)
+    park(driver, lot_id, ['TN01AB0001', 'TN01AB0002'], release=False)
+    expire(app, lot_id, ['TN01AB0001'])
+
+    with app.app_context():
+        assert sweep_expired_reservations() == 1
+        assert sweep_expired_reservations() == 0
+        with use_shard(shard_for_id(lot_id)):
+            expired = Reservation.query.filter_by(vehicle_number='TN01AB0001').one()
+            assert expired.payment_status == 'Paid'
+            assert [(p.amount, p.payment_method) for p in Payment.query.filter_by(
+                reservation_id=expired.reservation_id)] == [(20 * MAX_CHARGE_HOURS, 'Auto-charge')]
+            assert db.session.get(ParkingSpot, expired.spot_id).status == 'A'
+            assert Reservation.query.filter_by(vehicle_number='TN01AB0002').one().payment_status == 'Pending'
+
+            lot = db.session.get(ParkingLot, lot_id)
+            assert (lot.available_count, lot.occupied_count) == (4, 1)
+            assert ParkingLot.rebuild_counts(fix=False) == []
+
+
+def test_sweep_does_not_charge_a_reservation_twice(app, make_lot, driver):
+    lot_id = make_lot('Harbour', capacity=5)
+    park(driver, lot_id, ['TN01AB0001'], release=False)
+    expire(app, lot_id, ['TN01AB0001'])
+    with app.app_context():
+        # Charged by a sweep whose claim has not been seen yet
+        reservation = Reservation.query.one()
+        db.session.add(Payment(reservation_id=reservation.reservation_id, amount=480, payment_method='Auto-charge',
+                               payment_status='Completed', payment_timestamp=datetime.now()))
+        db.session.commit()
+
+        assert sweep_expired_reservations() == 1
+        assert Payment.query.count() == 1
+        assert Reservation.query.one().payment_status == 'Paid'
+
+
+def test_overlapping_sweeps_close_each_reservation_once(app, make_lot, make_user, login):
+    vehicles = [f'TN01AB{n:04d}' for n in range(30)]
+    lot_id = make_lot('Harbour', capacity=40)
+    for n in range(0, len(vehicles), 10):
+        park(login(make_user(f'driver{n}')), lot_id, vehicles[n:n + 10], release=False)
+    expire(app, lot_id, vehicles)
+
+    start, closed = threading.Barrier(2), []
+
+    def sweep():
+        start.wait()
+        with app.app_context():
+            closed.append(sweep_expired_reservations(batch_size=4))
+            db.session.remove()
+
+    sweepers = [threading.Thread(target=sweep) for _ in range(2)]
+    for sweeper in sweepers:
+        sweeper.start()
+    for sweeper in sweepers:
+        sweeper.join()
+
+    assert sum(closed) == len(vehicles)
+    with app.app_context():
+        assert db.session.query(Payment.reservation_id).group_by(Payment.reservation_id) \
+            .having(db.func.count() > 1).count() == 0
+        assert Payment.query.count() == len(vehicles)
+        lot = db.session.get(ParkingLot, lot_id)
+        assert (lot.available_count, lot.occupied_count) == (40, 0)
+        assert ParkingLot.rebuild_counts(fix=False) == []
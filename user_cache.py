@@ -0,0 +1,93 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User_Admin
+
+# Copied into the cache; enough to rebuild the user without a query
+USER_FIELDS = ('id', 'username', 'email', 'password_hash', 'role')
+
+
+class UserCache:
+    """Per-process cache of the users that Flask-Login loads on every request.
+
+    Entries are plain column snapshots, rebuilt into a User_Admin and merged
+    into the request's session without a SELECT. Updating or deleting a user
+    through the ORM drops its entry in this process; other worker processes
+    see the change once their copy's TTL runs out.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # user_id -> (expires_at, fields)
+        self._lock = threading.Lock()
+
+    def load(self, user_id):
+        """The user with user_id, attached to the current session, or None"""
+        if self.ttl <= 0:
+            return db.session.get(User_Admin, user_id)
+
+        user = self.lookup(user_id)
+        if user is not None:
+            return db.session.merge(user, load=False)
+
+        user = db.session.get(User_Admin, user_id)
+        self.store(user)
+        return user
+
+    def lookup(self, user_id):
+        """A detached copy of the cached user, or None if it is not cached or has expired"""
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if not entry or entry[0] <= time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            fields = entry[1]
+        user = User_Admin(**fields)
+        make_transient_to_detached(user)
+        return user
+
+    def store(self, user):
+        """Cache a user just loaded from the database"""
+        if self.ttl <= 0 or user is None:
+            return
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[user.id] = (time.monotonic() + self.ttl,
+                                      {name: getattr(user, name) for name in USER_FIELDS})
+
+    def invalidate(self, user_id=None):
+        """Forget one user, or every user when user_id is None"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'ttl': self.ttl,
+            }
+
+    def watch_changes(self):
+        """Invalidate a user's entry whenever the ORM updates or deletes the row"""
+        def forget(mapper, connection, target):
+            self.invalidate(target.id)
+        event.listen(User_Admin, 'after_update', forget)
+        event.listen(User_Admin, 'after_delete', forget)
+        return self